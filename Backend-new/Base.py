@@ -2,76 +2,237 @@ from marker.converters.pdf import PdfConverter
 from marker.models import create_model_dict
 from marker.output import text_from_rendered
 from pathlib import Path
-from io import BytesIO # Used to save the Pillow Image object as binary data
+import gc
+import os
+import resource
+import threading
+import time
 import sys # Added to read command-line arguments
+import metrics # Stage timings, exported on the server's /metrics
+import image_store # Single-blob image handoff to Image-Testo.py
 
-# Get PDF filename from the command-line argument
-if len(sys.argv) < 2:
-    print("Error: No PDF file path provided.")
-    print("Usage: python Base.py <path_to_pdf_file>")
-    sys.exit(1)
-    
-pdf_filename = sys.argv[1] # e.g., "pdf/2501.17887v1.pdf"
-
-# creating output dir with same name as the PDF stem
-# e.g., "pdf/2501.17887v1.pdf" -> "2501.17887v1"
-output_dir_name = Path(pdf_filename).stem 
-
-# 1. Setup Converter and Process PDF
-print(f"Initializing Marker converter for: {pdf_filename}")
-converter = PdfConverter(
-    artifact_dict=create_model_dict(),
-)
-rendered = converter(pdf_filename)
-
-# 2. Extract Text, Metadata, and Images
-print("Extracting text and images...")
-text, _, images = text_from_rendered(rendered)
-
-# 3. Create an output directory for the MD file and images
-# This will create a directory in the same folder where the script is run
-output_dir = Path(output_dir_name)
-output_dir.mkdir(exist_ok=True)
-print(f"Created output directory: {output_dir}")
-
-# 4. Save the Markdown text file
-md_filename = output_dir / f"{output_dir_name}.md"
-
-try:
-    with open(md_filename, "w", encoding="utf-8") as f:
-        f.write(text)
-    print(f"Successfully saved Markdown text to {md_filename}")
-except Exception as e:
-    print(f"An error occurred while writing the MD file: {e}")
-
-# 5. Save the image files
-print(f"\nSaving {len(images)} images...")
-for filename, image_object in images.items():
-    image_path = output_dir / filename
-    
-    byte_io = BytesIO()
-    
+# --- 1. Configuration ---
+
+# Opt-in: PDFs longer than this are converted in windows of this many pages.
+# Each window's Markdown and images are written out before the next one is
+# rendered, so memory no longer grows with the document. Windows cost some
+# conversion quality at their edges (a table or paragraph split across two
+# windows), so the default is 0: the whole PDF in one pass.
+WINDOW_PAGES = int(os.getenv("BASE_WINDOW_PAGES", 0))
+# Optional peak-RSS budget in MB; setting it turns windowing on. After each
+# window the pages that still fit under it are estimated from the window's
+# memory growth, and the next window is sized accordingly (never above
+# WINDOW_PAGES, if set). A window that goes over the budget anyway switches
+# the rest of the PDF to one-page windows; if a single page goes over, the
+# conversion is aborted with RssBudgetExceeded. 0 = no budget.
+RSS_BUDGET_MB = float(os.getenv("BASE_RSS_BUDGET_MB", 0))
+# Only plan to use this share of the remaining headroom (estimates are rough)
+RSS_BUDGET_SAFETY = 0.8
+# With a budget, the first window is this small, to measure the memory a page needs
+RSS_PROBE_PAGES = 4
+RSS_SAMPLE_INTERVAL = 0.05  # seconds
+
+
+class RssBudgetExceeded(RuntimeError):
+    """Raised when converting a single page needs more memory than BASE_RSS_BUDGET_MB."""
+
+
+def current_rss() -> int:
+    """Resident set size of this process in bytes (Linux; 0 where /proc is unavailable)."""
     try:
-        # Determine image format from suffix (e.g., .jpeg, .png)
-        img_format = image_path.suffix.lstrip('.').upper()
-        if img_format == 'JPEG':
-            img_format = 'JPEG'
-        elif img_format == 'JPG':
-            img_format = 'JPEG'
-        elif img_format == 'PNG':
-            img_format = 'PNG'
-        else:
-            print(f"Warning: Unknown image format '{img_format}' for {filename}. Defaulting to PNG.")
-            img_format = 'PNG'
-            image_path = image_path.with_suffix('.png')
-
-        image_object.save(byte_io, format=img_format)
-        image_data = byte_io.getvalue()
-        
-        with open(image_path, "wb") as f:
-            f.write(image_data)
-        
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return 0
+
+
+def max_rss() -> int:
+    """Highest RSS this process has ever had, in bytes (ru_maxrss is in KB on Linux)."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssMonitor:
+    """
+    Peak RSS of a block of code: sampled in a background thread, and exact
+    whenever the block raised the process's all-time peak (ru_maxrss).
+    """
+
+    def __init__(self, interval: float = RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.start_rss = self.peak = current_rss()
+        self._start_max = max_rss()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+        if max_rss() > self._start_max:
+            self.peak = max(self.peak, max_rss())
+
+
+def page_count(pdf_filename):
+    """Number of pages, or None if it can't be read (then the PDF is converted in one go)."""
+    try:
+        import pypdfium2  # Installed with marker
+        document = pypdfium2.PdfDocument(str(pdf_filename))
+        try:
+            return len(document)
+        finally:
+            document.close()
     except Exception as e:
-        print(f"An error occurred while writing image {filename} (format: {img_format}): {e}")
+        print(f"Could not count the pages of {pdf_filename}: {e}")
+        return None
+
+
+def next_window_size(per_page: float, budget_bytes: float, max_pages: int) -> int:
+    """
+    Pages for the next window so that its peak stays under the budget: the
+    headroom left above the current RSS divided by the memory a page needs.
+    """
+    headroom = (budget_bytes - current_rss()) * RSS_BUDGET_SAFETY
+    return max(1, min(max_pages, int(headroom / per_page)))
+
+
+def load_converter():
+    """Loads the marker models. Slow, so bulk_ingest.py does it once per worker."""
+    with metrics.span("ingest", "marker_model_load"):
+        return PdfConverter(
+            artifact_dict=create_model_dict(),
+        )
+
+
+def convert_window(converter, pdf_filename, pages=None):
+    """Renders the given pages (0-based indexes; None = all) and returns (markdown, images)."""
+    # marker reads page_range from the converter's config for every document it builds
+    config = dict(converter.config or {})
+    if pages is None:
+        config.pop("page_range", None)
+    else:
+        config["page_range"] = list(pages)
+    converter.config = config
+
+    with metrics.span("ingest", "marker_conversion"):
+        rendered = converter(str(pdf_filename))
+    with metrics.span("ingest", "marker_extraction"):
+        text, _, images = text_from_rendered(rendered)
+    return text, images
+
+
+def convert_pdf(converter, pdf_filename, output_root=".", window_pages=WINDOW_PAGES, rss_budget_mb=RSS_BUDGET_MB,
+                output_dir=None):
+    """
+    Converts one PDF into <output_dir>/<name of output_dir>.md plus the image
+    blob; output_dir defaults to <output_root>/<stem>.
+    Long PDFs are converted window by window (see WINDOW_PAGES and
+    RSS_BUDGET_MB): each window's Markdown is appended to the file and its
+    images to the blob, then the window's objects are released. Returns the
+    output directory; raises RssBudgetExceeded if one page is over the budget.
+    """
+    # creating output dir with same name as the PDF stem, unless one is given
+    # (the pipeline passes one named after the collection)
+    # e.g., "pdf/2501.17887v1.pdf" -> "2501.17887v1"
+    output_dir = Path(output_dir) if output_dir is not None else Path(output_root) / Path(pdf_filename).stem
+    output_dir_name = output_dir.name
+
+    trace = metrics.start_trace("ingest:Base.py", document=str(pdf_filename))
+
+    # 1. Create an output directory for the MD file and images
+    # By default this is a directory in the same folder where the script is run
+    output_dir.mkdir(parents=True, exist_ok=True)
+    print(f"Created output directory: {output_dir}")
+    md_filename = output_dir / f"{output_dir_name}.md"
+
+    budget = rss_budget_mb * 1024 * 1024
+    total_pages = page_count(pdf_filename) if window_pages or budget else None
+    if budget and total_pages is not None:
+        # The budget alone turns windowing on: windows are then sized by it
+        window_pages = min(window_pages or total_pages, total_pages)
+        windowed = total_pages > 1
+    else:
+        windowed = total_pages is not None and total_pages > window_pages
+    size = (min(window_pages, RSS_PROBE_PAGES) if budget else window_pages) if windowed else total_pages
+    if windowed:
+        print(f"Converting {total_pages} pages in windows of up to {window_pages}"
+              + (f" (RSS budget {rss_budget_mb:.0f} MB)" if budget else ""))
+
+    # 2. Convert, writing the Markdown and images of each window as it is done.
+    # Each image is prepared once for the VLM (decorative ones skipped, large ones
+    # downscaled, all re-encoded as JPEG) and appended to a single blob file with
+    # an offset index, instead of one file per image.
+    print(f"Converting with Marker: {pdf_filename}")
+    save_seconds = 0.0
+    peak_rss = current_rss()
+    per_page = 1  # Highest memory growth per page seen so far (bytes); the conservative estimate
+    with open(md_filename, "w", encoding="utf-8") as md_file, image_store.ImageBlobWriter(output_dir) as blob:
+        start = 0
+        while True:
+            end = min(total_pages, start + size) if windowed else None
+            with RssMonitor() as monitor:
+                text, images = convert_window(converter, pdf_filename, range(start, end) if windowed else None)
+
+                if md_file.tell():
+                    md_file.write("\n\n")
+                md_file.write(text)
+
+                save_start = time.perf_counter()
+                for filename, image_object in images.items():
+                    try:
+                        if not blob.add(filename, image_object):
+                            print(f"Skipping decorative image {filename} ({image_object.size[0]}x{image_object.size[1]})")
+                    except Exception as e:
+                        print(f"An error occurred while preparing image {filename}: {e}")
+                save_seconds += time.perf_counter() - save_start
+                # Release this window's pages and images before rendering the next one
+                del text, images
+                gc.collect()
+
+            peak_rss = max(peak_rss, monitor.peak)
+            if not windowed:
+                break
+            print(f"Pages {start + 1}-{end} of {total_pages} done (peak RSS {monitor.peak / 1e6:.0f} MB)")
+            if budget and monitor.peak > budget:
+                if end - start == 1:
+                    raise RssBudgetExceeded(
+                        f"Page {end} needed a peak RSS of {monitor.peak / 1e6:.0f} MB, "
+                        f"over the {rss_budget_mb:.0f} MB budget (BASE_RSS_BUDGET_MB)"
+                    )
+                print(f"Peak RSS {monitor.peak / 1e6:.0f} MB exceeded the {rss_budget_mb:.0f} MB budget; "
+                      f"converting the rest one page at a time")
+                window_pages = 1
+            if end >= total_pages:
+                break
+            if budget:
+                per_page = max(per_page, (monitor.peak - monitor.start_rss) / (end - start))
+                size = next_window_size(per_page, budget, window_pages)
+            start = end
+
+    print(f"Successfully saved Markdown text to {md_filename}")
+    metrics.record_stage("ingest", "image_save", save_seconds, images=blob.kept)
+    print(f"Stored {blob.kept} images ({blob.bytes_written / 1e6:.2f} MB), skipped {blob.skipped}, for {output_dir_name}.")
+    print(f"Peak RSS: {peak_rss / 1e6:.0f} MB")
+    metrics.finish_trace(trace, peak_rss_bytes=peak_rss, pages=total_pages)
+    return output_dir
+
+
+if __name__ == "__main__":
+    # Get PDF filename from the command-line argument
+    if len(sys.argv) < 2:
+        print("Error: No PDF file path provided.")
+        print("Usage: python Base.py <path_to_pdf_file> [output_dir]")
+        sys.exit(1)
+
+    pdf_filename = sys.argv[1] # e.g., "pdf/2501.17887v1.pdf"
+    output_dir = sys.argv[2] if len(sys.argv) > 2 else None
 
-print(f"Image saving complete for {output_dir_name}.")
\ No newline at end of file
+    print(f"Initializing Marker converter for: {pdf_filename}")
+    convert_pdf(load_converter(), pdf_filename, output_dir=output_dir)
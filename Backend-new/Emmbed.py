@@ -1,27 +1,22 @@
 import chromadb
 from sentence_transformers import SentenceTransformer
-from langchain_community.document_loaders import UnstructuredMarkdownLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 import uuid
 import time
 import sys
 import torch
+import job_registry
+import metrics # Stage timings, exported on the server's /metrics
+import md_chunker # Structure-aware chunking (sections, tables, image descriptions)
+import section_index # Section centroids for coarse-to-fine retrieval in large documents
 
-# --- 1. Configuration (now from command-line) ---
+# --- 1. Configuration ---
 
-if len(sys.argv) < 3:
-    print("Error: Missing arguments.")
-    print("Usage: python Emmbed.py <path_to_markdown_file> <collection_name>")
-    sys.exit(1)
-
-# Data Configuration
-MARKDOWN_FILE = sys.argv[1] # The path to your markdown file
-CHUNK_SIZE = 512
-CHUNK_OVERLAP = 50
+# Chunk size in tokens of the embedding model (see md_chunker.py)
+CHUNK_MAX_TOKENS = md_chunker.MAX_TOKENS
+CHUNK_MIN_TOKENS = md_chunker.MIN_TOKENS
 
 # ChromaDB Configuration
 CHROMA_PATH = "./chroma_db"  # Directory to store the persistent database
-COLLECTION_NAME = sys.argv[2] # A dynamic collection name (e.g., the file stem)
 
 # Embedding Model Configuration
 MODEL_NAME = "BAAI/bge-large-en-v1.5"
@@ -29,88 +24,136 @@ MODEL_NAME = "BAAI/bge-large-en-v1.5"
 
 
 # --- 2. Load Embedding Model ---
-print(f"Loading embedding model: {MODEL_NAME}...")
-# Use 'cuda' if you have a GPU, otherwise 'cpu'
-model = SentenceTransformer(MODEL_NAME, device= "cuda" if torch.cuda.is_available() else "cpu")
-print("Model loaded.")
-
-# --- 3. Load, Chunk, and Prepare Document ---
-print(f"Loading and splitting document: {MARKDOWN_FILE}...")
-loader = UnstructuredMarkdownLoader(MARKDOWN_FILE)
-text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=CHUNK_SIZE,
-    chunk_overlap=CHUNK_OVERLAP
-)
-
-# Load and split the document into chunks
-docs = loader.load_and_split(text_splitter=text_splitter)
-print(f"Document split into {len(docs)} chunks.")
-
-# Prepare data for Chroma
-# We need a list of texts, a list of metadatas, and a list of unique IDs
-texts = [doc.page_content for doc in docs]
-metadatas = [doc.metadata for doc in docs]
-ids = [str(uuid.uuid4()) for _ in texts] # Generate unique IDs for each chunk
-
-# --- 4. Generate Embeddings ---
-print("Generating embeddings for all chunks...")
-start_time = time.time()
-embeddings = model.encode(
-    texts,
-    normalize_embeddings=True,  # Normalize for BGE, crucial for cosine similarity
-    show_progress_bar=True
-)
-end_time = time.time()
-print(f"Embeddings generated in {end_time - start_time:.2f} seconds.")
-
-# --- 5. Initialize ChromaDB and Store Data ---
-print(f"Initializing ChromaDB at: {CHROMA_PATH}")
-# Create a persistent client. Data will be saved to disk
-client = chromadb.PersistentClient(path=CHROMA_PATH)
-
-# Get or create the collection
-collection = client.get_or_create_collection(name=COLLECTION_NAME)
-
-print(f"Adding {len(texts)} chunks to the '{COLLECTION_NAME}' collection...")
-# Add the data to Chroma in a batch
-# Note: ChromaDB takes 'documents', not 'texts'
-collection.add(
-    embeddings=embeddings,
-    documents=texts,
-    metadatas=metadatas,
-    ids=ids
-)
-
-print("Data insertion complete.")
-
-# --- 6. Test Query (Optional) ---
-# This part will still run to verify the insertion
-print("\n--- Verification Search ---")
-query_text = "What is a vector database?"
-print(f"Query: '{query_text}'")
-
-# Embed the query
-# **Must** use the same model and normalization
-query_vector = model.encode(
-    query_text,
-    normalize_embeddings=True
-).tolist()  # Convert to list for Chroma
-
-# Perform the search
-# query_embeddings expects a list of embeddings
-search_results = collection.query(
-    query_embeddings=[query_vector],
-    n_results=2  # Number of results to return
-)
-
-# Print results
-print("Search Results:")
-if search_results['documents']:
-    for i, (doc, dist) in enumerate(zip(search_results['documents'][0], search_results['distances'][0])):
-        print(f"\nResult {i+1}:")
-        print(f"  Distance: {dist:.4f}")
-        print(f"  Text: {doc[:150]}...")
-else:
-    print("No results found for verification query.")
-
-print(f"\nDone processing for collection: {COLLECTION_NAME}.")
\ No newline at end of file
+def load_model():
+    """Loads the embedding model. Slow, so bulk_ingest.py does it once per worker."""
+    print(f"Loading embedding model: {MODEL_NAME}...")
+    # Use 'cuda' if you have a GPU, otherwise 'cpu'
+    with metrics.span("ingest", "embedding_model_load"):
+        model = SentenceTransformer(MODEL_NAME, device= "cuda" if torch.cuda.is_available() else "cpu")
+    print("Model loaded.")
+    return model
+
+
+def embed_markdown(model, client, markdown_file, collection_name):
+    """Chunks a Markdown file, embeds the chunks and adds them to the collection. Returns the collection."""
+    trace = metrics.start_trace("ingest:Emmbed.py", document=str(markdown_file), collection=collection_name)
+
+    # --- 3. Load, Chunk, and Prepare Document ---
+    print(f"Loading and splitting document: {markdown_file}...")
+
+    # Split along sections; each chunk carries its heading path and pages
+    with metrics.span("ingest", "chunking"):
+        docs = list(md_chunker.chunk_markdown_file(
+            markdown_file,
+            max_tokens=CHUNK_MAX_TOKENS,
+            min_tokens=CHUNK_MIN_TOKENS,
+            count_tokens=md_chunker.tokenizer_counter(model.tokenizer),
+        ))
+    print(f"Document split into {len(docs)} chunks.")
+
+    # Prepare data for Chroma
+    # We need a list of texts, a list of metadatas, and a list of unique IDs
+    texts = [doc.text for doc in docs]
+    metadatas = [doc.metadata for doc in docs]
+    ids = [str(uuid.uuid4()) for _ in texts] # Generate unique IDs for each chunk
+    # Large documents: tag every chunk with its section (see section_index.py)
+    sections = section_index.assign_sections(metadatas)
+
+    # --- 4. Generate Embeddings ---
+    print("Generating embeddings for all chunks...")
+    start_time = time.time()
+    embeddings = model.encode(
+        texts,
+        normalize_embeddings=True,  # Normalize for BGE, crucial for cosine similarity
+        show_progress_bar=True
+    )
+    end_time = time.time()
+    print(f"Embeddings generated in {end_time - start_time:.2f} seconds.")
+    metrics.record_stage("ingest", "embedding", end_time - start_time, chunks=len(texts))
+
+    # --- 5. Store Data in ChromaDB ---
+    # Re-ingesting a document replaces its chunks instead of adding a second
+    # copy. The new chunks are added before the old ones are deleted, so
+    # queries never find the collection missing, and a failed add leaves the
+    # previous version in place.
+    collection = client.get_or_create_collection(name=collection_name)
+    stale_ids = collection.get(include=[])["ids"]
+
+    print(f"Adding {len(texts)} chunks to the '{collection_name}' collection...")
+    # Add the data to Chroma in a batch
+    # Note: ChromaDB takes 'documents', not 'texts'
+    with metrics.span("ingest", "upsert"):
+        try:
+            collection.add(
+                embeddings=embeddings,
+                documents=texts,
+                metadatas=metadatas,
+                ids=ids
+            )
+        except Exception:
+            collection.delete(ids=ids)  # Don't leave part of the new version next to the old one
+            raise
+
+    print("Data insertion complete.")
+    # The section index and the collection metadata (which tells the server to
+    # search through it) switch to the new chunks before the old ones go away
+    section_index.build_section_index(client, collection_name, ids, embeddings, metadatas)
+    collection.modify(metadata={"sections": sections})
+    if stale_ids:
+        print(f"Removing {len(stale_ids)} chunks of the previous version of '{collection_name}'.")
+        collection.delete(ids=stale_ids)
+
+    # Invalidate cached retrieval results for this collection in every server worker
+    new_version = job_registry.bump_collection_version(collection_name)
+    print(f"Collection '{collection_name}' is now at version {new_version}.")
+    metrics.finish_trace(trace)
+    return collection
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Error: Missing arguments.")
+        print("Usage: python Emmbed.py <path_to_markdown_file> <collection_name>")
+        sys.exit(1)
+
+    MARKDOWN_FILE = sys.argv[1] # The path to your markdown file
+    COLLECTION_NAME = sys.argv[2] # A dynamic collection name (e.g., the file stem)
+
+    model = load_model()
+
+    print(f"Initializing ChromaDB at: {CHROMA_PATH}")
+    # Create a persistent client. Data will be saved to disk
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    collection = embed_markdown(model, client, MARKDOWN_FILE, COLLECTION_NAME)
+
+    # --- 6. Test Query (Optional) ---
+    # This part will still run to verify the insertion
+    print("\n--- Verification Search ---")
+    query_text = "What is a vector database?"
+    print(f"Query: '{query_text}'")
+
+    # Embed the query
+    # **Must** use the same model and normalization
+    query_vector = model.encode(
+        query_text,
+        normalize_embeddings=True
+    ).tolist()  # Convert to list for Chroma
+
+    # Perform the search
+    # query_embeddings expects a list of embeddings
+    search_results = collection.query(
+        query_embeddings=[query_vector],
+        n_results=2  # Number of results to return
+    )
+
+    # Print results
+    print("Search Results:")
+    if search_results['documents']:
+        for i, (doc, dist) in enumerate(zip(search_results['documents'][0], search_results['distances'][0])):
+            print(f"\nResult {i+1}:")
+            print(f"  Distance: {dist:.4f}")
+            print(f"  Text: {doc[:150]}...")
+    else:
+        print("No results found for verification query.")
+
+    print(f"\nDone processing for collection: {COLLECTION_NAME}.")
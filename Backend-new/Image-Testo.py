@@ -2,6 +2,9 @@ import re
 from ollama import chat, ChatResponse
 import os
 import sys # Added to read command-line arguments
+import metrics # Stage timings, exported on the server's /metrics
+import image_store # Images prepared by Base.py, read from one memory-mapped blob
+import scheduler # Fair share of the remote model with chat and other documents
 
 # --- Configuration (now from command-line) ---
 if len(sys.argv) < 4:
@@ -14,10 +17,21 @@ IMAGE_DIRECTORY = sys.argv[2] # The directory where images are stored
 OUTPUT_FILE = sys.argv[3]     # The file to save the result
 # -----------------------------------------------
 
+metrics.describe("rag_vlm_errors_total", "Image descriptions that failed.")
+metrics.describe("rag_vlm_image_bytes_total", "Encoded image bytes sent to the VLM.")
+metrics.describe("rag_images_skipped_total", "Decorative images skipped without a VLM call.")
+
+# The document whose share of the model these calls use (set by ingest_pipeline.run_stage)
+TENANT = os.getenv("RAG_TENANT") or os.path.splitext(os.path.basename(README_FILE))[0]
+
 MODEL_NAME = 'qwen3-vl:235b-cloud' 
 PROMPT = 'Describe the content of this image concisely and precisely, focusing on any numerical data present. If no numerical data is present, simply describe the image.'
 # ---------------------
 
+# Base.py stores the prepared images in one blob; older output dirs have one file per image
+image_blob = image_store.ImageBlobReader.open_if_present(IMAGE_DIRECTORY)
+
+
 def get_image_description(image_filename: str) -> str:
     """
     Calls the Ollama LMM to get a description for the given image file.
@@ -29,24 +43,38 @@ def get_image_description(image_filename: str) -> str:
     # Construct the full path by joining the directory and the filename
     image_path = os.path.join(IMAGE_DIRECTORY, image_filename)
 
-    # Check if the image file actually exists before calling the model
-    if not os.path.exists(image_path):
+    if image_blob is not None:
+        if image_filename in image_blob.skipped:
+            # Decorative image (icon, rule, ...): nothing worth describing
+            metrics.inc("rag_images_skipped_total")
+            return ""
+        # Already downscaled and JPEG-encoded; sent as bytes without touching the disk again
+        image = image_blob.get(image_filename)
+        if image is None:
+            print(f"Warning: Image '{image_filename}' not in the image blob. Returning placeholder.")
+            return f"[[Image Missing: {image_path}]]"
+        metrics.inc("rag_vlm_image_bytes_total", len(image))
+    elif os.path.exists(image_path):
+        image = image_path
+    else:
         print(f"Warning: Image file not found at '{image_path}'. Returning placeholder.")
         return f"[[Image Missing: {image_path}]]"
 
     print(f"-> Sending image '{image_path}' to model...")
     try:
-        response: ChatResponse = chat(
-            model=MODEL_NAME, 
-            messages=[
-                {
-                    'role': 'user',
-                    'content': PROMPT,
-                    'images': [image_path]
-                },
-            ],
-            stream=False 
-        )
+        # Waits behind chat questions and takes turns with other documents
+        with scheduler.slot(TENANT, priority="ingest"), metrics.span("ingest", "vlm_call", image=image_filename):
+            response: ChatResponse = chat(
+                model=MODEL_NAME, 
+                messages=[
+                    {
+                        'role': 'user',
+                        'content': PROMPT,
+                        'images': [image]
+                    },
+                ],
+                stream=False 
+            )
         
         # Access the content field
         content = response.message.content.strip()
@@ -57,6 +85,7 @@ def get_image_description(image_filename: str) -> str:
 
     except Exception as e:
         print(f"Error calling Ollama for {image_path}: {e}")
+        metrics.inc("rag_vlm_errors_total")
         return f"[[ERROR: Could not get description for {image_path}]]"
 
 
@@ -101,4 +130,5 @@ def replace_images_in_readme(input_file: str, output_file: str):
 
 # --- Run the script ---
 if __name__ == "__main__":
-    replace_images_in_readme(README_FILE, OUTPUT_FILE)
\ No newline at end of file
+    with metrics.trace("ingest:Image-Testo.py", document=README_FILE):
+        replace_images_in_readme(README_FILE, OUTPUT_FILE)
\ No newline at end of file
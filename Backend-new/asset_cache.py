@@ -0,0 +1,148 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+import threading
+import time
+from pathlib import Path
+
+from starlette.responses import Response
+
+try:
+    import brotli
+except ImportError:  # Optional: without it only gzip variants are served
+    brotli = None
+
+# --- In-memory frontend asset cache ---
+# The HTML pages and /static files are read once, kept in memory together
+# with precompressed gzip (and brotli, if installed) variants, and served
+# with strong ETags. A request whose If-None-Match matches gets an empty
+# 304. Files are re-checked at most every ASSET_CHECK_INTERVAL seconds
+# and reloaded when their mtime or size changed, so frontend edits show
+# up without a restart.
+
+# --- 1. Configuration ---
+
+# Cache-Control max-age for /static files (seconds). HTML pages are always revalidated.
+ASSET_MAX_AGE = int(os.getenv("ASSET_MAX_AGE", 300))
+ASSET_CHECK_INTERVAL = float(os.getenv("ASSET_CHECK_INTERVAL", 1.0))
+# Smaller files aren't worth compressing
+MIN_COMPRESS_SIZE = 512
+COMPRESSIBLE_TYPES = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+
+class Asset:
+    """One file: its bytes, compressed variants and validators."""
+
+    def __init__(self, path: Path):
+        stat = path.stat()
+        self.path = path
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.checked_at = time.monotonic()
+        raw = path.read_bytes()
+        self.media_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+        if self.media_type.startswith("text/") or self.media_type == "application/javascript":
+            self.media_type += "; charset=utf-8"
+        tag = hashlib.sha256(raw).hexdigest()[:20]
+
+        # encoding -> (body, strong ETag); each representation has its own ETag
+        self.variants = {"identity": (raw, f'"{tag}"')}
+        if len(raw) >= MIN_COMPRESS_SIZE and self.media_type.startswith(COMPRESSIBLE_TYPES):
+            compressed = gzip.compress(raw, compresslevel=9, mtime=0)
+            if len(compressed) < len(raw):
+                self.variants["gzip"] = (compressed, f'"{tag}-gz"')
+            if brotli is not None:
+                compressed = brotli.compress(raw, quality=11)
+                if len(compressed) < len(raw):
+                    self.variants["br"] = (compressed, f'"{tag}-br"')
+
+    def is_stale(self) -> bool:
+        """Re-stats the file (at most every ASSET_CHECK_INTERVAL) to see if it changed on disk."""
+        now = time.monotonic()
+        if now - self.checked_at < ASSET_CHECK_INTERVAL:
+            return False
+        self.checked_at = now
+        try:
+            stat = self.path.stat()
+        except FileNotFoundError:
+            return True
+        return (stat.st_mtime_ns, stat.st_size) != self.signature
+
+
+def _accepted_encodings(accept_encoding: str) -> set:
+    """Encodings the client accepts (q=0 excluded)."""
+    accepted = set()
+    for item in accept_encoding.split(","):
+        name, _, params = item.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = params.strip()
+        try:
+            if q.startswith("q=") and float(q[2:]) == 0:
+                continue
+        except ValueError:
+            continue  # Malformed quality value
+        accepted.add(name)
+    return accepted
+
+
+class AssetCache:
+    """Serves the files of one directory from memory."""
+
+    def __init__(self, directory: Path):
+        self.directory = Path(directory).resolve()
+        self._assets = {}
+        self._lock = threading.Lock()
+        # Warm the cache at startup so the first request doesn't pay for compression
+        for path in self.directory.iterdir():
+            if path.is_file():
+                self.get(path.name)
+
+    def get(self, name: str):
+        """The cached Asset for a file name relative to the directory, or None if it doesn't exist."""
+        asset = self._assets.get(name)
+        if asset is not None and not asset.is_stale():
+            return asset
+
+        path = (self.directory / name).resolve()
+        # Never serve anything outside the directory (e.g. "../Backend-new/.env")
+        if self.directory not in path.parents or not path.is_file():
+            with self._lock:
+                self._assets.pop(name, None)
+            return None
+        asset = Asset(path)
+        with self._lock:
+            self._assets[name] = asset
+        return asset
+
+    def response(self, name: str, headers, cache_control: str = None, head: bool = False):
+        """
+        The response for a file in the best encoding the client accepts, or
+        304 if If-None-Match holds that encoding's ETag (a cached gzip copy
+        doesn't validate a client that now asks for identity). Returns None
+        if the file doesn't exist.
+        """
+        asset = self.get(name)
+        if asset is None:
+            return None
+        if cache_control is None:
+            cache_control = f"public, max-age={ASSET_MAX_AGE}"
+
+        accepted = _accepted_encodings(headers.get("accept-encoding", ""))
+        encoding = next((e for e in ("br", "gzip") if e in accepted and e in asset.variants), "identity")
+        body, etag = asset.variants[encoding]
+        response_headers = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+
+        if_none_match = headers.get("if-none-match")
+        if if_none_match:
+            tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+            if "*" in tags or etag in tags:
+                return Response(status_code=304, headers=response_headers)
+
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        response = Response(content=b"" if head else body, media_type=asset.media_type, headers=response_headers)
+        if head:
+            response.headers["content-length"] = str(len(body))
+        return response
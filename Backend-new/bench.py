@@ -0,0 +1,779 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import datetime, timezone
+from pathlib import Path
+
+import md_chunker
+from fake_ollama import FakeOllamaConfig, start_fake_ollama
+from load_test import percentile, run_load_test
+
+# --- Benchmark suite for ingestion and chat ---
+# Runs offline: the chat LLM and the image VLM are replaced by fake_ollama.py.
+# Every benchmark prints (and optionally writes) a JSON report, so results
+# can be stored per version and compared with --compare.
+#
+# Usage (from Backend-new/):
+#     python bench.py pdf --pdf pdf/                         # Base.py PDF -> Markdown throughput
+#     python bench.py images --count 50                      # Image-Testo.py against a stub VLM
+#     python bench.py chunk-embed --sections 400             # Emmbed.py chunking + embedding, old vs new chunker
+#     python bench.py chroma --sizes 10000,100000,1000000    # Chroma upsert + query latency
+#     python bench.py chat --concurrency 16 --duration 30    # /chat/ p50/p95/p99 with a stub LLM
+#     python bench.py sections --chunks 100000               # Flat vs section-index retrieval: recall and latency
+#     python bench.py pdf-memory --pages 1000 --budget-mb 6000  # Base.py peak RSS, whole PDF vs page windows
+#     python bench.py all --output results.json --compare baseline.json
+
+BACKEND_DIR = Path(__file__).parent
+EMBEDDING_DIM = 1024  # BAAI/bge-large-en-v1.5
+
+
+# -----------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------
+def latency_summary(seconds: list) -> dict:
+    """p50/p95/p99/mean of a list of durations, in milliseconds."""
+    values = sorted(seconds)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None}
+    return {
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "mean": round(statistics.fmean(values) * 1000, 3),
+    }
+
+
+def environment_info() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "git_commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def synthetic_markdown(sections: int, seed: int = 0) -> str:
+    """
+    Builds a Markdown document shaped like Base.py + Image-Testo.py output:
+    nested headings, prose paragraphs, tables and image-description blockquotes.
+    """
+    rng = random.Random(seed)
+    words = ("retrieval augmented generation vector embedding chunk model latency throughput "
+             "document figure table accuracy baseline dataset training inference result method").split()
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+    parts = ["# Synthetic Benchmark Document\n"]
+    for s in range(sections):
+        page = s // 3 + 1
+        parts.append(f'<span id="page-{page}-{s % 3}"></span>\n')
+        parts.append(f"## {s + 1}. Section {s + 1}\n")
+        for sub in range(rng.randint(1, 3)):
+            parts.append(f"### {s + 1}.{sub + 1} Subsection\n")
+            for _ in range(rng.randint(2, 4)):
+                parts.append(" ".join(sentence() for _ in range(rng.randint(3, 6))) + "\n")
+        if rng.random() < 0.4:
+            parts.append("| Metric | Baseline | Ours |\n|---|---|---|")
+            for row in range(rng.randint(3, 8)):
+                parts.append(f"| metric_{row} | {rng.random():.3f} | {rng.random():.3f} |")
+            parts.append("")
+        if rng.random() < 0.3:
+            parts.append(f"\n> **Image Description:** {sentence()} {sentence()} The chart reports "
+                         f"{rng.randint(10, 99)}% accuracy at {rng.randint(1, 64)} epochs.\n")
+    return "\n".join(parts)
+
+
+def compare_reports(current: dict, baseline: dict, path: str = "") -> dict:
+    """
+    Walks two reports and returns {metric_path: {"baseline", "current", "ratio"}}
+    for every numeric value present in both.
+    """
+    diff = {}
+    for key, value in current.items():
+        if key == "environment" or key not in baseline:
+            continue
+        child = f"{path}.{key}" if path else key
+        if isinstance(value, dict) and isinstance(baseline[key], dict):
+            diff.update(compare_reports(value, baseline[key], child))
+        elif isinstance(value, (int, float)) and isinstance(baseline[key], (int, float)) and baseline[key]:
+            diff[child] = {"baseline": baseline[key], "current": value, "ratio": round(value / baseline[key], 4)}
+    return diff
+
+
+# -----------------------------------------------------------
+# 1. Base.py: PDF -> Markdown
+# -----------------------------------------------------------
+def bench_pdf(pdf_paths: list) -> dict:
+    """Runs Base.py on each PDF (as the pipeline does) and reports docs/hour and pages/sec."""
+    try:
+        import pypdfium2
+    except ImportError:
+        pypdfium2 = None
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for pdf in pdf_paths:
+            pages = len(pypdfium2.PdfDocument(str(pdf))) if pypdfium2 else None
+            start = time.perf_counter()
+            subprocess.run([sys.executable, str(BACKEND_DIR / "Base.py"), str(Path(pdf).resolve())],
+                           cwd=workdir, check=True, capture_output=True, text=True)
+            elapsed = time.perf_counter() - start
+            results.append({"pdf": str(pdf), "pages": pages, "seconds": round(elapsed, 3)})
+            print(f"[pdf] {pdf}: {elapsed:.1f}s", file=sys.stderr)
+
+    total = sum(r["seconds"] for r in results)
+    total_pages = sum(r["pages"] or 0 for r in results)
+    return {
+        "documents": len(results),
+        "total_seconds": round(total, 3),
+        "docs_per_hour": round(len(results) / total * 3600, 2) if total else None,
+        "pages_per_sec": round(total_pages / total, 3) if total and total_pages else None,
+        "per_document": results,
+    }
+
+
+def synthetic_pdf(path, pages: int, scanned: bool = False, seed: int = 0):
+    """
+    Writes a PDF with `pages` pages of text or, with scanned=True, one
+    page-sized grayscale image per page (text-like stripes), without any
+    PDF library.
+    """
+    import zlib
+
+    rng = random.Random(seed)
+    words = "retrieval vector embedding chunk model latency document figure table result method".split()
+    objects = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    pages_id = add(None)  # Filled in once the page objects exist
+    width, height = 612, 792
+    # "Scanned" pages: rows of ink drawn from a small set, so the images compress like real scans
+    ink_rows = [bytes(rng.choice((0, 40, 255, 255, 255)) for _ in range(width)) for _ in range(32)]
+    blank_row = bytes([255]) * width
+
+    kids = []
+    for n in range(pages):
+        resources = f"/Font << /F1 {font} 0 R >>"
+        if scanned:
+            rows = []
+            for y in range(height):
+                rows.append(rng.choice(ink_rows) if 60 < y < height - 60 and (y // 8) % 2 else blank_row)
+            image = zlib.compress(b"".join(rows), 6)
+            image_id = add(f"<< /Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace /DeviceGray "
+                           f"/BitsPerComponent 8 /Filter /FlateDecode /Length {len(image)} >>\nstream\n".encode()
+                           + image + b"\nendstream")
+            resources += f" /XObject << /Im0 {image_id} 0 R >>"
+            content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode()
+        else:
+            lines = [f"Section {n // 10 + 1}.{n % 10 + 1}"]
+            lines += [" ".join(rng.choice(words) for _ in range(12)) for _ in range(45)]
+            content = ("BT /F1 11 Tf 14 TL 72 740 Td " + " ".join(f"({line}) '" for line in lines) + " ET").encode()
+        content_id = add(f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream")
+        kids.append(add(f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {width} {height}] "
+                        f"/Resources << {resources} >> /Contents {content_id} 0 R >>".encode()))
+    objects[pages_id - 1] = (f"<< /Type /Pages /Count {pages} /Kids [" + " ".join(f"{k} 0 R" for k in kids)
+                             + "] >>").encode()
+    catalog = add(f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode())
+
+    with open(path, "wb") as f:
+        f.write(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, 1):
+            offsets.append(f.tell())
+            f.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+        xref = f.tell()
+        f.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+        for offset in offsets:
+            f.write(f"{offset:010d} 00000 n \n".encode())
+        f.write(f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+
+
+def _run_peak_rss(command: list, env: dict, cwd: str):
+    """Runs a command and returns (seconds, peak RSS in bytes) of that process."""
+    start = time.perf_counter()
+    with open(os.path.join(cwd, "output.log"), "ab") as log:
+        process = subprocess.Popen(command, env=env, cwd=cwd, stdout=log, stderr=subprocess.STDOUT)
+        _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"{command[1]} failed with exit code {process.returncode}; see {log.name}")
+    return time.perf_counter() - start, usage.ru_maxrss * 1024  # ru_maxrss is in KB on Linux
+
+
+def bench_pdf_memory(pages: int, scanned: bool, window_pages: int, budget_mb: float) -> dict:
+    """
+    Runs Base.py on a large synthetic PDF twice, converting the whole
+    document at once and in page windows under the RSS budget, and reports
+    the peak RSS of each run. "within_budget" is False if the windowed run
+    went over the budget.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        pdf = os.path.join(workdir, "synthetic.pdf")
+        synthetic_pdf(pdf, pages, scanned)
+        report = {"pages": pages, "scanned": scanned, "pdf_bytes": os.path.getsize(pdf),
+                  "window_pages": window_pages, "rss_budget_mb": budget_mb}
+        runs = {"whole_document": {"BASE_WINDOW_PAGES": "0"},
+                "windowed": {"BASE_WINDOW_PAGES": str(window_pages), "BASE_RSS_BUDGET_MB": str(budget_mb)}}
+        for name, overrides in runs.items():
+            try:
+                seconds, peak = _run_peak_rss([sys.executable, str(BACKEND_DIR / "Base.py"), pdf],
+                                              dict(os.environ, **overrides), workdir)
+                report[name] = {"seconds": round(seconds, 3), "peak_rss_mb": round(peak / 2 ** 20, 1)}
+            except RuntimeError as e:
+                # Typically the whole-document run being OOM-killed
+                report[name] = {"error": str(e)}
+            print(f"[pdf-memory] {name}: {report[name]}", file=sys.stderr)
+        peak = report["windowed"].get("peak_rss_mb")
+        report["within_budget"] = peak is not None and peak <= budget_mb
+    return report
+
+
+# -----------------------------------------------------------
+# 2. Image-Testo.py: image descriptions against a stub VLM
+# -----------------------------------------------------------
+def bench_images(count: int, vlm_latency_ms: float, size: int, decorative: float = 0.2) -> dict:
+    """
+    Describes `count` synthetic images through Image-Testo.py with a fake VLM
+    server, once per handoff: "files" (one full-size file per image, the
+    previous Base.py output) and "blob" (image_store: decorative images
+    skipped, the rest downscaled into one memory-mapped blob).
+    A `decorative` fraction of the images are small icons.
+    """
+    from PIL import Image
+    import image_store
+
+    rng = random.Random(0)
+    images = {}
+    for i in range(count):
+        side = rng.randint(16, 40) if rng.random() < decorative else size
+        images[f"_page_{i // 4}_Figure_{i}.jpeg"] = Image.effect_noise((side, side), 64).convert("RGB")
+
+    server, base_url = start_fake_ollama(config=FakeOllamaConfig(latency_ms=vlm_latency_ms, jitter_ms=0))
+    report = {"images": count, "image_size_px": size, "decorative_fraction": decorative,
+              "stub_vlm_latency_ms": vlm_latency_ms}
+    try:
+        for handoff in ("files", "blob"):
+            with tempfile.TemporaryDirectory() as workdir:
+                workdir = Path(workdir)
+                start = time.perf_counter()
+                if handoff == "files":
+                    for name, image in images.items():
+                        image.save(workdir / name, format="JPEG")
+                    payload_bytes = sum((workdir / name).stat().st_size for name in images)
+                    sent = count
+                else:
+                    with image_store.ImageBlobWriter(workdir) as blob:
+                        for name, image in images.items():
+                            blob.add(name, image)
+                    payload_bytes, sent = blob.bytes_written, blob.kept
+                handoff_seconds = time.perf_counter() - start
+
+                input_md = workdir / "doc.md"
+                input_md.write_text("\n".join(f"Figure {i} text.\n\n![]({name})\n" for i, name in enumerate(images)),
+                                    encoding="utf-8")
+                env = dict(os.environ, OLLAMA_HOST=base_url)
+                start = time.perf_counter()
+                subprocess.run([sys.executable, str(BACKEND_DIR / "Image-Testo.py"), str(input_md), str(workdir),
+                                str(workdir / "out.md")], cwd=workdir, env=env, check=True, capture_output=True, text=True)
+                elapsed = time.perf_counter() - start
+
+            report[handoff] = {
+                "handoff_seconds": round(handoff_seconds, 3),
+                "images_sent_to_vlm": sent,
+                "payload_mb": round(payload_bytes / 1e6, 3),
+                "total_seconds": round(elapsed, 3),
+                "images_per_sec": round(count / elapsed, 3),
+                "overhead_ms_per_image": round((elapsed / count) * 1000 - vlm_latency_ms, 3),
+            }
+    finally:
+        server.shutdown()
+
+    report["payload_reduction"] = round(1 - report["blob"]["payload_mb"] / report["files"]["payload_mb"], 3)
+    report["speedup"] = round(report["files"]["total_seconds"] / report["blob"]["total_seconds"], 2)
+    return report
+
+
+# -----------------------------------------------------------
+# 3. Emmbed.py: chunking + embedding
+# -----------------------------------------------------------
+def _chunk_unstructured(markdown_file):
+    """The previous Emmbed.py chunking: UnstructuredMarkdownLoader + RecursiveCharacterTextSplitter(512, 50)."""
+    from langchain_community.document_loaders import UnstructuredMarkdownLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    loader = UnstructuredMarkdownLoader(str(markdown_file))
+    splitter = RecursiveCharacterTextSplitter(chunk_size=512, chunk_overlap=50)
+    return [doc.page_content for doc in loader.load_and_split(text_splitter=splitter)]
+
+
+def _chunk_structured(markdown_file, count_tokens):
+    """The current Emmbed.py chunking: md_chunker, sized with the embedding model's tokenizer."""
+    return [chunk.text for chunk in md_chunker.chunk_markdown_file(markdown_file, count_tokens=count_tokens)]
+
+
+def bench_chunk_embed(markdown_file, sections: int, model_name: str, chunkers=("unstructured", "structured")) -> dict:
+    """
+    Times chunking and embedding for each chunker on the same document and
+    reports chunk counts and token sizes, so the chunkers can be compared.
+    """
+    from sentence_transformers import SentenceTransformer
+    import torch
+
+    model = SentenceTransformer(model_name, device="cuda" if torch.cuda.is_available() else "cpu")
+    count_tokens = md_chunker.tokenizer_counter(model.tokenizer)
+    report = {"embedding_model": model_name}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        if markdown_file is None:
+            markdown_file = Path(workdir) / "synthetic.md"
+            markdown_file.write_text(synthetic_markdown(sections), encoding="utf-8")
+        size_bytes = Path(markdown_file).stat().st_size
+        report["markdown_bytes"] = size_bytes
+
+        for name in chunkers:
+            start = time.perf_counter()
+            if name == "unstructured":
+                texts = _chunk_unstructured(markdown_file)
+            else:
+                texts = _chunk_structured(markdown_file, count_tokens)
+            chunk_seconds = time.perf_counter() - start
+
+            tokens = [count_tokens(text) for text in texts]
+            start = time.perf_counter()
+            model.encode(texts, normalize_embeddings=True)
+            embed_seconds = time.perf_counter() - start
+
+            report[name] = {
+                "chunks": len(texts),
+                "chunking_seconds": round(chunk_seconds, 3),
+                "chunking_mb_per_sec": round(size_bytes / 1e6 / chunk_seconds, 3),
+                "tokens_mean": round(statistics.fmean(tokens), 1) if tokens else 0,
+                "tokens_max": max(tokens, default=0),
+                # The model truncates input beyond its limit; those tokens are never embedded
+                "chunks_truncated": sum(1 for t in tokens if t > model.max_seq_length),
+                "embedding_seconds": round(embed_seconds, 3),
+                "chunks_per_sec": round(len(texts) / embed_seconds, 2),
+            }
+
+    if "unstructured" in report and "structured" in report:
+        old, new = report["unstructured"], report["structured"]
+        report["chunking_speedup"] = round(old["chunking_seconds"] / new["chunking_seconds"], 2)
+        report["chunk_count_reduction"] = round(1 - new["chunks"] / old["chunks"], 3)
+        report["ingest_speedup"] = round(
+            (old["chunking_seconds"] + old["embedding_seconds"]) / (new["chunking_seconds"] + new["embedding_seconds"]), 2
+        )
+    return report
+
+
+# -----------------------------------------------------------
+# 4. Chroma: upsert + query latency by collection size
+# -----------------------------------------------------------
+def _random_unit_vectors(rng, n: int, dim: int):
+    import numpy as np
+    vectors = rng.standard_normal((n, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def bench_chroma(sizes: list, dim: int, queries: int, k: int, batch: int) -> dict:
+    """Fills a fresh persistent collection up to each size and measures upsert and query latency."""
+    import chromadb
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    report = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        client = chromadb.PersistentClient(path=workdir)
+        for size in sizes:
+            collection = client.create_collection(name=f"bench_{size}")
+            upsert_batches = []
+            for offset in range(0, size, batch):
+                n = min(batch, size - offset)
+                vectors = _random_unit_vectors(rng, n, dim)
+                start = time.perf_counter()
+                collection.upsert(
+                    ids=[f"chunk-{offset + i}" for i in range(n)],
+                    embeddings=vectors,
+                    documents=[f"synthetic chunk {offset + i}" for i in range(n)],
+                    metadatas=[{"page": (offset + i) // 20} for i in range(n)],
+                )
+                upsert_batches.append(time.perf_counter() - start)
+
+            query_latencies = []
+            for query in _random_unit_vectors(rng, queries, dim):
+                start = time.perf_counter()
+                collection.query(query_embeddings=[query.tolist()], n_results=k)
+                query_latencies.append(time.perf_counter() - start)
+
+            upsert_total = sum(upsert_batches)
+            report[str(size)] = {
+                "upsert_seconds": round(upsert_total, 3),
+                "upsert_chunks_per_sec": round(size / upsert_total, 1),
+                "upsert_batch_ms": latency_summary(upsert_batches),
+                "query_ms": latency_summary(query_latencies),
+            }
+            print(f"[chroma] {size}: {report[str(size)]['query_ms']}", file=sys.stderr)
+            client.delete_collection(name=f"bench_{size}")
+    return {"dim": dim, "k": k, "queries": queries, "by_size": report}
+
+
+# -----------------------------------------------------------
+# 5. /chat/ under concurrent load
+# -----------------------------------------------------------
+def _wait_for_server(url: str, timeout: float):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2):
+                return
+        except Exception:
+            time.sleep(1)
+    raise RuntimeError(f"Server at {url} did not become ready within {timeout}s")
+
+
+def _routing_counts(metrics_url: str) -> dict:
+    """Questions per model tier, read from the server's /metrics."""
+    with urllib.request.urlopen(metrics_url, timeout=10) as response:
+        text = response.read().decode("utf-8")
+    counts = {}
+    for line in text.splitlines():
+        if line.startswith(("rag_llm_route_total{", "rag_llm_escalations_total")):
+            name, value = line.rsplit(" ", 1)
+            counts[name] = float(value)
+    return counts
+
+
+def bench_chat(concurrency: int, duration: float, chunks: int, llm_latency_ms: float, port: int,
+               small_llm_latency_ms: float = None) -> dict:
+    """
+    Starts the real FastAPI app against a stub LLM and a synthetic collection,
+    then drives /chat/ with concurrent clients. With small_llm_latency_ms a
+    second stub plays the small local model and tiered routing is enabled.
+    """
+    import chromadb
+    import numpy as np
+
+    llm_server, llm_url = start_fake_ollama(config=FakeOllamaConfig(latency_ms=llm_latency_ms))
+    small_server = None
+    workdir = tempfile.mkdtemp(prefix="rag-bench-chat-")
+    server = None
+    try:
+        # Synthetic collection in the server's working directory
+        client = chromadb.PersistentClient(path=os.path.join(workdir, "chroma_db"))
+        collection = client.create_collection(name="bench_collection")
+        rng = np.random.default_rng(0)
+        for offset in range(0, chunks, 5000):
+            n = min(5000, chunks - offset)
+            collection.add(
+                ids=[f"chunk-{offset + i}" for i in range(n)],
+                embeddings=_random_unit_vectors(rng, n, EMBEDDING_DIM),
+                documents=[synthetic_markdown(1, seed=offset + i)[:500] for i in range(n)],
+            )
+        del client
+
+        env = dict(os.environ, OLLAMA_BASE_URL=llm_url, OLLAMA_API_KEY="bench",
+                   RAG_STATE_DB=os.path.join(workdir, "rag_state.db"),
+                   RAG_METRICS_DIR=os.path.join(workdir, "metrics_data"))
+        if small_llm_latency_ms is not None:
+            small_server, small_url = start_fake_ollama(config=FakeOllamaConfig(latency_ms=small_llm_latency_ms))
+            env.update(SMALL_LLM_MODEL_ID="stub-small", SMALL_LLM_BASE_URL=small_url)
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+             "--port", str(port), "--log-level", "warning"],
+            cwd=workdir, env=env,
+        )
+        _wait_for_server(f"http://127.0.0.1:{port}/metrics", timeout=600)
+
+        questions = ["What is the main result?", "How was the model trained?", "Which dataset is used?",
+                     "What does the table report?", "Summarize the method."]
+        url = f"http://127.0.0.1:{port}/chat/"
+        # Same question every time: retrieval is served from the cache
+        repeated = json.dumps({"message": questions[0], "collection_name": "bench_collection"})
+        # A unique question per request: every request embeds and searches Chroma
+        unique = [json.dumps({"message": f"{questions[i % len(questions)]} (variant {i})",
+                              "collection_name": "bench_collection"}) for i in range(100000)]
+        results = {
+            "repeated_question": run_load_test(url, "POST", repeated, concurrency, duration),
+            "unique_questions": run_load_test(url, "POST", unique, concurrency, duration),
+        }
+        report = {"chunks": chunks, "stub_llm_latency_ms": llm_latency_ms, **results}
+        if small_server is not None:
+            report["stub_small_llm_latency_ms"] = small_llm_latency_ms
+            report["routing"] = _routing_counts(f"http://127.0.0.1:{port}/metrics")
+        return report
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+        llm_server.shutdown()
+        if small_server is not None:
+            small_server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# -----------------------------------------------------------
+# 6. Section index: recall vs latency on a large document
+# -----------------------------------------------------------
+def bench_sections(chunks: int, section_size: int, dim: int, queries: int, k: int, top_ns: list, batch: int) -> dict:
+    """
+    Builds one synthetic document of `chunks` chunks in sections of
+    `section_size` (chunks of a section share a topic vector plus noise),
+    then compares the flat Chroma search with coarse-to-fine search through
+    the section index for several SECTION_TOP_N values. Recall@k is
+    measured against exact brute-force search over all chunks.
+    """
+    import chromadb
+    import numpy as np
+
+    import section_index
+
+    rng = np.random.default_rng(0)
+    sections = max(1, chunks // section_size)
+    topics = _random_unit_vectors(rng, sections, dim)
+    chunk_sections = np.minimum(np.arange(chunks) // section_size, sections - 1)
+    vectors = topics[chunk_sections] + 1.5 * _random_unit_vectors(rng, chunks, dim)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    metadatas = [{"heading_path": f"Chapter {s // 10} > Section {s}", "chunk_index": i}
+                 for i, s in enumerate(chunk_sections.tolist())]
+
+    # Questions about a random chunk, phrased differently (noise)
+    targets = rng.integers(0, chunks, queries)
+    query_vectors = vectors[targets] + _random_unit_vectors(rng, queries, dim)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    truth = [set(np.argsort(-(vectors @ q))[:k].tolist()) for q in query_vectors]
+
+    def measure(search):
+        # Two passes: the second one finds the sections' embeddings already cached in memory
+        report = {}
+        for run in ("cold", "warm"):
+            latencies, recalls = [], []
+            for q, expected in zip(query_vectors, truth):
+                start = time.perf_counter()
+                results = search(q.tolist())
+                latencies.append(time.perf_counter() - start)
+                found = {int(chunk_id.split("-")[1]) for chunk_id in results["ids"][0]}
+                recalls.append(len(found & expected) / k)
+            report[f"query_ms_{run}"] = latency_summary(latencies)
+        report["recall_at_k"] = round(statistics.fmean(recalls), 4)
+        return report
+
+    with tempfile.TemporaryDirectory() as workdir:
+        client = chromadb.PersistentClient(path=workdir)
+        section_index.SECTION_CACHE_SIZE = max(section_index.SECTION_CACHE_SIZE, sections)
+        count = section_index.assign_sections(metadatas)
+        collection = client.create_collection(name="bench_sections", metadata={"sections": count})
+        ids = [f"chunk-{i}" for i in range(chunks)]
+        for offset in range(0, chunks, batch):
+            collection.add(
+                ids=ids[offset:offset + batch],
+                embeddings=vectors[offset:offset + batch],
+                metadatas=metadatas[offset:offset + batch],
+            )
+        start = time.perf_counter()
+        section_index.build_section_index(client, "bench_sections", ids, vectors, metadatas)
+        build_seconds = time.perf_counter() - start
+
+        include = ["distances"]
+        report = {"flat": measure(lambda q: collection.query(query_embeddings=[q], n_results=k, include=include))}
+        print(f"[sections] flat: {report['flat']}", file=sys.stderr)
+        for top_n in top_ns:
+            report[f"top_{top_n}_sections"] = measure(
+                lambda q: section_index.query(client, collection, q, k, include, top_n=top_n))
+            print(f"[sections] top {top_n}: {report[f'top_{top_n}_sections']}", file=sys.stderr)
+
+    return {"chunks": chunks, "sections": count, "dim": dim, "k": k, "queries": queries,
+            "section_index_build_seconds": round(build_seconds, 3), "by_strategy": report}
+
+
+# -----------------------------------------------------------
+# 7. Model scheduler: chat latency while another document hogs the model
+# -----------------------------------------------------------
+def bench_scheduler(duration: float, quota: int, llm_latency_ms: float, hog_ingest: int, hog_chat: int,
+                    tenants: int, tenant_rate: float) -> dict:
+    """
+    A stub model that serves `quota` calls at once (the rest queue, like a
+    remote quota). One "hog" document runs `hog_ingest` image-description
+    loops and `hog_chat` chat loops; `tenants` other documents each chat in
+    one loop. Reports every tenant's call latency with the scheduler off
+    and on (SCHEDULER_SLOTS = quota).
+    """
+    import job_registry
+    import scheduler
+    from llm_client import OllamaChatClient
+
+    server, url = start_fake_ollama(config=FakeOllamaConfig(latency_ms=llm_latency_ms, jitter_ms=0,
+                                                            max_concurrency=quota))
+    workdir = tempfile.mkdtemp(prefix="rag-bench-scheduler-")
+    job_registry.REGISTRY_PATH = Path(workdir) / "rag_state.db"
+    client = OllamaChatClient(url, "stub", max_retries=0, hedge=False)
+    messages = [("human", "Describe this.")]
+    report = {"quota": quota, "stub_llm_latency_ms": llm_latency_ms, "hog_ingest_loops": hog_ingest,
+              "hog_chat_loops": hog_chat, "other_tenants": tenants, "tenant_rate": tenant_rate}
+
+    def loop(tenant, priority, deadline, latencies):
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            with scheduler.slot(tenant, priority):
+                client.chat(messages)
+            latencies.append(time.perf_counter() - start)
+
+    try:
+        for mode, slots in (("unscheduled", 0), ("scheduled", quota)):
+            scheduler.SCHEDULER_SLOTS = slots
+            scheduler.SCHEDULER_BACKGROUND_SLOTS = max(1, quota // 2)
+            scheduler.SCHEDULER_TENANT_RATE = tenant_rate
+            loops = [("hog", "ingest")] * hog_ingest + [("hog", "interactive")] * hog_chat \
+                + [(f"tenant-{n}", "interactive") for n in range(tenants)]
+            latencies = {}
+            deadline = time.perf_counter() + duration
+            threads = []
+            for tenant, priority in loops:
+                samples = latencies.setdefault(f"{tenant}:{priority}", [])
+                threads.append(threading.Thread(target=loop, args=(tenant, priority, deadline, samples)))
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            report[mode] = {key: {"calls": len(samples), **latency_summary(samples)}
+                            for key, samples in sorted(latencies.items())}
+    finally:
+        client.close()
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+# -----------------------------------------------------------
+# CLI
+# -----------------------------------------------------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark suite for ingestion and chat.")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("pdf")
+    p.add_argument("--pdf", required=True, help="A PDF file or a directory of PDFs")
+
+    p = sub.add_parser("pdf-memory")
+    p.add_argument("--pages", type=int, default=1000)
+    p.add_argument("--scanned", action="store_true", help="Image-only pages, like a scanned document")
+    p.add_argument("--window-pages", type=int, default=25)
+    p.add_argument("--budget-mb", type=float, default=6000, help="Peak RSS the windowed run must stay under")
+
+    p = sub.add_parser("images")
+    p.add_argument("--count", type=int, default=50)
+    p.add_argument("--size", type=int, default=800, help="Synthetic image width/height in pixels")
+    p.add_argument("--vlm-latency-ms", type=float, default=100.0)
+    p.add_argument("--decorative", type=float, default=0.2, help="Fraction of tiny decorative images")
+
+    p = sub.add_parser("chunk-embed")
+    p.add_argument("--markdown", default=None, help="Markdown file (default: synthetic document)")
+    p.add_argument("--sections", type=int, default=400)
+    p.add_argument("--model", default="BAAI/bge-large-en-v1.5")
+    p.add_argument("--chunkers", default="unstructured,structured",
+                   help="Comma-separated: unstructured (previous loader + splitter), structured (md_chunker)")
+
+    p = sub.add_parser("chroma")
+    p.add_argument("--sizes", default="10000,100000,1000000")
+    p.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=5)
+    p.add_argument("--batch", type=int, default=5000)
+
+    p = sub.add_parser("chat")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--duration", type=float, default=30.0)
+    p.add_argument("--chunks", type=int, default=2000)
+    p.add_argument("--llm-latency-ms", type=float, default=300.0)
+    p.add_argument("--port", type=int, default=8765)
+    p.add_argument("--small-llm-latency-ms", type=float, default=None,
+                   help="Enable tiered routing with a stub small model of this latency")
+
+    p = sub.add_parser("sections")
+    p.add_argument("--chunks", type=int, default=100000)
+    p.add_argument("--section-size", type=int, default=40, help="Chunks per section")
+    p.add_argument("--dim", type=int, default=EMBEDDING_DIM)
+    p.add_argument("--queries", type=int, default=200)
+    p.add_argument("--k", type=int, default=8)
+    p.add_argument("--top-n", default="1,2,4,8", help="Comma-separated SECTION_TOP_N values to compare")
+    p.add_argument("--batch", type=int, default=5000)
+
+    p = sub.add_parser("scheduler")
+    p.add_argument("--duration", type=float, default=20.0)
+    p.add_argument("--quota", type=int, default=4, help="Calls the stub model serves at once")
+    p.add_argument("--llm-latency-ms", type=float, default=200.0)
+    p.add_argument("--hog-ingest", type=int, default=16, help="Image-description loops of the hog document")
+    p.add_argument("--hog-chat", type=int, default=4, help="Chat loops of the hog document")
+    p.add_argument("--tenants", type=int, default=3, help="Other documents, one chat loop each")
+    p.add_argument("--tenant-rate", type=float, default=0.0, help="Token bucket refill (calls/s per tenant, 0 = off)")
+
+    p = sub.add_parser("all", help="Small, quick run of every offline benchmark")
+    p.add_argument("--pdf", default=None, help="Include the PDF benchmark for these PDFs")
+
+    args = parser.parse_args()
+    report = {"environment": environment_info()}
+
+    if args.bench in ("pdf", "all") and getattr(args, "pdf", None):
+        target = Path(args.pdf)
+        pdfs = sorted(target.glob("*.pdf")) if target.is_dir() else [target]
+        report["pdf"] = bench_pdf(pdfs)
+    if args.bench == "pdf-memory":
+        report["pdf_memory"] = bench_pdf_memory(args.pages, args.scanned, args.window_pages, args.budget_mb)
+    if args.bench == "images":
+        report["images"] = bench_images(args.count, args.vlm_latency_ms, args.size, args.decorative)
+    if args.bench == "chunk-embed":
+        report["chunk_embed"] = bench_chunk_embed(args.markdown, args.sections, args.model, args.chunkers.split(","))
+    if args.bench == "chroma":
+        sizes = [int(s) for s in args.sizes.split(",")]
+        report["chroma"] = bench_chroma(sizes, args.dim, args.queries, args.k, args.batch)
+    if args.bench == "chat":
+        report["chat"] = bench_chat(args.concurrency, args.duration, args.chunks, args.llm_latency_ms, args.port,
+                                    args.small_llm_latency_ms)
+    if args.bench == "sections":
+        report["sections"] = bench_sections(args.chunks, args.section_size, args.dim, args.queries, args.k,
+                                            [int(n) for n in args.top_n.split(",")], args.batch)
+    if args.bench == "scheduler":
+        report["scheduler"] = bench_scheduler(args.duration, args.quota, args.llm_latency_ms, args.hog_ingest,
+                                              args.hog_chat, args.tenants, args.tenant_rate)
+    if args.bench == "all":
+        report["images"] = bench_images(20, 100.0, 800)
+        report["chunk_embed"] = bench_chunk_embed(None, 200, "BAAI/bge-large-en-v1.5")
+        report["chroma"] = bench_chroma([10000], EMBEDDING_DIM, 100, 5, 5000)
+        report["chat"] = bench_chat(8, 15.0, 2000, 300.0, 8765)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            report["comparison"] = compare_reports(report, json.load(f))
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
+    if not report.get("pdf_memory", {}).get("within_budget", True):
+        sys.exit("Base.py exceeded the RSS budget in windowed mode")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import job_registry
+import metrics
+from ingest_pipeline import BACKEND_DIR, STAGES, DocumentPaths, collection_name_for
+
+# --- Bulk ingestion for large PDF archives ---
+# Pipelines the three stages across documents: while one PDF is in marker,
+# another is being described by the VLM and a third is being embedded.
+# Each stage has its own worker pool, and models are loaded once per worker
+# rather than once per document.
+#
+# Usage (from Backend-new/):
+#     python bulk_ingest.py /data/archive/                    # every *.pdf below a directory
+#     python bulk_ingest.py manifest.txt                      # one PDF path per line
+#     python bulk_ingest.py /data/archive/ --marker-workers 2 --vlm-workers 8 --embed-workers 2
+#
+# Progress is checkpointed per document and stage in the job registry.
+# After an interrupted run, run the same command again: finished documents
+# are skipped, and the others resume after their last completed stage.
+# Workers write their output to bulk_logs/<stage>.log.
+
+LOG_DIR = BACKEND_DIR / "bulk_logs"
+PROGRESS_INTERVAL = 30.0  # Seconds between progress lines
+
+
+# -----------------------------------------------------------
+# Stage workers (separate processes)
+# -----------------------------------------------------------
+def _load_stage_handler(stage: str):
+    """Loads what a stage needs once per worker and returns handler(paths)."""
+    if stage == "Base.py":
+        import Base
+        converter = Base.load_converter()
+        return lambda paths: Base.convert_pdf(converter, paths.pdf_path, output_dir=paths.output_dir)
+    if stage == "Image-Testo.py":
+        # VLM calls are remote and I/O-bound; the script keeps running as a subprocess per document
+        import ingest_pipeline
+        return lambda paths: ingest_pipeline.run_stage(stage, paths)
+    if stage == "Emmbed.py":
+        import chromadb
+        import Emmbed
+        model = Emmbed.load_model()
+        # One client per process; its threads share it (Chroma writes are not multi-process safe)
+        client = chromadb.PersistentClient(path=Emmbed.CHROMA_PATH)
+        return lambda paths: Emmbed.embed_markdown(model, client, paths.described_md_file, paths.collection_name)
+    raise ValueError(f"Unknown pipeline stage: {stage}")
+
+
+def _error_text(e: Exception) -> str:
+    if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+        return e.stderr[-2000:]
+    return f"{type(e).__name__}: {e}"
+
+
+def stage_worker(stage: str, threads: int, tasks, results):
+    """
+    Entry point of a stage worker process: loads the stage's models, then
+    `threads` threads take (pdf_path, collection_name) tasks until they get None.
+    Reports ("start", ...) and ("done", ...) events on `results`.
+    """
+    os.chdir(BACKEND_DIR)
+    LOG_DIR.mkdir(exist_ok=True)
+    log = open(LOG_DIR / f"{stage}.log", "a", buffering=1, encoding="utf-8")
+    sys.stdout = sys.stderr = log
+    metrics.start_background_flush()
+    pid = os.getpid()
+
+    try:
+        handler = _load_stage_handler(stage)
+    except Exception as e:
+        results.put(("crashed", stage, pid, _error_text(e)))
+        return
+
+    def loop():
+        while True:
+            task = tasks.get()
+            if task is None:
+                return
+            paths = DocumentPaths(*task)
+            results.put(("start", stage, pid, paths.collection_name))
+            start = time.perf_counter()
+            try:
+                handler(paths)
+                results.put(("done", stage, pid, paths.collection_name, None, time.perf_counter() - start))
+            except Exception as e:
+                print(f"[{stage}] {paths.pdf_path} failed: {e}")
+                results.put(("done", stage, pid, paths.collection_name, _error_text(e), time.perf_counter() - start))
+
+    workers = [threading.Thread(target=loop, name=f"{stage}-{i}") for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    metrics.flush()
+
+
+# -----------------------------------------------------------
+# Coordinator
+# -----------------------------------------------------------
+def discover_pdfs(inputs) -> list:
+    """PDFs from directories (recursive), single PDF files, or manifest files (one path per line)."""
+    pdfs = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            pdfs.extend(sorted(path.rglob("*.pdf")))
+        elif path.suffix.lower() == ".pdf":
+            pdfs.append(path)
+        else:
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        pdfs.append(Path(line))
+    return [p.resolve() for p in pdfs]
+
+
+class StagePool:
+    """The worker processes of one stage, their task queue and what each is working on."""
+
+    def __init__(self, context, stage: str, processes: int, threads: int, results):
+        self.context = context
+        self.stage = stage
+        self.threads = threads
+        self.results = results
+        self.tasks = context.Queue()
+        self.in_flight = {}  # pid -> {collection_name}
+        self.processes = []
+        self.docs = 0
+        self.busy_seconds = 0.0
+        for _ in range(processes):
+            self._spawn()
+
+    def _spawn(self):
+        process = self.context.Process(target=stage_worker, args=(self.stage, self.threads, self.tasks, self.results),
+                                       name=f"bulk-{self.stage}", daemon=True)
+        process.start()
+        self.processes.append(process)
+
+    def reap_dead(self) -> list:
+        """Replaces workers that died (e.g. out of memory). Returns the documents they were holding."""
+        lost = []
+        for process in list(self.processes):
+            if process.is_alive():
+                continue
+            self.processes.remove(process)
+            lost.extend(self.in_flight.pop(process.pid, set()))
+            print(f"[{self.stage}] worker {process.pid} exited with code {process.exitcode}; starting a new one")
+            self._spawn()
+        return lost
+
+    def stop(self, abort: bool = False):
+        """Lets the workers finish and exit, or kills them on abort (the checkpoints allow a resume)."""
+        for process in self.processes:
+            if abort:
+                process.terminate()
+            else:
+                for _ in range(self.threads):
+                    self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+
+
+def run_bulk_ingest(inputs, marker_workers: int = 1, vlm_workers: int = 4, embed_workers: int = 1) -> dict:
+    job_registry.init_registry()
+    pdfs = discover_pdfs(inputs)
+    report = {"documents": len(pdfs), "skipped_ready": 0, "skipped_busy": 0, "skipped_duplicate": 0,
+              "completed": 0, "failed": 0, "resumed": 0}
+    failures = {}
+
+    # --- Decide where each document starts ---
+    start_stage = {}   # collection_name -> index into STAGES
+    pdf_of = {}        # collection_name -> pdf path
+    for pdf in pdfs:
+        paths = DocumentPaths(pdf, collection_name_for(pdf))
+        name = paths.collection_name
+        if name in pdf_of:
+            # collection_name_for sees the earlier file's claim, so this only happens if that claim was lost
+            print(f"Skipping {pdf}: {pdf_of[name]} has the same name")
+            report["skipped_duplicate"] += 1
+            continue
+        job = job_registry.get_job(name)
+        if job is not None and job["status"] == job_registry.STATUS_READY:
+            report["skipped_ready"] += 1
+            continue
+        if not job_registry.claim_job(name, str(pdf)):
+            print(f"Skipping {pdf}: it is being processed by a server worker")
+            report["skipped_busy"] += 1
+            continue
+
+        index = 0
+        checkpoint = job_registry.get_checkpoint(name)
+        if checkpoint is not None and checkpoint[0] == str(pdf):
+            done = STAGES.index(checkpoint[1]) + 1
+            # Only trust the checkpoint if the stage's output is still there
+            if all(paths.stage_output(s) is None or paths.stage_output(s).exists() for s in STAGES[:done]):
+                index = done
+                report["resumed"] += 1
+        pdf_of[name] = pdf
+        start_stage[name] = index
+
+    if not pdf_of:
+        print("Nothing to ingest.")
+        return report
+
+    # --- Start the stage pools ---
+    # Spawned (not forked) workers: marker and torch don't survive fork after CUDA init
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    pools = {
+        "Base.py": StagePool(context, "Base.py", marker_workers, 1, results),
+        "Image-Testo.py": StagePool(context, "Image-Testo.py", 1, vlm_workers, results),
+        "Emmbed.py": StagePool(context, "Emmbed.py", 1, embed_workers, results),
+    }
+    workers = {"Base.py": marker_workers, "Image-Testo.py": vlm_workers, "Emmbed.py": embed_workers}
+
+    def submit(name: str, index: int):
+        stage = STAGES[index]
+        job_registry.update_job(name, job_registry.STATUS_RUNNING, stage=stage)
+        pools[stage].tasks.put((str(pdf_of[name]), name))
+
+    def fail(name: str, stage: str, error: str):
+        job_registry.update_job(name, job_registry.STATUS_FAILED, stage=stage, error=error)
+        failures[name] = f"{stage}: {error.strip().splitlines()[-1] if error.strip() else error}"
+        metrics.inc("rag_ingest_jobs_total", status="failed")
+        report["failed"] += 1
+
+    start = time.perf_counter()
+    pending = set(start_stage)
+    for name, index in start_stage.items():
+        submit(name, index)
+    print(f"Ingesting {len(pending)} documents "
+          f"(marker x{marker_workers}, VLM x{vlm_workers}, embedding x{embed_workers})...")
+
+    last_progress = time.perf_counter()
+    try:
+        while pending:
+            try:
+                event = results.get(timeout=5.0)
+            except queue.Empty:
+                event = None
+
+            if event is not None:
+                kind, stage, pid = event[0], event[1], event[2]
+                pool = pools[stage]
+                if kind == "start":
+                    pool.in_flight.setdefault(pid, set()).add(event[3])
+                elif kind == "done":
+                    name, error, seconds = event[3], event[4], event[5]
+                    pool.in_flight.get(pid, set()).discard(name)
+                    pool.docs += 1
+                    pool.busy_seconds += seconds
+                    if error is not None:
+                        fail(name, stage, error)
+                        pending.discard(name)
+                    else:
+                        job_registry.save_checkpoint(name, str(pdf_of[name]), stage)
+                        index = STAGES.index(stage) + 1
+                        if index < len(STAGES):
+                            submit(name, index)
+                        else:
+                            job_registry.update_job(name, job_registry.STATUS_READY)
+                            job_registry.clear_checkpoint(name)
+                            metrics.inc("rag_ingest_jobs_total", status="ready")
+                            report["completed"] += 1
+                            pending.discard(name)
+                elif kind == "crashed":
+                    # A worker could not even load its models: nothing in this stage can succeed
+                    raise RuntimeError(f"{stage} worker failed to start: {event[3]}")
+
+            for stage, pool in pools.items():
+                for name in pool.reap_dead():
+                    if name in pending:
+                        fail(name, stage, "Worker process died while processing this document.")
+                        pending.discard(name)
+
+            if time.perf_counter() - last_progress >= PROGRESS_INTERVAL:
+                last_progress = time.perf_counter()
+                elapsed = last_progress - start
+                in_stage = {s: sum(len(v) for v in p.in_flight.values()) for s, p in pools.items()}
+                print(f"[{elapsed / 60:.1f} min] done {report['completed']}, failed {report['failed']}, "
+                      f"remaining {len(pending)}, in progress {in_stage}, "
+                      f"{report['completed'] / elapsed * 3600:.1f} docs/hour")
+    finally:
+        for pool in pools.values():
+            pool.stop(abort=bool(pending))
+        metrics.flush()
+
+    elapsed = time.perf_counter() - start
+    report["elapsed_seconds"] = round(elapsed, 1)
+    report["docs_per_hour"] = round(report["completed"] / elapsed * 3600, 2) if elapsed else 0.0
+    report["stages"] = {
+        stage: {
+            "workers": workers[stage],
+            "docs": pool.docs,
+            "mean_seconds_per_doc": round(pool.busy_seconds / pool.docs, 2) if pool.docs else None,
+            # Fraction of the run the stage's workers were busy; the highest one is the bottleneck
+            "utilization": round(pool.busy_seconds / (elapsed * workers[stage]), 3) if elapsed else None,
+        }
+        for stage, pool in pools.items()
+    }
+    if failures:
+        report["failures"] = failures
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-ingest PDFs with the stages pipelined across documents.")
+    parser.add_argument("inputs", nargs="+", help="PDF files, directories (searched recursively) or manifest files")
+    parser.add_argument("--marker-workers", type=int, default=1,
+                        help="Processes running marker (each loads its own models)")
+    parser.add_argument("--vlm-workers", type=int, default=4, help="Documents described by the VLM concurrently")
+    parser.add_argument("--embed-workers", type=int, default=1,
+                        help="Threads embedding documents (sharing one model and Chroma client)")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    result = run_bulk_ingest(args.inputs, args.marker_workers, args.vlm_workers, args.embed_workers)
+    output = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(output, encoding="utf-8")
+    print(output)
@@ -0,0 +1,351 @@
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+import job_registry
+import metrics
+import section_index
+from ingest_pipeline import BACKEND_DIR, DocumentPaths, is_document_dir
+
+# --- Collection lifecycle: storage accounting, deletion, compaction, cold storage ---
+# Collections in Chroma and the per-document directories in documents/
+# otherwise only ever grow. This module backs the /admin endpoints:
+#   * list_collections:  chunk counts and on-disk bytes per collection
+#   * delete_collection: the Chroma collection plus its intermediate files
+#   * compact_store:     VACUUM the SQLite files, drop orphaned index segments
+#   * evict / restore:   idle collections are exported to cold storage and
+#                        loaded back into Chroma on their first query
+
+# --- 1. Configuration ---
+
+# Collections not queried for this many seconds are moved to cold storage (0 disables)
+COLLECTION_TTL = float(os.getenv("COLLECTION_TTL", 0))
+# How often each worker looks for idle collections (seconds)
+COLLECTION_SWEEP_INTERVAL = float(os.getenv("COLLECTION_SWEEP_INTERVAL", 3600))
+COLD_STORAGE_DIR = Path(os.getenv("COLD_STORAGE_DIR", BACKEND_DIR / "cold_storage"))
+# Write at most one last-used update per collection per worker in this window
+USE_RECORD_INTERVAL = 60.0
+# Chunks per Chroma add() call when restoring
+RESTORE_BATCH_SIZE = 1000
+
+# Chroma names its per-collection vector index directories after the segment UUID
+_SEGMENT_DIR = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+metrics.describe("rag_collections_evicted_total", "Idle collections moved to cold storage.")
+metrics.describe("rag_collections_restored_total", "Collections restored from cold storage on first query.")
+
+_last_recorded = {}
+_last_recorded_lock = threading.Lock()
+
+
+def directory_bytes(path: Path) -> int:
+    """Total size of the files below a directory (0 if it doesn't exist)."""
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+
+def record_use(collection_name: str):
+    """Marks a collection as used now. Throttled, since it runs on every chat request."""
+    now = time.time()
+    with _last_recorded_lock:
+        if now - _last_recorded.get(collection_name, 0) < USE_RECORD_INTERVAL:
+            return
+        _last_recorded[collection_name] = now
+    job_registry.record_collection_use(collection_name, now)
+
+
+def document_paths(collection_name: str):
+    """DocumentPaths of the PDF a collection was built from, or None if unknown."""
+    job = job_registry.get_job(collection_name)
+    if job is None or not job["pdf_path"]:
+        return None
+    return DocumentPaths(job["pdf_path"], collection_name)
+
+
+def _segment_ids(db_path: Path):
+    """Maps collection name -> ids of its segments, read from Chroma's own SQLite file. None if unreadable."""
+    segments = {}
+    try:
+        conn = sqlite3.connect(f"file:{Path(db_path) / 'chroma.sqlite3'}?mode=ro", uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT collections.name, segments.id FROM segments "
+                "JOIN collections ON segments.collection = collections.id"
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"Could not read Chroma segments from {db_path}: {e}")
+        return None
+    for name, segment_id in rows:
+        segments.setdefault(name, []).append(segment_id)
+    return segments
+
+
+# -----------------------------------------------------------
+# Storage accounting
+# -----------------------------------------------------------
+def list_collections(client, db_path) -> dict:
+    """
+    Every collection, hot or cold, with its chunk count and on-disk bytes:
+    index_bytes (its vector index segments), document_bytes (Markdown and
+    images), pdf_bytes and cold_bytes. Chunk texts and metadata live in
+    Chroma's shared SQLite file, which is reported once under "store".
+    """
+    db_path = Path(db_path)
+    segments = _segment_ids(db_path) or {}
+    usage = {u["collection_name"]: u for u in job_registry.list_collection_usage()}
+
+    collections = []
+    # A document's section index is reported as part of its collection
+    names = [c.name for c in client.list_collections() if not section_index.is_section_index(c.name)]
+    cold = [name for name, u in usage.items() if u["state"] != job_registry.COLLECTION_HOT and name not in names]
+    for name in names + cold:
+        u = usage.get(name) or {}
+        paths = document_paths(name)
+        entry = {
+            "collection_name": name,
+            "state": u.get("state", job_registry.COLLECTION_HOT),
+            "last_used_at": u.get("last_used_at"),
+            "pdf_path": str(paths.pdf_path) if paths else None,
+            "chunks": None,
+            "index_bytes": sum(directory_bytes(db_path / s)
+                               for s in segments.get(name, []) + segments.get(section_index.section_index_name(name), [])),
+            "document_bytes": directory_bytes(paths.output_dir) if paths else 0,
+            "pdf_bytes": directory_bytes(paths.pdf_path) if paths else 0,
+            "cold_bytes": directory_bytes(Path(u["cold_path"])) if u.get("cold_path") else 0,
+        }
+        if name in names:
+            entry["chunks"] = client.get_collection(name).count()
+        entry["total_bytes"] = entry["index_bytes"] + entry["document_bytes"] + entry["pdf_bytes"] + entry["cold_bytes"]
+        collections.append(entry)
+
+    collections.sort(key=lambda c: c["total_bytes"], reverse=True)
+    return {
+        "collections": collections,
+        "store": {
+            "chroma_bytes": directory_bytes(db_path),
+            "chroma_sqlite_bytes": directory_bytes(db_path / "chroma.sqlite3"),
+            "cold_storage_bytes": directory_bytes(COLD_STORAGE_DIR),
+            "registry_bytes": sum(directory_bytes(Path(f"{job_registry.REGISTRY_PATH}{suffix}"))
+                                  for suffix in ("", "-wal", "-shm")),
+        },
+    }
+
+
+# -----------------------------------------------------------
+# Deletion and compaction
+# -----------------------------------------------------------
+def delete_collection(client, collection_name: str, delete_pdf: bool = True) -> dict:
+    """
+    Deletes a document: its Chroma collection (or cold copy), its Markdown
+    and image directory, optionally the uploaded PDF, and its registry
+    entries. Returns what was removed and the bytes freed outside Chroma
+    (Chroma's own file shrinks on the next compact_store).
+    """
+    paths = document_paths(collection_name)
+    usage = job_registry.get_collection_usage(collection_name) or {}
+    removed = {"collection": False, "cold_copy": False, "document_dir": False, "pdf": False, "bytes_freed": 0}
+
+    if collection_name in [c.name for c in client.list_collections()]:
+        client.delete_collection(collection_name)
+        removed["collection"] = True
+    section_index.drop_section_index(client, collection_name)
+    if usage.get("cold_path") and Path(usage["cold_path"]).exists():
+        removed["bytes_freed"] += directory_bytes(Path(usage["cold_path"]))
+        Path(usage["cold_path"]).unlink()
+        removed["cold_copy"] = True
+    if paths is not None and paths.output_dir.is_dir():
+        if is_document_dir(paths.output_dir):
+            removed["bytes_freed"] += directory_bytes(paths.output_dir)
+            shutil.rmtree(paths.output_dir)
+            removed["document_dir"] = True
+        else:
+            print(f"Not removing {paths.output_dir}: it is outside the documents directory")
+    if delete_pdf and paths is not None and paths.pdf_path.is_file():
+        removed["bytes_freed"] += paths.pdf_path.stat().st_size
+        paths.pdf_path.unlink()
+        removed["pdf"] = True
+
+    job_registry.delete_job(collection_name)
+    # Invalidate cached retrieval results in every worker
+    job_registry.bump_collection_version(collection_name)
+    with _last_recorded_lock:
+        _last_recorded.pop(collection_name, None)
+    print(f"Deleted collection '{collection_name}': {removed}")
+    return removed
+
+
+def compact_store(client, db_path) -> dict:
+    """
+    Returns space left behind by deletions: removes vector index directories
+    that no collection refers to any more, then VACUUMs Chroma's SQLite file
+    and the registry. (Chroma's `chroma utils vacuum` CLI additionally prunes
+    its write-ahead log, but needs the server to be stopped.)
+    """
+    db_path = Path(db_path)
+    before = directory_bytes(db_path) + directory_bytes(job_registry.REGISTRY_PATH)
+    result = {"orphaned_segments_removed": 0, "chroma_vacuumed": False, "registry_vacuumed": False}
+
+    # Only trust the segment list if Chroma's database could be read; otherwise every index would look orphaned
+    segments = _segment_ids(db_path)
+    if segments is not None and db_path.is_dir():
+        live = {segment_id for ids in segments.values() for segment_id in ids}
+        for entry in db_path.iterdir():
+            if entry.is_dir() and _SEGMENT_DIR.match(entry.name) and entry.name not in live:
+                shutil.rmtree(entry)
+                result["orphaned_segments_removed"] += 1
+
+    try:
+        conn = sqlite3.connect(db_path / "chroma.sqlite3", timeout=job_registry.BUSY_TIMEOUT, isolation_level=None)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+        result["chroma_vacuumed"] = True
+    except sqlite3.Error as e:
+        print(f"Could not vacuum Chroma's database: {e}")
+        result["chroma_error"] = str(e)
+
+    job_registry.purge_sessions(_session_ttl())
+    job_registry.vacuum_registry()
+    result["registry_vacuumed"] = True
+
+    result["bytes_freed"] = before - directory_bytes(db_path) - directory_bytes(job_registry.REGISTRY_PATH)
+    print(f"Compacted the store: {result}")
+    return result
+
+
+def _session_ttl() -> float:
+    import conversation  # Only needed here; keeps this module importable by scripts
+    return conversation.SESSION_TTL
+
+
+# -----------------------------------------------------------
+# Cold storage (TTL eviction and lazy restore)
+# -----------------------------------------------------------
+def evict(client, collection_name: str) -> bool:
+    """
+    Exports a collection (ids, embeddings, texts, metadata) to
+    cold_storage/<name>.npz and drops it from Chroma. Returns False if
+    another worker is already moving it.
+    """
+    job_registry.record_collection_use(collection_name, 0)  # Ensure a usage row exists
+    if not job_registry.transition_collection(collection_name, job_registry.COLLECTION_HOT, job_registry.COLLECTION_EVICTING):
+        return False
+    cold_path = COLD_STORAGE_DIR / f"{collection_name}.npz"
+    try:
+        with metrics.span("admin", "evict", collection=collection_name):
+            data = client.get_collection(collection_name).get(include=["embeddings", "documents", "metadatas"])
+            COLD_STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+            records = json.dumps({"ids": data["ids"], "documents": data["documents"], "metadatas": data["metadatas"]})
+            tmp_path = cold_path.with_suffix(f".{os.getpid()}.tmp")
+            with open(tmp_path, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    embeddings=np.asarray(data["embeddings"], dtype=np.float32),
+                    records=np.frombuffer(gzip.compress(records.encode("utf-8")), dtype=np.uint8),
+                )
+            os.replace(tmp_path, cold_path)
+            client.delete_collection(collection_name)
+            # Rebuilt from the chunks' section metadata on restore
+            section_index.drop_section_index(client, collection_name)
+    except Exception:
+        job_registry.transition_collection(collection_name, job_registry.COLLECTION_EVICTING, job_registry.COLLECTION_HOT)
+        raise
+    job_registry.transition_collection(collection_name, job_registry.COLLECTION_EVICTING, job_registry.COLLECTION_COLD,
+                                       str(cold_path))
+    metrics.inc("rag_collections_evicted_total")
+    print(f"Moved collection '{collection_name}' ({len(data['ids'])} chunks) to {cold_path}")
+    return True
+
+
+def evict_idle(client, ttl: float = None) -> list:
+    """Evicts every collection not queried within ttl seconds. Returns their names."""
+    ttl = COLLECTION_TTL if ttl is None else ttl
+    now = time.time()
+    usage = {u["collection_name"]: u for u in job_registry.list_collection_usage()}
+    evicted = []
+    for collection in client.list_collections():
+        name = collection.name
+        if section_index.is_section_index(name):
+            continue  # Evicted together with its collection
+        if name not in usage:
+            # Never queried since tracking began: give it a full TTL from now
+            job_registry.record_collection_use(name, now)
+            continue
+        if usage[name]["state"] == job_registry.COLLECTION_HOT and now - usage[name]["last_used_at"] > ttl:
+            try:
+                if evict(client, name):
+                    evicted.append(name)
+            except Exception as e:
+                print(f"Could not evict collection '{name}': {e}")
+    return evicted
+
+
+def is_cold(collection_name: str) -> bool:
+    usage = job_registry.get_collection_usage(collection_name)
+    return usage is not None and usage["state"] in (job_registry.COLLECTION_COLD, job_registry.COLLECTION_RESTORING)
+
+
+def restore(client, collection_name: str) -> bool:
+    """
+    Loads an evicted collection back into Chroma. Returns False if it is
+    not cold or another worker is already restoring it.
+    """
+    usage = job_registry.get_collection_usage(collection_name)
+    if usage is None or usage["state"] != job_registry.COLLECTION_COLD:
+        return False
+    cold_path = usage["cold_path"]
+    if not job_registry.transition_collection(collection_name, job_registry.COLLECTION_COLD,
+                                              job_registry.COLLECTION_RESTORING, cold_path):
+        return False
+    try:
+        with metrics.span("admin", "restore", collection=collection_name):
+            with np.load(cold_path, allow_pickle=False) as data:
+                embeddings = data["embeddings"]
+                records = json.loads(gzip.decompress(data["records"].tobytes()))
+            sections = section_index.section_count(records["metadatas"])
+            collection = client.get_or_create_collection(collection_name,
+                                                         metadata={"sections": sections} if sections else None)
+            for start in range(0, len(records["ids"]), RESTORE_BATCH_SIZE):
+                end = start + RESTORE_BATCH_SIZE
+                collection.add(
+                    ids=records["ids"][start:end],
+                    embeddings=embeddings[start:end],
+                    documents=records["documents"][start:end],
+                    metadatas=records["metadatas"][start:end],
+                )
+            section_index.build_section_index(client, collection_name, records["ids"], embeddings, records["metadatas"])
+    except Exception:
+        try:
+            client.delete_collection(collection_name)  # Don't leave a partial copy behind
+        except Exception:
+            pass
+        section_index.drop_section_index(client, collection_name)
+        job_registry.transition_collection(collection_name, job_registry.COLLECTION_RESTORING,
+                                           job_registry.COLLECTION_COLD, cold_path)
+        raise
+    job_registry.transition_collection(collection_name, job_registry.COLLECTION_RESTORING, job_registry.COLLECTION_HOT)
+    job_registry.record_collection_use(collection_name)
+    Path(cold_path).unlink(missing_ok=True)
+    metrics.inc("rag_collections_restored_total")
+    print(f"Restored collection '{collection_name}' ({len(records['ids'])} chunks) from cold storage")
+    return True
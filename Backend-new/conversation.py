@@ -0,0 +1,243 @@
+import json
+import os
+import re
+import uuid
+
+import numpy as np
+
+import job_registry
+
+# --- 1. Configuration ---
+
+# Sessions idle for longer than this are discarded (seconds)
+SESSION_TTL = int(os.getenv("SESSION_TTL_SECONDS", 3600))
+# Number of recent turns whose question, context and answer stay in the prompt
+SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 6))
+# A follow-up whose embedding is at least this similar (cosine) to the question
+# of a retained turn, and that asks about no word the turn's question didn't,
+# reuses that turn's chunks instead of retrieving again
+SESSION_REUSE_THRESHOLD = float(os.getenv("SESSION_REUSE_THRESHOLD", 0.95))
+
+# Words that don't change what a question is about
+STOPWORDS = frozenset("""
+a an the is are was were be been do does did what which who whom whose when where why how
+of in on at to for from by with about and or it its this that these those there
+i me my we our you your he she they them can could would should will please tell give
+""".split())
+
+# The system prompt never changes, so it is always the first (cached) prefix
+SYSTEM_PROMPT = """You are an assistant for question-answering tasks.
+Use the pieces of retrieved context given in the conversation to answer the questions.
+If you don't know the answer based on the context, just say that you don't know.
+Keep the answer concise and helpful."""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token), used for accounting only."""
+    return max(1, len(text) // 4)
+
+
+def question_terms(text: str) -> set:
+    return set(re.findall(r"\w+", text.lower())) - STOPWORDS
+
+
+def format_context(docs) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
+
+
+def context_message(question: str, texts) -> str:
+    """A user message carrying `texts` as context (or just the question, if there are none)."""
+    if texts:
+        context = "\n\n".join(texts)
+        return f"CONTEXT:\n{context}\n\nQUESTION:\n{question}"
+    return f"QUESTION:\n{question}"
+
+
+def citation(doc) -> dict:
+    """Where a retrieved chunk comes from, taken from the metadata retrieval already returned."""
+    metadata = doc.metadata
+    return {
+        "chunk_id": metadata.get("chunk_id"),
+        "score": round(metadata["score"], 4) if metadata.get("score") is not None else None,
+        "page_start": metadata.get("page_start"),
+        "page_end": metadata.get("page_end"),
+        "heading_path": metadata.get("heading_path"),
+    }
+
+
+class ConversationSession:
+    """
+    Server-side state of one multi-turn chat about one collection.
+
+    The prompt is laid out append-only:
+
+        [system] SYSTEM_PROMPT
+        [human]  CONTEXT (chunks new in turn 1) + QUESTION 1
+        [ai]     ANSWER 1
+        [human]  CONTEXT (chunks new in turn 2, if any) + QUESTION 2
+        ...
+
+    Each turn's message is stored verbatim, so every request starts with
+    exactly the same bytes as the previous one and the LLM backend can reuse
+    its cached prefix. Chunks already present in the retained turns are
+    never sent twice.
+
+    Trimming the oldest turns changes the prefix anyway, so when a dropped
+    turn carried chunks that a retained turn skipped as already sent (or
+    reused), they are moved into the first retained turn that needs them.
+    """
+
+    def __init__(self, session_id: str, collection_name: str):
+        self.session_id = session_id
+        self.collection_name = collection_name
+        # Each turn: {"question", "message", "answer", "chunk_ids", "chunk_texts", "sources", "query_embedding"}
+        # chunk_ids/chunk_texts are the chunks in the turn's message; sources cite every chunk it relied on
+        self.turns = []
+        self.tokens_sent = 0
+        self.tokens_saved = 0
+        self.retrievals_skipped = 0
+        # Citations of the turn answered in this request (not persisted)
+        self.answer_sources = []
+
+    # --- Serialization ---
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "turns": self.turns,
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+            "retrievals_skipped": self.retrievals_skipped,
+        })
+
+    @classmethod
+    def from_json(cls, session_id: str, collection_name: str, data: str):
+        session = cls(session_id, collection_name)
+        state = json.loads(data)
+        session.turns = state["turns"]
+        session.tokens_sent = state["tokens_sent"]
+        session.tokens_saved = state["tokens_saved"]
+        session.retrievals_skipped = state["retrievals_skipped"]
+        return session
+
+    # --- Context reuse ---
+
+    def find_reusable_turn(self, question: str, query_embedding):
+        """
+        Returns the retained turn whose question is closest to the new one,
+        if it is above SESSION_REUSE_THRESHOLD and the new question adds no
+        terms. Embeddings are normalized, so the dot product is the cosine
+        similarity. The term check catches near misses that embed almost
+        identically ("max voltage" / "min voltage") but need other chunks.
+        """
+        terms = question_terms(question)
+        candidates = [turn for turn in self.turns
+                      if turn["chunk_ids"] and terms <= question_terms(turn["question"])]
+        if not candidates:
+            return None
+        query = np.asarray(query_embedding, dtype=np.float32)
+        matrix = np.asarray([turn["query_embedding"] for turn in candidates], dtype=np.float32)
+        similarities = matrix @ query
+        best = int(np.argmax(similarities))
+        if similarities[best] >= SESSION_REUSE_THRESHOLD:
+            return candidates[best]
+        return None
+
+    def mark_reused(self, turn):
+        """Accounts for a retrieval skipped because `turn`'s chunks are already in the prompt."""
+        self.retrievals_skipped += 1
+        self.tokens_saved += estimate_tokens(turn["message"]) - estimate_tokens(turn["question"])
+
+    def new_chunks(self, docs):
+        """Filters out retrieved chunks that are already in the prompt."""
+        seen = {chunk_id for turn in self.turns for chunk_id in turn["chunk_ids"]}
+        new_docs = [doc for doc in docs if doc.metadata.get("chunk_id") not in seen]
+        skipped = [doc for doc in docs if doc.metadata.get("chunk_id") in seen]
+        self.tokens_saved += sum(estimate_tokens(doc.page_content) for doc in skipped)
+        return new_docs
+
+    # --- Prompt assembly ---
+
+    def build_message(self, question: str, new_docs) -> str:
+        """Builds this turn's user message. Only chunks new to the session are included."""
+        return context_message(question, [doc.page_content for doc in new_docs])
+
+    def build_messages(self, message: str):
+        """Returns the full message list for the LLM: stable prefix + this turn."""
+        messages = [("system", SYSTEM_PROMPT)]
+        for turn in self.turns:
+            messages.append(("human", turn["message"]))
+            messages.append(("ai", turn["answer"]))
+        messages.append(("human", message))
+        return messages
+
+    def record_turn(self, question: str, message: str, answer: str, query_embedding, new_docs, messages, sources=()):
+        """
+        Appends a completed turn and trims the oldest turns beyond SESSION_MAX_TURNS.
+        `sources` are the citations of every chunk the answer was based on,
+        including those already in the prompt from earlier turns.
+        """
+        self.tokens_sent += sum(estimate_tokens(content) for _, content in messages)
+        self.answer_sources = list(sources)
+        self.turns.append({
+            "question": question,
+            "message": message,
+            "answer": answer,
+            "chunk_ids": [doc.metadata.get("chunk_id") for doc in new_docs],
+            "chunk_texts": [doc.page_content for doc in new_docs],
+            "sources": list(sources),
+            "query_embedding": [float(x) for x in query_embedding],
+        })
+        # Dropping a turn also drops its chunks from the prompt; those that no
+        # retained turn relies on will be sent again if a later question retrieves them.
+        if len(self.turns) > SESSION_MAX_TURNS:
+            dropped, self.turns = self.turns[:-SESSION_MAX_TURNS], self.turns[-SESSION_MAX_TURNS:]
+            self.carry_over(dropped)
+
+    def carry_over(self, dropped):
+        """
+        Re-includes chunks of the `dropped` turns in the first retained turn
+        that relied on them, so every retained answer still has its context
+        in the prompt.
+        """
+        texts = {}
+        for turn in dropped:
+            texts.update(zip(turn["chunk_ids"], turn.get("chunk_texts", [])))
+        present = set()
+        for turn in self.turns:
+            relied_on = dict.fromkeys(source.get("chunk_id") for source in turn["sources"])
+            carried = [chunk_id for chunk_id in relied_on
+                       if chunk_id in texts and chunk_id not in present and chunk_id not in turn["chunk_ids"]]
+            if carried and "chunk_texts" in turn:
+                turn["chunk_ids"] = carried + turn["chunk_ids"]
+                turn["chunk_texts"] = [texts[chunk_id] for chunk_id in carried] + turn["chunk_texts"]
+                turn["message"] = context_message(turn["question"], turn["chunk_texts"])
+            present.update(turn["chunk_ids"])
+
+    def last_sources(self):
+        """Citations of the answer given in this request ([] if it wasn't based on the document)."""
+        return self.answer_sources
+
+    def stats(self) -> dict:
+        return {
+            "session_id": self.session_id,
+            "turns": len(self.turns),
+            "tokens_sent": self.tokens_sent,
+            "tokens_saved": self.tokens_saved,
+            "retrievals_skipped": self.retrievals_skipped,
+        }
+
+
+def load_or_create_session(session_id, collection_name: str) -> ConversationSession:
+    """
+    Loads a session from the shared registry, or starts a new one if the id is
+    missing, expired, or belongs to a different collection.
+    """
+    if session_id:
+        stored = job_registry.load_session(session_id, SESSION_TTL)
+        if stored is not None and stored[0] == collection_name:
+            return ConversationSession.from_json(session_id, collection_name, stored[1])
+    return ConversationSession(uuid.uuid4().hex, collection_name)
+
+
+def save_session(session: ConversationSession):
+    job_registry.save_session(session.session_id, session.collection_name, session.to_json())
@@ -0,0 +1,181 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# --- Fake Ollama-compatible server for offline testing ---
+# Implements the parts of the Ollama API this project uses:
+#   POST /api/chat     (stream and non-stream, text and image messages)
+#   GET  /api/tags, GET /api/version
+#
+# Usage:
+#     python fake_ollama.py --port 11434 --latency-ms 300 --jitter-ms 100 \
+#         --tail-prob 0.05 --tail-latency-ms 4000 --error-rate 0.05 --max-concurrency 8
+#
+# Then point the server at it:
+#     OLLAMA_BASE_URL=http://127.0.0.1:11434 uvicorn main:app
+# and the image-description script (ollama python client):
+#     OLLAMA_HOST=http://127.0.0.1:11434 python Image-Testo.py ...
+
+
+class FakeOllamaConfig:
+    def __init__(self, latency_ms=200.0, jitter_ms=50.0, tail_prob=0.0, tail_latency_ms=3000.0,
+                 error_rate=0.0, tokens_per_sec=200.0, reply_words=60, max_concurrency=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tail_prob = tail_prob
+        self.tail_latency_ms = tail_latency_ms
+        self.error_rate = error_rate
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_words = reply_words
+        # Like a remote quota: at most this many requests are served at once, the rest queue (0 = no limit)
+        self.max_concurrency = max_concurrency
+
+    def sample_latency(self) -> float:
+        """Seconds before the first token: normal latency plus an occasional tail spike."""
+        if self.tail_prob and random.random() < self.tail_prob:
+            return self.tail_latency_ms / 1000
+        return max(0.0, random.gauss(self.latency_ms, self.jitter_ms) / 1000)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def build_reply(messages, reply_words: int) -> str:
+    """A deterministic-looking reply that mentions what was asked."""
+    last = messages[-1] if messages else {}
+    if last.get("images"):
+        total = sum(len(image) for image in last["images"])
+        head = f"Stub description of {len(last['images'])} image(s) ({total} base64 bytes)."
+    else:
+        question = str(last.get("content", ""))[-120:].replace("\n", " ")
+        head = f"Stub answer to: {question}."
+    filler = " ".join(f"word{i}" for i in range(reply_words))
+    return f"{head} {filler}"
+
+
+def make_handler(config: FakeOllamaConfig):
+    capacity = threading.Semaphore(config.max_concurrency) if config.max_concurrency else None
+
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real server
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json(200, {"models": [{"name": "stub:latest", "model": "stub:latest"}]})
+            elif self.path == "/api/version":
+                self._send_json(200, {"version": "0.0.0-fake"})
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if self.path != "/api/chat":
+                self._send_json(404, {"error": "not found"})
+                return
+            if capacity is None:
+                self._chat(request)
+            else:
+                with capacity:
+                    self._chat(request)
+
+        def _chat(self, request: dict):
+            time.sleep(config.sample_latency())
+            if config.error_rate and random.random() < config.error_rate:
+                self._send_json(503, {"error": "fake transient failure"})
+                return
+
+            model = request.get("model", "stub")
+            messages = request.get("messages", [])
+            reply = build_reply(messages, config.reply_words)
+            prompt_chars = sum(len(str(m.get("content", ""))) for m in messages)
+
+            if not request.get("stream", True):
+                self._send_json(200, {
+                    "model": model,
+                    "created_at": _now(),
+                    "message": {"role": "assistant", "content": reply},
+                    "done": True,
+                    "done_reason": "stop",
+                    "prompt_eval_count": prompt_chars // 4,
+                    "eval_count": len(reply.split()),
+                })
+                return
+
+            # Streaming: NDJSON, one word per chunk, chunked transfer encoding
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            delay = 1.0 / config.tokens_per_sec if config.tokens_per_sec else 0.0
+            words = reply.split(" ")
+            for i, word in enumerate(words):
+                piece = word if i == 0 else f" {word}"
+                self._write_chunk({"model": model, "created_at": _now(),
+                                   "message": {"role": "assistant", "content": piece}, "done": False})
+                if delay:
+                    time.sleep(delay)
+            self._write_chunk({"model": model, "created_at": _now(),
+                               "message": {"role": "assistant", "content": ""}, "done": True,
+                               "done_reason": "stop", "prompt_eval_count": prompt_chars // 4,
+                               "eval_count": len(words)})
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, body: dict):
+            data = json.dumps(body).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+    return FakeOllamaHandler
+
+
+def start_fake_ollama(host="127.0.0.1", port=0, config: FakeOllamaConfig = None):
+    """
+    Starts the fake server in a background thread.
+    Returns (server, base_url); call server.shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(config or FakeOllamaConfig()))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Ollama-compatible server for offline testing.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency-ms", type=float, default=200.0, help="Mean time to first token")
+    parser.add_argument("--jitter-ms", type=float, default=50.0)
+    parser.add_argument("--tail-prob", type=float, default=0.0, help="Probability of a latency spike")
+    parser.add_argument("--tail-latency-ms", type=float, default=3000.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Probability of a 503 response")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="Streaming speed")
+    parser.add_argument("--reply-words", type=int, default=60)
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests served at once (0 = no limit)")
+    args = parser.parse_args()
+
+    config = FakeOllamaConfig(args.latency_ms, args.jitter_ms, args.tail_prob, args.tail_latency_ms,
+                              args.error_rate, args.tokens_per_sec, args.reply_words, args.max_concurrency)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    print(f"Fake Ollama listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
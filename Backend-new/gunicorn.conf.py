@@ -0,0 +1,32 @@
+# Multi-worker serving configuration.
+#
+# Usage (from the Backend-new/ directory):
+#     gunicorn -c gunicorn.conf.py main:app
+#
+# The app is imported once in the master process with RAG_PRELOAD_MODELS=1,
+# which loads the bge embedding model *before* the workers are forked.
+# Every worker then shares those weights (copy-on-write) instead of loading
+# its own copy. The LLM client and the Chroma client are still created per
+# worker in the FastAPI lifespan, because sockets and SQLite handles must
+# not be shared across a fork.
+#
+# GPU hosts: a CUDA context does not survive fork(), so when the embedding
+# model runs on "cuda" nothing is preloaded in the master and every worker
+# loads its own copy (one per worker in GPU memory) after it is forked.
+# Keep RAG_WORKERS small there.
+import multiprocessing
+import os
+
+os.environ.setdefault("RAG_PRELOAD_MODELS", "1")
+# Keep each worker's torch/BLAS pool small so N workers don't oversubscribe the cores
+os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+bind = os.getenv("RAG_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("RAG_WORKERS", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True
+
+# The pipeline and remote LLM calls can be slow; don't let gunicorn kill busy workers
+timeout = int(os.getenv("RAG_WORKER_TIMEOUT", 300))
+graceful_timeout = 30
+keepalive = 5
@@ -0,0 +1,131 @@
+import json
+import mmap
+import os
+from io import BytesIO
+from pathlib import Path
+
+# --- Image handoff between Base.py and Image-Testo.py ---
+# Base.py used to write every extracted image to its own file, and
+# Image-Testo.py re-read each file for the VLM request. Now Base.py
+# prepares each image once (skip if decorative, downscale to the VLM input
+# size, re-encode) and appends it to a single blob file with a JSON offset
+# index. Image-Testo.py memory-maps the blob and hands the bytes straight
+# to the VLM client.
+
+# --- 1. Configuration ---
+
+# Longest side sent to the VLM; larger images are downscaled (the model resizes them anyway)
+VLM_MAX_SIDE = int(os.getenv("VLM_MAX_SIDE", 1024))
+# Images smaller than this (either side, in pixels) are treated as decorative and skipped
+MIN_IMAGE_SIDE = int(os.getenv("MIN_IMAGE_SIDE", 48))
+MIN_IMAGE_PIXELS = int(os.getenv("MIN_IMAGE_PIXELS", 96 * 96))
+JPEG_QUALITY = int(os.getenv("VLM_JPEG_QUALITY", 85))
+
+BLOB_FILENAME = "images.bin"
+INDEX_FILENAME = "images.json"
+
+
+def prepare_image(image):
+    """
+    Returns (jpeg_bytes, width, height) ready for the VLM, or None if the
+    image is too small to carry information (icons, rules, bullets).
+    """
+    width, height = image.size
+    if min(width, height) < MIN_IMAGE_SIDE or width * height < MIN_IMAGE_PIXELS:
+        return None
+
+    if image.mode in ("RGBA", "LA", "P"):
+        # Flatten transparency onto white, the way the page shows it
+        from PIL import Image
+        rgba = image.convert("RGBA")
+        background = Image.new("RGB", rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    elif image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if max(width, height) > VLM_MAX_SIDE:
+        image = image.copy()
+        image.thumbnail((VLM_MAX_SIDE, VLM_MAX_SIDE))
+
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return buffer.getvalue(), image.size[0], image.size[1]
+
+
+class ImageBlobWriter:
+    """Appends prepared images to <directory>/images.bin and writes the offset index on close."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self._blob = open(self.directory / BLOB_FILENAME, "wb")
+        self._index = {"images": {}, "skipped": []}
+        self.kept = 0
+        self.skipped = 0
+        self.bytes_written = 0
+
+    def add(self, name: str, image) -> bool:
+        """Prepares and stores one PIL image. Returns False if it was skipped as decorative."""
+        prepared = prepare_image(image)
+        if prepared is None:
+            self._index["skipped"].append(name)
+            self.skipped += 1
+            return False
+        data, width, height = prepared
+        self._index["images"][name] = {
+            "offset": self._blob.tell(),
+            "length": len(data),
+            "width": width,
+            "height": height,
+            "original_width": image.size[0],
+            "original_height": image.size[1],
+        }
+        self._blob.write(data)
+        self.kept += 1
+        self.bytes_written += len(data)
+        return True
+
+    def close(self):
+        self._blob.close()
+        tmp = self.directory / f"{INDEX_FILENAME}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, self.directory / INDEX_FILENAME)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ImageBlobReader:
+    """Read-only view of an image blob; get() returns bytes sliced from the memory map."""
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        with open(self.directory / INDEX_FILENAME, encoding="utf-8") as f:
+            index = json.load(f)
+        self.images = index["images"]
+        self.skipped = set(index["skipped"])
+        self._file = open(self.directory / BLOB_FILENAME, "rb")
+        # mmap can't map an empty file
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if self.images else None
+
+    @classmethod
+    def open_if_present(cls, directory):
+        """Returns a reader, or None if the directory has no blob (e.g. output of an older Base.py)."""
+        if not (Path(directory) / INDEX_FILENAME).exists():
+            return None
+        return cls(directory)
+
+    def get(self, name: str):
+        entry = self.images.get(name)
+        if entry is None:
+            return None
+        return self._map[entry["offset"]:entry["offset"] + entry["length"]]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
@@ -0,0 +1,132 @@
+import hashlib
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+import job_registry
+import metrics
+
+# --- Ingestion pipeline layout ---
+# Shared by the server's per-upload pipeline (main.py) and the bulk loader
+# (bulk_ingest.py): how a PDF maps to a collection name and intermediate
+# files, and how each of the three stages is invoked.
+
+BACKEND_DIR = Path(__file__).parent
+# Per-document intermediate files (Markdown, image blob) go to DOCUMENTS_DIR/<collection>.
+# A root of their own, so a collection named "pdf" or "chroma_db" can't land on app data.
+DOCUMENTS_DIR = Path(os.getenv("DOCUMENTS_DIR", BACKEND_DIR / "documents"))
+
+# The stages in order: PDF -> Markdown + images, image descriptions, embeddings
+STAGES = ("Base.py", "Image-Testo.py", "Emmbed.py")
+
+
+def sanitize_name(name: str) -> str:
+    """Cleans a string to be a valid ChromaDB collection name."""
+    # Replace spaces with underscores
+    name = name.replace(' ', '_')
+    # Remove any character that is not a letter, number, underscore, hyphen, or period
+    name = re.sub(r'[^a-zA-Z0-9._-]', '', name)
+
+    # Ensure it's at least 3 chars long
+    if len(name) < 3:
+        name = f"doc_{name}"
+
+    # Ensure it doesn't start or end with a non-alphanumeric char
+    # (ChromaDB requires start/end with [a-zA-Z0-9])
+    if not name[0].isalnum():
+        name = f"c_{name}"
+    if not name[-1].isalnum():
+        name = f"{name}_c"
+
+    # Ensure it's not too long (Chroma's actual limit is 63)
+    return name[:63]
+
+
+def collection_name_for(pdf_path) -> str:
+    """
+    The collection for a PDF: its sanitized stem, unless that collection
+    already belongs to a different PDF. sanitize_name is lossy ("a b.pdf"
+    and "a_b.pdf" both become "a_b") and the same file name can sit in two
+    directories, so the later file gets a suffix derived from its resolved
+    path instead of being mixed into the earlier file's collection. Each
+    candidate is checked against the registry until a free one is found.
+    """
+    resolved = Path(pdf_path).resolve()
+    name = sanitize_name(resolved.stem)
+    candidate = name
+    attempt = 0
+    while True:
+        job = job_registry.get_job(candidate)
+        if job is None or not job["pdf_path"] or Path(job["pdf_path"]).resolve() == resolved:
+            return candidate
+        suffix = hashlib.sha1(f"{resolved}:{attempt}".encode("utf-8")).hexdigest()[:6]
+        candidate = f"{name[:56]}_{suffix}"
+        attempt += 1
+
+
+def is_document_dir(path) -> bool:
+    """True if path is a directory strictly inside DOCUMENTS_DIR (the only ones that may be deleted)."""
+    path, root = Path(path).resolve(), DOCUMENTS_DIR.resolve()
+    return path != root and path.is_relative_to(root)
+
+
+class DocumentPaths:
+    """
+    Collection name and intermediate files for one PDF. The intermediate
+    files are keyed on the collection name, which is unique, so two PDFs
+    with the same stem never share (or delete) each other's directory.
+    """
+
+    def __init__(self, pdf_path, collection_name: str = None):
+        self.pdf_path = Path(pdf_path)
+        self.collection_name = collection_name or sanitize_name(self.pdf_path.stem)
+        self.output_dir = DOCUMENTS_DIR / self.collection_name
+        # Base.py names the Markdown after its output directory
+        self.base_md_file = self.output_dir / f"{self.collection_name}.md"
+        self.described_md_file = self.output_dir / f"{self.collection_name}_with_descriptions.md"
+
+    def stage_output(self, stage: str) -> Path:
+        """The file a stage leaves behind (used to check a checkpoint is still valid)."""
+        if stage == "Base.py":
+            return self.base_md_file
+        if stage == "Image-Testo.py":
+            return self.described_md_file
+        return None
+
+
+def stage_command(stage: str, paths: DocumentPaths) -> list:
+    if stage == "Base.py":
+        # Note: Base.py still uses the *original* PDF path
+        return [sys.executable, "Base.py", str(paths.pdf_path), str(paths.output_dir)]
+    if stage == "Image-Testo.py":
+        return [
+            sys.executable,
+            "Image-Testo.py",
+            str(paths.base_md_file),     # input_file
+            str(paths.output_dir),       # image_directory
+            str(paths.described_md_file) # output_file
+        ]
+    if stage == "Emmbed.py":
+        # Emmbed.py uses the *sanitized* file_stem as the collection name
+        return [sys.executable, "Emmbed.py", str(paths.described_md_file), paths.collection_name]
+    raise ValueError(f"Unknown pipeline stage: {stage}")
+
+
+def run_stage(stage: str, paths: DocumentPaths, profile_run=None):
+    """
+    Runs one stage as a subprocess in the backend directory. Raises CalledProcessError on failure.
+    With a profiler.ProfileRun the stage runs under the profiler.
+    """
+    command = stage_command(stage, paths)
+    if profile_run is not None:
+        command = profile_run.wrap_command(command, stage)
+    with metrics.span("ingest", stage):
+        try:
+            # RAG_TENANT: the document's share of the model scheduler (see scheduler.py)
+            return subprocess.run(command, check=True, capture_output=True, text=True, cwd=BACKEND_DIR,
+                                  env=dict(os.environ, RAG_TENANT=paths.collection_name))
+        except subprocess.CalledProcessError as e:
+            e.cmd = stage_command(stage, paths)  # Report the stage, not the profiler wrapper
+            raise
@@ -0,0 +1,825 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+# --- 1. Configuration ---
+
+# A single SQLite file shared by every worker process on this host.
+# All cross-process state (pipeline jobs, collection readiness) lives here
+# so that any uvicorn/gunicorn worker can answer for any upload.
+REGISTRY_PATH = Path(os.getenv("RAG_STATE_DB", Path(__file__).parent / "rag_state.db"))
+
+# How long a writer waits for the database lock before giving up (seconds)
+BUSY_TIMEOUT = 30
+
+# Job states
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+# Model call states (see scheduler.py)
+CALL_WAITING = "waiting"
+CALL_RUNNING = "running"
+
+# Collection storage states (see collection_admin.py)
+COLLECTION_HOT = "hot"              # In Chroma
+COLLECTION_EVICTING = "evicting"    # Being exported to cold storage
+COLLECTION_COLD = "cold"            # Only in cold storage
+COLLECTION_RESTORING = "restoring"  # Being loaded back into Chroma
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    collection_name TEXT PRIMARY KEY,
+    pdf_path        TEXT,
+    status          TEXT NOT NULL,
+    stage           TEXT,
+    error           TEXT,
+    pid             INTEGER,
+    created_at      REAL NOT NULL,
+    updated_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS collection_versions (
+    collection_name TEXT PRIMARY KEY,
+    version         INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+    collection_name TEXT PRIMARY KEY,
+    pdf_path        TEXT NOT NULL,
+    completed_stage TEXT NOT NULL,
+    updated_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS collection_usage (
+    collection_name TEXT PRIMARY KEY,
+    last_used_at    REAL NOT NULL,
+    state           TEXT NOT NULL,
+    cold_path       TEXT
+);
+
+CREATE TABLE IF NOT EXISTS uploads (
+    upload_id       TEXT PRIMARY KEY,
+    filename        TEXT NOT NULL,
+    size            INTEGER NOT NULL,
+    part_size       INTEGER NOT NULL,
+    created_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS upload_parts (
+    upload_id       TEXT NOT NULL,
+    part            INTEGER NOT NULL,
+    size            INTEGER NOT NULL,
+    sha256          TEXT NOT NULL,
+    PRIMARY KEY (upload_id, part)
+);
+
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id      TEXT PRIMARY KEY,
+    collection_name TEXT NOT NULL,
+    data            TEXT NOT NULL,
+    updated_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS profiles (
+    profile_id      TEXT PRIMARY KEY,
+    target          TEXT NOT NULL,   -- "chat" or "ingest"
+    collection_name TEXT,            -- Only requests/jobs for this collection (NULL: any)
+    mode            TEXT NOT NULL,   -- "sampling" or "deterministic"
+    remaining       INTEGER NOT NULL,
+    captured        INTEGER NOT NULL,
+    created_at      REAL NOT NULL,
+    expires_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS model_calls (
+    ticket_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+    pool            TEXT NOT NULL,
+    tenant          TEXT NOT NULL,
+    priority        INTEGER NOT NULL,  -- 0 = interactive; higher classes are background
+    cost            REAL NOT NULL,
+    start_tag       REAL NOT NULL,     -- Virtual start time (start-time fair queuing)
+    state           TEXT NOT NULL,     -- "waiting" or "running"
+    pid             INTEGER NOT NULL,
+    created_at      REAL NOT NULL,
+    granted_at      REAL
+);
+
+CREATE TABLE IF NOT EXISTS model_tenants (
+    pool            TEXT NOT NULL,
+    tenant          TEXT NOT NULL,
+    finish_tag      REAL NOT NULL,     -- Virtual finish time of the tenant's last call
+    tokens          REAL NOT NULL,     -- Token bucket
+    refilled_at     REAL NOT NULL,
+    PRIMARY KEY (pool, tenant)
+);
+
+CREATE TABLE IF NOT EXISTS model_pools (
+    pool            TEXT PRIMARY KEY,
+    virtual_time    REAL NOT NULL
+);
+
+-- Prefetches are per client (one chat page), so one user's typing never answers another's question.
+-- They only live for minutes: the earlier shared "prefetches" table is simply dropped.
+DROP TABLE IF EXISTS prefetches;
+CREATE TABLE IF NOT EXISTS client_prefetches (
+    client_id       TEXT NOT NULL,     -- Random id the chat page sends with /chat/prefetch and /chat/
+    collection_name TEXT NOT NULL,
+    query           TEXT NOT NULL,     -- Normalized in-progress question
+    version         INTEGER NOT NULL,  -- Collection version the chunks were retrieved from
+    embedding       BLOB NOT NULL,     -- float32 query embedding
+    docs            TEXT NOT NULL,     -- JSON: retrieved chunks (page_content + metadata)
+    seconds         REAL NOT NULL,     -- What the embed + search took
+    created_at      REAL NOT NULL,
+    PRIMARY KEY (client_id, collection_name, query)
+);
+"""
+
+_initialized = False
+
+# Per-thread read connection for hot-path lookups (see get_collection_version)
+_local = threading.local()
+
+
+def _connect() -> sqlite3.Connection:
+    """
+    Opens a short-lived connection to the registry.
+    WAL mode lets readers in other workers proceed while one worker writes.
+    """
+    global _initialized
+
+    conn = sqlite3.connect(REGISTRY_PATH, timeout=BUSY_TIMEOUT, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if not _initialized:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(_SCHEMA)
+        _initialized = True
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _pid_alive(pid) -> bool:
+    """Checks whether a worker process on this host is still running."""
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def init_registry():
+    """Creates the registry file and tables. Safe to call from every worker."""
+    conn = _connect()
+    conn.close()
+    print(f"Job registry ready at: {REGISTRY_PATH}")
+
+
+def claim_job(collection_name: str, pdf_path: str) -> bool:
+    """
+    Atomically registers a new processing job for a collection.
+
+    Returns False if another live worker is already processing the same
+    collection, so the same PDF is never run through the pipeline twice.
+    A job left 'running' by a worker that has since died can be re-claimed.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT status, pid FROM jobs WHERE collection_name = ?",
+            (collection_name,),
+        ).fetchone()
+
+        if row is not None and row["status"] in (STATUS_QUEUED, STATUS_RUNNING) and _pid_alive(row["pid"]):
+            conn.execute("ROLLBACK")
+            return False
+
+        conn.execute(
+            """
+            INSERT INTO jobs (collection_name, pdf_path, status, stage, error, pid, created_at, updated_at)
+            VALUES (?, ?, ?, NULL, NULL, ?, ?, ?)
+            ON CONFLICT(collection_name) DO UPDATE SET
+                pdf_path = excluded.pdf_path,
+                status = excluded.status,
+                stage = NULL,
+                error = NULL,
+                pid = excluded.pid,
+                created_at = excluded.created_at,
+                updated_at = excluded.updated_at
+            """,
+            (collection_name, pdf_path, STATUS_QUEUED, os.getpid(), now, now),
+        )
+        conn.execute("COMMIT")
+        return True
+    finally:
+        conn.close()
+
+
+def update_job(collection_name: str, status: str, stage: str = None, error: str = None):
+    """Records the current status/stage of a job. Called by the worker running it."""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, stage = ?, error = ?, pid = ?, updated_at = ? WHERE collection_name = ?",
+            (status, stage, error, os.getpid(), time.time(), collection_name),
+        )
+    finally:
+        conn.close()
+
+
+def _row_to_job(row):
+    job = dict(row)
+    # A job whose worker died mid-pipeline will never finish on its own
+    if job["status"] in (STATUS_QUEUED, STATUS_RUNNING) and not _pid_alive(job["pid"]):
+        job["status"] = STATUS_FAILED
+        job["error"] = job["error"] or "Worker process exited before the pipeline finished."
+    return job
+
+
+def get_job(collection_name: str):
+    """Returns the job record for a collection as a dict, or None if unknown."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT * FROM jobs WHERE collection_name = ?", (collection_name,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return _row_to_job(row) if row is not None else None
+
+
+def list_jobs():
+    """Returns all known jobs, most recently updated first."""
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM jobs ORDER BY updated_at DESC").fetchall()
+    finally:
+        conn.close()
+    return [_row_to_job(row) for row in rows]
+
+
+def delete_job(collection_name: str):
+    """Forgets everything recorded about a collection except its version counter."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        for table in ("jobs", "ingest_checkpoints", "collection_usage", "sessions"):
+            conn.execute(f"DELETE FROM {table} WHERE collection_name = ?", (collection_name,))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def save_checkpoint(collection_name: str, pdf_path: str, completed_stage: str):
+    """Records the last pipeline stage a document finished, so a bulk run can resume after it."""
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT INTO ingest_checkpoints (collection_name, pdf_path, completed_stage, updated_at)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(collection_name) DO UPDATE SET
+                pdf_path = excluded.pdf_path,
+                completed_stage = excluded.completed_stage,
+                updated_at = excluded.updated_at
+            """,
+            (collection_name, pdf_path, completed_stage, time.time()),
+        )
+    finally:
+        conn.close()
+
+
+def get_checkpoint(collection_name: str):
+    """Returns (pdf_path, completed_stage) for a document, or None."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT pdf_path, completed_stage FROM ingest_checkpoints WHERE collection_name = ?",
+            (collection_name,),
+        ).fetchone()
+    finally:
+        conn.close()
+    return (row["pdf_path"], row["completed_stage"]) if row is not None else None
+
+
+def clear_checkpoint(collection_name: str):
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM ingest_checkpoints WHERE collection_name = ?", (collection_name,))
+    finally:
+        conn.close()
+
+
+def bump_collection_version(collection_name: str) -> int:
+    """
+    Increments a collection's version counter and returns the new value.
+    Called by Emmbed.py after every ingestion so that cached retrieval
+    results for the previous contents are invalidated in every worker.
+    """
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT INTO collection_versions (collection_name, version) VALUES (?, 1)
+            ON CONFLICT(collection_name) DO UPDATE SET version = version + 1
+            """,
+            (collection_name,),
+        )
+        row = conn.execute(
+            "SELECT version FROM collection_versions WHERE collection_name = ?", (collection_name,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row["version"]
+
+
+def get_collection_version(collection_name: str) -> int:
+    """
+    Returns a collection's current version (0 if it was never ingested).
+    This is on the chat hot path, so it reuses a per-thread connection
+    instead of opening a new one for every lookup.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "pid", None) != os.getpid():
+        conn = _connect()
+        _local.conn = conn
+        _local.pid = os.getpid()
+    row = conn.execute(
+        "SELECT version FROM collection_versions WHERE collection_name = ?", (collection_name,)
+    ).fetchone()
+    return row["version"] if row is not None else 0
+
+
+def record_collection_use(collection_name: str, when: float = None):
+    """Updates the time a collection was last queried (drives TTL eviction)."""
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT INTO collection_usage (collection_name, last_used_at, state) VALUES (?, ?, ?)
+            ON CONFLICT(collection_name) DO UPDATE SET last_used_at = MAX(last_used_at, excluded.last_used_at)
+            """,
+            (collection_name, time.time() if when is None else when, COLLECTION_HOT),
+        )
+    finally:
+        conn.close()
+
+
+def get_collection_usage(collection_name: str):
+    """Returns {last_used_at, state, cold_path} for a collection, or None if it was never used."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT * FROM collection_usage WHERE collection_name = ?", (collection_name,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row is not None else None
+
+
+def list_collection_usage():
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM collection_usage").fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def transition_collection(collection_name: str, from_state: str, to_state: str, cold_path: str = None) -> bool:
+    """
+    Atomically moves a collection from one storage state to another.
+    Returns False if it was not in from_state, so when several workers
+    race to evict or restore the same collection exactly one of them wins.
+    """
+    conn = _connect()
+    try:
+        cursor = conn.execute(
+            "UPDATE collection_usage SET state = ?, cold_path = ? WHERE collection_name = ? AND state = ?",
+            (to_state, cold_path, collection_name, from_state),
+        )
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+
+def vacuum_registry():
+    """Rebuilds the registry file to return the space of deleted rows."""
+    conn = _connect()
+    try:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def create_upload(upload_id: str, filename: str, size: int, part_size: int):
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO uploads (upload_id, filename, size, part_size, created_at) VALUES (?, ?, ?, ?, ?)",
+            (upload_id, filename, size, part_size, time.time()),
+        )
+    finally:
+        conn.close()
+
+
+def get_upload(upload_id: str):
+    """Returns an upload as a dict with "parts" ({part number: {size, sha256}}), or None if unknown."""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM uploads WHERE upload_id = ?", (upload_id,)).fetchone()
+        if row is None:
+            return None
+        parts = conn.execute(
+            "SELECT part, size, sha256 FROM upload_parts WHERE upload_id = ?", (upload_id,)
+        ).fetchall()
+    finally:
+        conn.close()
+    upload = dict(row)
+    upload["parts"] = {p["part"]: {"size": p["size"], "sha256": p["sha256"]} for p in parts}
+    return upload
+
+
+def record_upload_part(upload_id: str, part: int, size: int, sha256: str):
+    """Records a received part. Any worker may receive any part of an upload."""
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT INTO upload_parts (upload_id, part, size, sha256) VALUES (?, ?, ?, ?)
+            ON CONFLICT(upload_id, part) DO UPDATE SET size = excluded.size, sha256 = excluded.sha256
+            """,
+            (upload_id, part, size, sha256),
+        )
+    finally:
+        conn.close()
+
+
+def forget_upload_part(upload_id: str, part: int):
+    """Marks a part as not received (it is being rewritten)."""
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM upload_parts WHERE upload_id = ? AND part = ?", (upload_id, part))
+    finally:
+        conn.close()
+
+
+def delete_upload(upload_id: str):
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM upload_parts WHERE upload_id = ?", (upload_id,))
+        conn.execute("DELETE FROM uploads WHERE upload_id = ?", (upload_id,))
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def list_expired_uploads(max_age: float):
+    """Ids of uploads started more than max_age seconds ago."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT upload_id FROM uploads WHERE created_at < ?", (time.time() - max_age,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [row["upload_id"] for row in rows]
+
+
+def save_session(session_id: str, collection_name: str, data: str):
+    """Stores a serialized conversation session so any worker can continue it."""
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT INTO sessions (session_id, collection_name, data, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET
+                collection_name = excluded.collection_name,
+                data = excluded.data,
+                updated_at = excluded.updated_at
+            """,
+            (session_id, collection_name, data, time.time()),
+        )
+    finally:
+        conn.close()
+
+
+def load_session(session_id: str, max_age: float):
+    """Returns (collection_name, data) for a session, or None if unknown or expired."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT collection_name, data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+    finally:
+        conn.close()
+    if row is None or time.time() - row["updated_at"] > max_age:
+        return None
+    return row["collection_name"], row["data"]
+
+
+def purge_sessions(max_age: float) -> int:
+    """Deletes sessions idle for longer than max_age seconds. Returns how many were removed."""
+    conn = _connect()
+    try:
+        cursor = conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - max_age,))
+        return cursor.rowcount
+    finally:
+        conn.close()
+
+
+def create_profile(profile_id: str, target: str, collection_name: str, mode: str, count: int, ttl: float):
+    """Arms a profile for the next `count` chat requests or ingestion jobs (see profiler.py)."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute(
+            """
+            INSERT INTO profiles (profile_id, target, collection_name, mode, remaining, captured, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, 0, ?, ?)
+            """,
+            (profile_id, target, collection_name, mode, count, now, now + ttl),
+        )
+    finally:
+        conn.close()
+
+
+def get_profile(profile_id: str):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM profiles WHERE profile_id = ?", (profile_id,)).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row is not None else None
+
+
+def list_profiles():
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT * FROM profiles ORDER BY created_at DESC").fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def delete_profile(profile_id: str):
+    conn = _connect()
+    try:
+        conn.execute("DELETE FROM profiles WHERE profile_id = ?", (profile_id,))
+    finally:
+        conn.close()
+
+
+def count_armed_profiles() -> int:
+    """How many profiles are still waiting for runs (cheap; polled by every worker)."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT COUNT(*) AS n FROM profiles WHERE remaining > 0 AND expires_at > ?", (time.time(),)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row["n"]
+
+
+def claim_profile_run(target: str, collection_name: str):
+    """
+    Atomically takes one run from the oldest armed profile matching a chat
+    request or ingestion job. Returns (profile_id, mode, run number) or None.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            """
+            SELECT profile_id, mode, captured FROM profiles
+            WHERE target = ? AND remaining > 0 AND expires_at > ?
+              AND (collection_name IS NULL OR collection_name = ?)
+            ORDER BY created_at LIMIT 1
+            """,
+            (target, time.time(), collection_name),
+        ).fetchone()
+        if row is None:
+            conn.execute("ROLLBACK")
+            return None
+        conn.execute(
+            "UPDATE profiles SET remaining = remaining - 1, captured = captured + 1 WHERE profile_id = ?",
+            (row["profile_id"],),
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return row["profile_id"], row["mode"], row["captured"] + 1
+
+
+def _dispatch_model_calls(conn, pool: str, limits: dict):
+    """
+    Starts waiting model calls while the pool has free slots: interactive
+    calls first, then within a priority class the lowest virtual start tag
+    whose tenant has a token left. Background classes get at most
+    limits["background_slots"]. Runs inside the caller's transaction.
+    """
+    now = time.time()
+    # Calls of crashed processes, or held far too long, give their slot back
+    pids = [row["pid"] for row in conn.execute("SELECT DISTINCT pid FROM model_calls WHERE pool = ?", (pool,))]
+    for pid in pids:
+        if not _pid_alive(pid):
+            conn.execute("DELETE FROM model_calls WHERE pool = ? AND pid = ?", (pool, pid))
+    conn.execute(
+        "DELETE FROM model_calls WHERE pool = ? AND state = ? AND granted_at < ?",
+        (pool, CALL_RUNNING, now - limits["max_hold"]),
+    )
+
+    running = {row["priority"]: row["n"] for row in conn.execute(
+        "SELECT priority, COUNT(*) AS n FROM model_calls WHERE pool = ? AND state = ? GROUP BY priority",
+        (pool, CALL_RUNNING),
+    )}
+    free = limits["slots"] - sum(running.values())
+    background = sum(n for priority, n in running.items() if priority > 0)
+    if free <= 0:
+        return
+    waiting = conn.execute(
+        "SELECT ticket_id, tenant, priority, cost, start_tag FROM model_calls WHERE pool = ? AND state = ? "
+        "ORDER BY priority, start_tag, ticket_id",
+        (pool, CALL_WAITING),
+    ).fetchall()
+    if not waiting:
+        return
+
+    buckets = {}
+    for row in conn.execute("SELECT tenant, tokens, refilled_at FROM model_tenants WHERE pool = ?", (pool,)):
+        tokens = row["tokens"] + (now - row["refilled_at"]) * limits["rate"]
+        buckets[row["tenant"]] = min(limits["burst"], tokens)
+    virtual_time = None
+    for call in waiting:
+        if free <= 0:
+            break
+        if call["priority"] > 0 and background >= limits["background_slots"]:
+            continue
+        if limits["rate"] > 0 and buckets.get(call["tenant"], limits["burst"]) < call["cost"]:
+            continue  # Over its rate; later calls of other tenants may still go
+        conn.execute(
+            "UPDATE model_calls SET state = ?, granted_at = ? WHERE ticket_id = ?",
+            (CALL_RUNNING, now, call["ticket_id"]),
+        )
+        buckets[call["tenant"]] = buckets.get(call["tenant"], limits["burst"]) - call["cost"]
+        virtual_time = max(virtual_time or 0.0, call["start_tag"])
+        free -= 1
+        if call["priority"] > 0:
+            background += 1
+
+    for tenant, tokens in buckets.items():
+        conn.execute(
+            "UPDATE model_tenants SET tokens = ?, refilled_at = ? WHERE pool = ? AND tenant = ?",
+            (tokens, now, pool, tenant),
+        )
+    if virtual_time is not None:
+        conn.execute(
+            "UPDATE model_pools SET virtual_time = MAX(virtual_time, ?) WHERE pool = ?", (virtual_time, pool)
+        )
+
+
+def enqueue_model_call(pool: str, tenant: str, priority: int, cost: float, weight: float, limits: dict):
+    """
+    Queues a model call and starts whatever the pool has room for.
+    Returns (ticket_id, state); the caller waits until the state is CALL_RUNNING.
+    """
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("INSERT OR IGNORE INTO model_pools (pool, virtual_time) VALUES (?, 0)", (pool,))
+        conn.execute(
+            "INSERT OR IGNORE INTO model_tenants (pool, tenant, finish_tag, tokens, refilled_at) VALUES (?, ?, 0, ?, ?)",
+            (pool, tenant, limits["burst"], now),
+        )
+        virtual_time = conn.execute("SELECT virtual_time FROM model_pools WHERE pool = ?", (pool,)).fetchone()[0]
+        finish_tag = conn.execute(
+            "SELECT finish_tag FROM model_tenants WHERE pool = ? AND tenant = ?", (pool, tenant)
+        ).fetchone()[0]
+        # A tenant that was idle starts at the current virtual time instead of "catching up"
+        start_tag = max(virtual_time, finish_tag)
+        conn.execute(
+            "UPDATE model_tenants SET finish_tag = ? WHERE pool = ? AND tenant = ?",
+            (start_tag + cost / weight, pool, tenant),
+        )
+        ticket_id = conn.execute(
+            "INSERT INTO model_calls (pool, tenant, priority, cost, start_tag, state, pid, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (pool, tenant, priority, cost, start_tag, CALL_WAITING, os.getpid(), now),
+        ).lastrowid
+        _dispatch_model_calls(conn, pool, limits)
+        state = conn.execute("SELECT state FROM model_calls WHERE ticket_id = ?", (ticket_id,)).fetchone()[0]
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return ticket_id, state
+
+
+def model_call_state(ticket_id: int, pool: str = None, limits: dict = None):
+    """
+    The state of a queued call (None if it is gone). With pool and limits,
+    first dispatches waiting calls (token buckets refill over time, so a
+    waiting call can become eligible without another call finishing).
+    """
+    conn = _connect()
+    try:
+        if pool is not None:
+            conn.execute("BEGIN IMMEDIATE")
+            _dispatch_model_calls(conn, pool, limits)
+        row = conn.execute("SELECT state FROM model_calls WHERE ticket_id = ?", (ticket_id,)).fetchone()
+        if pool is not None:
+            conn.execute("COMMIT")
+    finally:
+        conn.close()
+    return row["state"] if row is not None else None
+
+
+def release_model_call(ticket_id: int, pool: str, limits: dict):
+    """Removes a finished (or abandoned) call and hands its slot to the next one."""
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM model_calls WHERE ticket_id = ?", (ticket_id,))
+        _dispatch_model_calls(conn, pool, limits)
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def list_model_calls(pool: str):
+    """Queued and running calls of a pool, for the admin API."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT tenant, priority, state, COUNT(*) AS calls, MIN(created_at) AS oldest FROM model_calls "
+            "WHERE pool = ? GROUP BY tenant, priority, state ORDER BY priority, tenant",
+            (pool,),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [dict(row) for row in rows]
+
+
+def save_prefetch(client_id: str, collection_name: str, query: str, version: int, embedding: bytes, docs: str,
+                  seconds: float, max_age: float):
+    """Stores a speculative retrieval (see rag_components.prefetch) and drops ones older than max_age."""
+    now = time.time()
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute("DELETE FROM client_prefetches WHERE created_at < ?", (now - max_age,))
+        conn.execute(
+            """
+            INSERT INTO client_prefetches (client_id, collection_name, query, version, embedding, docs, seconds,
+                                           created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(client_id, collection_name, query) DO UPDATE SET
+                version = excluded.version,
+                embedding = excluded.embedding,
+                docs = excluded.docs,
+                seconds = excluded.seconds,
+                created_at = excluded.created_at
+            """,
+            (client_id, collection_name, query, version, embedding, docs, seconds, now),
+        )
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
+
+
+def list_prefetch_queries(client_id: str, collection_name: str, max_age: float, limit: int = 50):
+    """(query, version) of a client's recent prefetches for a collection, newest first."""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT query, version FROM client_prefetches WHERE client_id = ? AND collection_name = ? "
+            "AND created_at >= ? ORDER BY created_at DESC LIMIT ?",
+            (client_id, collection_name, time.time() - max_age, limit),
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(row["query"], row["version"]) for row in rows]
+
+
+def get_prefetch(client_id: str, collection_name: str, query: str):
+    """A stored prefetch as a dict, or None."""
+    conn = _connect()
+    try:
+        row = conn.execute(
+            "SELECT * FROM client_prefetches WHERE client_id = ? AND collection_name = ? AND query = ?",
+            (client_id, collection_name, query),
+        ).fetchone()
+    finally:
+        conn.close()
+    return dict(row) if row is not None else None
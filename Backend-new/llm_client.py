@@ -0,0 +1,267 @@
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import httpx
+
+# --- 1. Configuration ---
+
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", 120))          # Per-attempt timeout (seconds)
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))      # Retries after the first attempt
+LLM_BACKOFF_BASE = float(os.getenv("LLM_BACKOFF_BASE", 0.5))
+LLM_BACKOFF_CAP = float(os.getenv("LLM_BACKOFF_CAP", 8.0))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0") == "1"              # Send a duplicate request after the hedge delay
+LLM_HEDGE_DELAY = os.getenv("LLM_HEDGE_DELAY")              # Fixed hedge delay (seconds); default is the observed p95
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", 32))
+
+# Statuses worth retrying: rate limiting and transient server-side failures
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+# The adaptive hedge delay needs a few samples before it is trusted
+MIN_LATENCY_SAMPLES = 20
+DEFAULT_HEDGE_DELAY = 5.0
+
+# LangChain message types -> Ollama chat roles
+_ROLE_MAP = {"human": "user", "ai": "assistant", "system": "system", "user": "user", "assistant": "assistant"}
+
+
+class LLMError(Exception):
+    """Raised when the LLM backend could not produce an answer after all retries."""
+
+
+class MalformedResponse(Exception):
+    """A reply that isn't a chat message: not JSON, an {"error": ...} body, or no message content."""
+
+
+def reply_content(data, stream: bool = False) -> str:
+    """
+    The message text of one /api/chat reply, or of one line of a streamed
+    reply (where lines without a message, like the final one, count as "").
+    Raises MalformedResponse for anything else.
+    """
+    if not isinstance(data, dict):
+        raise MalformedResponse(f"unexpected reply {str(data)[:200]!r}")
+    if data.get("error"):
+        raise MalformedResponse(f"backend error: {str(data['error'])[:200]}")
+    message = data.get("message")
+    if message is None and stream:
+        return ""
+    content = message.get("content") if isinstance(message, dict) else None
+    if not isinstance(content, str):
+        raise MalformedResponse(f"reply without message content: {str(data)[:200]!r}")
+    return content
+
+
+def parse_json(text) -> object:
+    try:
+        return json.loads(text)
+    except ValueError as e:
+        raise MalformedResponse(f"reply is not JSON ({e}): {str(text)[:200]!r}")
+
+
+class LatencyTracker:
+    """Keeps a window of recent request latencies to derive the hedge delay."""
+
+    def __init__(self, window: int = 200):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, pct: float):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < MIN_LATENCY_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(pct / 100 * len(samples)))
+        return samples[index]
+
+
+def to_ollama_messages(messages) -> list:
+    """
+    Accepts (role, content) tuples, {"role", "content"} dicts or LangChain
+    message objects and returns Ollama /api/chat messages.
+    """
+    converted = []
+    for message in messages:
+        if isinstance(message, tuple):
+            role, content = message
+        elif isinstance(message, dict):
+            role, content = message["role"], message["content"]
+        else:
+            role, content = message.type, message.content
+        converted.append({"role": _ROLE_MAP.get(role, role), "content": content})
+    return converted
+
+
+class OllamaChatClient:
+    """
+    Client for an Ollama-compatible /api/chat endpoint (Ollama Cloud, a local
+    Ollama, or the fake_ollama.py stub).
+
+    * One pooled httpx.Client, so requests reuse keep-alive connections
+      instead of paying a TCP/TLS handshake each time.
+    * Retries transport errors, 408/429/5xx and malformed replies (not JSON,
+      an {"error": ...} body, no message content) with jittered exponential backoff.
+    * Optional hedging: if the first attempt hasn't answered after the p95
+      latency (or LLM_HEDGE_DELAY), a duplicate is sent and the first reply wins.
+    """
+
+    def __init__(self, base_url: str, model: str, api_key: str = None, temperature: float = 0.7,
+                 timeout: float = LLM_TIMEOUT, max_retries: int = LLM_MAX_RETRIES,
+                 hedge: bool = LLM_HEDGE, hedge_delay: float = None):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.hedge = hedge
+        self.hedge_delay = hedge_delay if hedge_delay is not None else (
+            float(LLM_HEDGE_DELAY) if LLM_HEDGE_DELAY else None
+        )
+        self.latency = LatencyTracker()
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+        headers = {"Authorization": f"Bearer {api_key}"} if api_key else {}
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            headers=headers,
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=60.0,
+            ),
+        )
+        # Threads for hedged attempts
+        self._pool = ThreadPoolExecutor(max_workers=LLM_MAX_CONNECTIONS, thread_name_prefix="llm-hedge")
+
+    def close(self):
+        self._http.close()
+        self._pool.shutdown(wait=False)
+
+    # --- Request building ---
+
+    def _payload(self, messages, stream: bool) -> dict:
+        return {
+            "model": self.model,
+            "messages": to_ollama_messages(messages),
+            "stream": stream,
+            "options": {"temperature": self.temperature},
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        """Full-jitter exponential backoff."""
+        return random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * (2 ** attempt)))
+
+    # --- Non-streaming chat ---
+
+    def _attempt(self, payload: dict) -> str:
+        response = self._http.post("/api/chat", json=payload)
+        if response.status_code in RETRYABLE_STATUS:
+            raise httpx.HTTPStatusError(
+                f"Retryable status {response.status_code}", request=response.request, response=response
+            )
+        response.raise_for_status()
+        return reply_content(parse_json(response.content))
+
+    def _current_hedge_delay(self) -> float:
+        if self.hedge_delay is not None:
+            return self.hedge_delay
+        p95 = self.latency.percentile(95)
+        return p95 if p95 is not None else DEFAULT_HEDGE_DELAY
+
+    def _hedged_attempt(self, payload: dict) -> str:
+        """Runs one attempt, plus a duplicate if the first is slower than the hedge delay."""
+        primary = self._pool.submit(self._attempt, payload)
+        done, _ = wait([primary], timeout=self._current_hedge_delay())
+        if done:
+            return primary.result()
+
+        self.hedges_sent += 1
+        backup = self._pool.submit(self._attempt, payload)
+        pending = {primary, backup}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    last_error = e
+                    continue
+                if future is backup:
+                    self.hedges_won += 1
+                # The slower attempt is simply abandoned; its connection returns to the pool
+                return result
+        raise last_error
+
+    def chat(self, messages) -> str:
+        """Sends the messages and returns the assistant's reply text."""
+        payload = self._payload(messages, stream=False)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                if self.hedge:
+                    result = self._hedged_attempt(payload)
+                else:
+                    result = self._attempt(payload)
+                self.latency.record(time.perf_counter() - start)
+                return result
+            except (httpx.TransportError, httpx.HTTPStatusError, MalformedResponse) as e:
+                last_error = e
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in RETRYABLE_STATUS:
+                    break
+                if attempt < self.max_retries:
+                    delay = self._backoff(attempt)
+                    print(f"LLM request failed ({e}); retrying in {delay:.2f}s ({attempt + 1}/{self.max_retries})")
+                    time.sleep(delay)
+        raise LLMError(f"LLM backend at {self.base_url} failed: {last_error}")
+
+    # --- Streaming chat ---
+
+    def stream_chat(self, messages):
+        """
+        Yields the reply in pieces as the backend generates them.
+        Failures before the first piece are retried like chat(); once
+        output has started, an error is raised as LLMError. Streams are
+        never hedged: a duplicate would double the tokens generated for
+        every slow first token, so `hedge` only applies to chat().
+        """
+        payload = self._payload(messages, stream=True)
+        last_error = None
+        for attempt in range(self.max_retries + 1):
+            started = False
+            start = time.perf_counter()
+            try:
+                with self._http.stream("POST", "/api/chat", json=payload) as response:
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise httpx.HTTPStatusError(
+                            f"Retryable status {response.status_code}", request=response.request, response=response
+                        )
+                    response.raise_for_status()
+                    for line in response.iter_lines():
+                        if not line:
+                            continue
+                        content = reply_content(parse_json(line), stream=True)
+                        if content:
+                            started = True
+                            yield content
+                self.latency.record(time.perf_counter() - start)
+                return
+            except (httpx.TransportError, httpx.HTTPStatusError, MalformedResponse) as e:
+                last_error = e
+                if started:
+                    raise LLMError(f"LLM stream from {self.base_url} broke off: {e}")
+                if isinstance(e, httpx.HTTPStatusError) and e.response.status_code not in RETRYABLE_STATUS:
+                    break
+                if attempt < self.max_retries:
+                    time.sleep(self._backoff(attempt))
+        raise LLMError(f"LLM backend at {self.base_url} failed: {last_error}")
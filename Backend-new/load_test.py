@@ -0,0 +1,157 @@
+import argparse
+import http.client
+import json
+import statistics
+import threading
+import time
+from urllib.parse import urlparse
+
+# --- Simple HTTP load generator ---
+# Usage:
+#     python load_test.py --url http://127.0.0.1:8000/status/my_doc --concurrency 32 --duration 20
+#     python load_test.py --url http://127.0.0.1:8000/chat/ --method POST \
+#         --body '{"message": "What is this paper about?", "collection_name": "my_doc"}'
+#
+# Static assets / HTML pages, as a browser with a warm cache fetches them:
+#     python load_test.py --url http://127.0.0.1:8000/chat --header "Accept-Encoding: gzip, br"
+#     python load_test.py --url http://127.0.0.1:8000/chat --header "Accept-Encoding: gzip, br" --revalidate
+#
+# Run it once against `uvicorn main:app` and once against
+# `RAG_WORKERS=N gunicorn -c gunicorn.conf.py main:app` to compare
+# throughput across worker counts. Results are printed as JSON.
+
+
+def worker(url, method, bodies, offset, headers, deadline, latencies, errors, statuses, lock):
+    """
+    Sends requests over one keep-alive connection until the deadline.
+    `bodies` is a list of request bodies used round-robin (or [None]).
+    """
+    parsed = urlparse(url)
+    conn_cls = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parsed.hostname, parsed.port, timeout=120)
+    path = parsed.path or "/"
+    if parsed.query:
+        path += f"?{parsed.query}"
+
+    local_latencies = []
+    local_errors = 0
+    local_statuses = {}
+    local_bytes = 0
+    sent = 0
+    while time.perf_counter() < deadline:
+        body = bodies[(offset + sent) % len(bodies)]
+        sent += 1
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            local_bytes += len(response.read())
+            local_statuses[response.status] = local_statuses.get(response.status, 0) + 1
+            if response.status >= 400:
+                local_errors += 1
+            else:
+                local_latencies.append(time.perf_counter() - start)
+        except Exception:
+            local_errors += 1
+            conn.close()
+            conn = conn_cls(parsed.hostname, parsed.port, timeout=120)
+    conn.close()
+
+    with lock:
+        latencies.extend(local_latencies)
+        errors.append(local_errors)
+        for status, count in local_statuses.items():
+            statuses[status] = statuses.get(status, 0) + count
+        statuses["bytes"] = statuses.get("bytes", 0) + local_bytes
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def fetch_etag(url, headers) -> str:
+    """The ETag the server currently returns for a URL (to load-test 304 revalidation)."""
+    parsed = urlparse(url)
+    conn_cls = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+    conn = conn_cls(parsed.hostname, parsed.port, timeout=30)
+    try:
+        conn.request("GET", parsed.path or "/", headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.getheader("ETag")
+    finally:
+        conn.close()
+
+
+def run_load_test(url, method="GET", body=None, concurrency=16, duration=10.0, extra_headers=None, revalidate=False):
+    """
+    Runs the load test and returns a summary dict.
+    `body` may be a single JSON string or a list of them (sent round-robin).
+    With revalidate=True every request carries the URL's current ETag in
+    If-None-Match, like a browser revalidating its cached copy.
+    """
+    headers = {"Connection": "keep-alive", **(extra_headers or {})}
+    if revalidate:
+        etag = fetch_etag(url, headers)
+        if etag:
+            headers["If-None-Match"] = etag
+    bodies = body if isinstance(body, list) else [body]
+    if bodies[0] is not None:
+        bodies = [b.encode("utf-8") for b in bodies]
+        headers["Content-Type"] = "application/json"
+
+    latencies, errors, statuses, lock = [], [], {}, threading.Lock()
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=worker, args=(url, method, bodies, i * 7919, headers, deadline, latencies, errors, statuses, lock))
+        for i in range(concurrency)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    total_bytes = statuses.pop("bytes", 0)
+    responses = sum(statuses.values())
+    return {
+        "url": url,
+        "method": method,
+        "concurrency": concurrency,
+        "duration_s": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": sum(errors),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "statuses": {str(status): count for status, count in sorted(statuses.items())},
+        "body_bytes_per_response": round(total_bytes / responses, 1) if responses else None,
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1000, 2) if latencies else None,
+            "p50": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            "p95": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+            "p99": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent HTTP load test for the RAG server.")
+    parser.add_argument("--url", required=True, help="Full URL to hit, e.g. http://127.0.0.1:8000/chat/")
+    parser.add_argument("--method", default="GET")
+    parser.add_argument("--body", default=None, help="JSON request body (for POST)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run")
+    parser.add_argument("--header", action="append", default=[], help='Extra request header, e.g. "Accept-Encoding: gzip"')
+    parser.add_argument("--revalidate", action="store_true",
+                        help="Send the URL's current ETag in If-None-Match (expect 304s)")
+    args = parser.parse_args()
+
+    extra_headers = dict(h.split(":", 1) for h in args.header)
+    extra_headers = {name.strip(): value.strip() for name, value in extra_headers.items()}
+    result = run_load_test(args.url, args.method.upper(), args.body, args.concurrency, args.duration,
+                           extra_headers, args.revalidate)
+    print(json.dumps(result, indent=2))
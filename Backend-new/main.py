@@ -1,29 +1,65 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse
-from fastapi.staticfiles import StaticFiles 
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Depends, Header, Request
+from fastapi.responses import HTMLResponse, PlainTextResponse, StreamingResponse, FileResponse
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from pathlib import Path
-import speech_recognition as sr
-import io
-from pydub import AudioSegment
+import asyncio
+import base64
+import json
+import time
 import subprocess
-import sys
+import threading
 from pydantic import BaseModel  
+from typing import List, Optional
 from contextlib import asynccontextmanager
-import re  # <-- ADDED THIS IMPORT
+import os
 
 # --- NEW: Import RAG components ---
-from rag_components import load_models, get_rag_chain_for_collection
+from rag_components import load_models, load_embedding_model, models_loaded, collection_exists, answer_in_session, stream_answer_in_session, retrieve
+import job_registry
+import conversation
+from llm_client import LLMError
+import metrics
+import stt_engines
+import ingest_pipeline
+import tts_engines
+import rag_components
+import collection_admin
+import upload_store
+import asset_cache
+import profiler
+import scheduler
+
+# --- Multi-worker mode: preload the embedding model before fork ---
+# When served with `gunicorn -c gunicorn.conf.py main:app` the master process
+# imports this module once, loads the bge weights here, and then forks the
+# workers, which share the weights through copy-on-write memory.
+# Only on CPU: a CUDA context does not survive fork(), so on a GPU host each
+# worker loads the model itself after the fork (in load_models(), lifespan).
+if os.getenv("RAG_PRELOAD_MODELS") == "1":
+    if rag_components.DEVICE == "cpu":
+        load_embedding_model()
+    else:
+        print(f"Not preloading the embedding model on {rag_components.DEVICE}: each worker loads it after fork.")
 
 # --- NEW: Lifespan event handler ---
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # This code runs on startup
-    print("Application startup...")
+    # This code runs on startup (once per worker)
+    print(f"Application startup (worker pid {os.getpid()})...")
+    job_registry.init_registry()  # Shared job/collection state for all workers
+    job_registry.purge_sessions(conversation.SESSION_TTL)  # Drop expired chat sessions
+    upload_store.purge_expired_uploads()  # Drop abandoned chunked uploads
+    metrics.start_background_flush()  # Share this worker's metrics with /metrics in every worker
     load_models()  # Load the LLM and Embedding models
+    sweeper = asyncio.create_task(evict_idle_collections()) if collection_admin.COLLECTION_TTL > 0 else None
     yield
+    if sweeper is not None:
+        sweeper.cancel()
     # This code runs on shutdown (if needed)
     print("Application shutdown...")
 
+metrics.describe("rag_ingest_jobs_total", "Finished ingestion pipeline runs by outcome.")
+
 # --- MODIFIED: Initialize FastAPI with the lifespan event ---
 app = FastAPI(lifespan=lifespan)
 
@@ -31,6 +67,32 @@ app = FastAPI(lifespan=lifespan)
 class ChatRequest(BaseModel):
     message: str
     collection_name: str
+    session_id: Optional[str] = None  # Returned by the first /chat/ call; send it back for follow-ups
+    client_id: Optional[str] = None  # The id sent with /chat/prefetch, so the prefetched retrieval can be used
+    citations: bool = False  # Also return the chunks the answer is based on (no extra retrieval or LLM call)
+
+
+class PrefetchRequest(BaseModel):
+    message: str  # The question as typed so far
+    collection_name: str
+    client_id: str  # Random per chat page; only /chat/ requests with the same id use the prefetch
+
+
+class ChatBatchRequest(BaseModel):
+    collection_name: str
+    questions: List[str]
+    citations: bool = False
+    concurrency: Optional[int] = None  # Parallel LLM calls (default and maximum: BATCH_LLM_CONCURRENCY)
+
+
+class TTSRequest(BaseModel):
+    text: str
+
+
+class UploadInitRequest(BaseModel):
+    filename: str
+    size: int
+    part_size: Optional[int] = None  # Defaults to UPLOAD_PART_SIZE
 
 # -----------------------------------------------------------
 # CRITICAL: Configure the path to your Frontend directory.
@@ -39,92 +101,51 @@ ABSOLUTE_FRONTEND_PATH = Path(__file__).parent.parent / "Frontend-new"
 PDF_FOLDER = Path(__file__).parent / "pdf"
 PDF_FOLDER.mkdir(exist_ok=True) 
 
+# The pages and /static files are served from memory, precompressed, with ETags
 try:
-    app.mount("/static", StaticFiles(directory=ABSOLUTE_FRONTEND_PATH), name="static")
-    print(f"INFO: Successfully mounted Frontend to the /static URL path.")
-except RuntimeError as e:
-    print(f"FATAL ERROR: StaticFiles could not find the directory at: {ABSOLUTE_FRONTEND_PATH}")
+    frontend_assets = asset_cache.AssetCache(ABSOLUTE_FRONTEND_PATH)
+    print("INFO: Loaded the Frontend into the asset cache for the /static URL path.")
+except FileNotFoundError as e:
+    print(f"FATAL ERROR: Could not find the Frontend directory at: {ABSOLUTE_FRONTEND_PATH}")
     raise e 
 
-# -----------------------------------------------------------
-# NEW: Filename Sanitizer Function
-# -----------------------------------------------------------
-def sanitize_name(name: str) -> str:
-    """Cleans a string to be a valid ChromaDB collection name."""
-    # Replace spaces with underscores
-    name = name.replace(' ', '_')
-    # Remove any character that is not a letter, number, underscore, hyphen, or period
-    name = re.sub(r'[^a-zA-Z0-9._-]', '', name)
-    
-    # Ensure it's at least 3 chars long
-    if len(name) < 3:
-        name = f"doc_{name}"
-        
-    # Ensure it doesn't start or end with a non-alphanumeric char
-    # (ChromaDB requires start/end with [a-zA-Z0-9])
-    if not name[0].isalnum():
-        name = f"c_{name}"
-    if not name[-1].isalnum():
-        name = f"{name}_c"
-
-    # Ensure it's not too long (Chroma's actual limit is 63)
-    return name[:63]
-
 # -----------------------------------------------------------
 # PDF Processing Pipeline (MODIFIED)
 # -----------------------------------------------------------
-def run_processing_pipeline(pdf_path: Path):
+def run_processing_pipeline(pdf_path: Path, collection_name: str):
     """
     Runs the full PDF processing pipeline (Base, Image-Testo, Emmbed)
     in the background using subprocess.
+    Progress is recorded in the job registry so every worker can report it.
     """
+    paths = ingest_pipeline.DocumentPaths(pdf_path, collection_name)
+    file_stem = paths.collection_name
+    trace = metrics.start_trace("ingest", document=pdf_path.name, collection=file_stem)
+    profile_run = profiler.start("ingest", file_stem, label=f"ingest-{file_stem}")
+    status = "failed"
     try:
-        # --- MODIFIED: Use the sanitizer ---
-        file_stem = sanitize_name(pdf_path.stem)
-        
-        # Define the paths for the intermediate and final files
-        # Base.py creates an output dir named after the *original* stem
-        original_stem = pdf_path.stem
-        output_dir = Path(__file__).parent / original_stem
-        base_md_file = output_dir / f"{original_stem}.md"
-        described_md_file = output_dir / f"{original_stem}_with_descriptions.md"
-        
-        # Get the path to the current Python executable
-        python_executable = sys.executable
-        
         print(f"\n--- [PIPELINE START] Processing: {pdf_path.name} (Collection: {file_stem}) ---")
 
         # --- 1. Run Base.py ---
-        # Note: Base.py still uses the *original* PDF path
         print(f"[TASK 1/3] Running Base.py (PDF to Markdown)...")
-        cmd_base = [python_executable, "Base.py", str(pdf_path)]
-        subprocess.run(cmd_base, check=True, capture_output=True, text=True)
-        print(f"[TASK 1/3] COMPLETE. Created: {base_md_file}")
+        job_registry.update_job(file_stem, job_registry.STATUS_RUNNING, stage="Base.py")
+        ingest_pipeline.run_stage("Base.py", paths, profile_run)
+        print(f"[TASK 1/3] COMPLETE. Created: {paths.base_md_file}")
 
         # --- 2. Run Image-Testo.py ---
         print(f"[TASK 2/3] Running Image-Testo.py (Describing Images)...")
-        cmd_image = [
-            python_executable, 
-            "Image-Testo.py", 
-            str(base_md_file),     # input_file
-            str(output_dir),       # image_directory
-            str(described_md_file) # output_file
-        ]
-        subprocess.run(cmd_image, check=True, capture_output=True, text=True)
-        print(f"[TASK 2/3] COMPLETE. Created: {described_md_file}")
+        job_registry.update_job(file_stem, job_registry.STATUS_RUNNING, stage="Image-Testo.py")
+        ingest_pipeline.run_stage("Image-Testo.py", paths, profile_run)
+        print(f"[TASK 2/3] COMPLETE. Created: {paths.described_md_file}")
 
         # --- 3. Run Emmbed.py ---
-        # Emmbed.py uses the *sanitized* file_stem as the collection name
         print(f"[TASK 3/3] Running Emmbed.py (Generating Embeddings)...")
-        cmd_embed = [
-            python_executable,
-            "Emmbed.py",
-            str(described_md_file), # markdown_file
-            file_stem               # collection_name
-        ]
-        subprocess.run(cmd_embed, check=True, capture_output=True, text=True)
+        job_registry.update_job(file_stem, job_registry.STATUS_RUNNING, stage="Emmbed.py")
+        ingest_pipeline.run_stage("Emmbed.py", paths, profile_run)
         print(f"[TASK 3/3] COMPLETE. Embedded to collection: '{file_stem}'")
         
+        job_registry.update_job(file_stem, job_registry.STATUS_READY)
+        status = "ready"
         print(f"--- [PIPELINE SUCCESS] Finished processing: {pdf_path.name} ---")
 
     except subprocess.CalledProcessError as e:
@@ -133,58 +154,137 @@ def run_processing_pipeline(pdf_path: Path):
         print(f"COMMAND: {' '.join(e.cmd)}")
         print(f"STDOUT: {e.stdout}")
         print(f"STDERR: {e.stderr}")
+        job_registry.update_job(file_stem, job_registry.STATUS_FAILED, stage=e.cmd[1], error=e.stderr[-2000:] if e.stderr else str(e))
     except Exception as e:
         print(f"!!!!!! [PIPELINE FAILED] with unexpected error for {pdf_path.name}: {e} !!!!!!")
+        job_registry.update_job(file_stem, job_registry.STATUS_FAILED, error=str(e))
+    finally:
+        profiler.stop(profile_run)
+        metrics.finish_trace(trace, status=status)
+        metrics.inc("rag_ingest_jobs_total", status=status)
 
 
 # -----------------------------------------------------------
-# Audio Transcription Utility (Unchanged)
+# Audio Transcription Utility
 # -----------------------------------------------------------
-def transcribe_and_translate_audio(audio_content: bytes) -> dict:
-    r = sr.Recognizer()
+# At most this many transcriptions run at once; further requests wait
+STT_MAX_CONCURRENCY = int(os.getenv("STT_MAX_CONCURRENCY", 4))
+stt_semaphore = asyncio.Semaphore(STT_MAX_CONCURRENCY)
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+async def iter_upload(upload: UploadFile):
+    """Yields an uploaded file in chunks instead of reading it into memory at once."""
+    while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+        yield chunk
+
+
+async def transcribe_audio_stream(chunks) -> dict:
+    """
+    Decodes encoded audio with an ffmpeg pipe and runs the configured
+    recognizer in the thread pool, so the event loop is never blocked.
+    """
+    engine = stt_engines.get_engine()
     try:
-        audio_segment = AudioSegment.from_file(io.BytesIO(audio_content))
-        wav_buffer = io.BytesIO()
-        audio_segment.export(wav_buffer, format="wav", parameters=["-ac", "1", "-ar", "22050"])
-        wav_buffer.seek(0)
-        with sr.AudioFile(wav_buffer) as source:
-            audio = r.record(source)
-    except Exception as e:
+        with metrics.span("stt", "decode"):
+            pcm = await stt_engines.decode_stream_to_pcm(chunks)
+    except stt_engines.AudioDecodeError as e:
         raise HTTPException(status_code=400, detail=f"Invalid audio file format: {e}")
-    
+
     try:
-        text_transcribed = r.recognize_google(audio, language="en-US")
+        with metrics.span("stt", "recognize", engine=engine.name):
+            text_transcribed = await run_in_threadpool(engine.transcribe, pcm)
         return {"text_english": text_transcribed}
-    except sr.UnknownValueError:
+    except stt_engines.SpeechNotUnderstood:
         return {"text_english": "Could not understand audio."}
-    except sr.RequestError as e:
-        raise HTTPException(status_code=503, detail=f"Speech API error: {e}")
+    except stt_engines.SpeechBackendError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Transcription failed: {e}")
 
+
+# Live (push-to-talk) transcriptions over /ws/transcribe; each holds one ffmpeg process
+STT_MAX_STREAMS = int(os.getenv("STT_MAX_STREAMS", 16))
+stt_stream_semaphore = asyncio.Semaphore(STT_MAX_STREAMS)
+# Decoded PCM is handed to the recognizer in pieces of at most this size (0.25 s of audio)
+STT_STREAM_READ_SIZE = stt_engines.PCM_BYTES_PER_SECOND // 4
+# Warm the retrieval cache with partial transcripts while the user is still speaking
+STT_SPECULATIVE_RETRIEVAL = os.getenv("STT_SPECULATIVE_RETRIEVAL", "1") == "1"
+
+metrics.describe("rag_stt_speculative_retrievals_total",
+                 "Retrievals started from a partial or final transcript before the chat request arrived.")
+
+
+class SpeculativeRetriever:
+    """
+    Runs retrieve() for the newest transcript in the background, so the
+    following /chat/ request finds its query embedding and chunks in the
+    retrieval cache. At most one retrieval is in flight per recording;
+    transcripts that arrive meanwhile only replace the pending one.
+    """
+
+    def __init__(self, collection_name: str):
+        self.collection_name = collection_name
+        self._pending = None
+        self._submitted = None
+        self._task = None
+
+    def submit(self, text: str):
+        if text == self._submitted:
+            return
+        self._submitted = self._pending = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._pending:
+            text, self._pending = self._pending, None
+            try:
+                await run_in_threadpool(retrieve, self.collection_name, text)
+                metrics.inc("rag_stt_speculative_retrievals_total")
+            except Exception as e:
+                print(f"Speculative retrieval failed: {e}")
+
 # -----------------------------------------------------------
 # --- Frontend Serving Endpoints (Unchanged) ---
 # -----------------------------------------------------------
 @app.get("/", response_class=HTMLResponse)
-async def serve_upload_page():
-    upload_file_path = ABSOLUTE_FRONTEND_PATH / "upload.html"
-    if not upload_file_path.exists():
+async def serve_upload_page(request: Request):
+    # "no-cache": browsers revalidate every time, which costs a 304 while the page is unchanged
+    response = frontend_assets.response("upload.html", request.headers, cache_control="no-cache")
+    if response is None:
         return HTMLResponse(status_code=404, content="<h1>404 Not Found</h1><p>upload.html not found.</p>")
-    with open(upload_file_path, 'r', encoding='utf-8') as f:
-        return HTMLResponse(content=f.read())
+    return response
 
 @app.get("/chat", response_class=HTMLResponse)
-async def serve_chat_page():
-    chat_file_path = ABSOLUTE_FRONTEND_PATH / "index.html"
-    if not chat_file_path.exists():
+async def serve_chat_page(request: Request):
+    response = frontend_assets.response("index.html", request.headers, cache_control="no-cache")
+    if response is None:
         return HTMLResponse(status_code=404, content="<h1>404 Not Found</h1><p>index.html not found.</p>")
-    with open(chat_file_path, 'r', encoding='utf-8') as f:
-        return HTMLResponse(content=f.read())
+    return response
+
+@app.api_route("/static/{file_path:path}", methods=["GET", "HEAD"])
+async def serve_static(file_path: str, request: Request):
+    response = frontend_assets.response(file_path, request.headers, head=request.method == "HEAD")
+    if response is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return response
 
 # -----------------------------------------------------------
 # --- API Endpoints ---
 # -----------------------------------------------------------
 
+def _start_processing(file_path: Path, collection_name: str, background_tasks: BackgroundTasks) -> dict:
+    """Schedules the pipeline for a stored (and claimed) PDF and returns the upload response."""
+    background_tasks.add_task(run_processing_pipeline, file_path, collection_name)
+    return {
+        "filename": file_path.name,
+        "message": "File upload successful. Processing started in background.",
+        "path": str(file_path),
+        "collection_name": collection_name  # <-- This is now sanitized
+    }
+
+
 @app.post("/upload-pdf/")
 async def upload_pdf(
     file: UploadFile = File(...),
@@ -194,72 +294,631 @@ async def upload_pdf(
     Receives a PDF, stores it, and triggers the background processing.
     MODIFIED: Returns the SANITIZED collection_name to the frontend.
     """
+    collection_name = None
     try:
         if not file.filename.lower().endswith(".pdf"):
             raise HTTPException(status_code=400, detail="Only PDF files are allowed.")
         
         file_path = PDF_FOLDER / file.filename
-        
-        with open(file_path, "wb") as buffer:
-            while content := await file.read(1024 * 1024):  
-                buffer.write(content)
 
         # --- MODIFIED: Get the SANITIZED collection name ---
-        collection_name = sanitize_name(Path(file.filename).stem)
+        # (with a suffix if a different file already sanitizes to the same name)
+        # (registry calls may wait on its lock, so they run in a worker thread too)
+        collection_name = await run_in_threadpool(ingest_pipeline.collection_name_for, file_path)
 
-        # Start background task to process this file
-        background_tasks.add_task(run_processing_pipeline, file_path)
+        # Only one worker may process a given collection at a time
+        if not await run_in_threadpool(job_registry.claim_job, collection_name, str(file_path)):
+            raise HTTPException(status_code=409, detail=f"'{file.filename}' is already being processed.")
         
-        return {
-            "filename": file.filename, 
-            "message": "File upload successful. Processing started in background.", 
-            "path": str(file_path),
-            "collection_name": collection_name  # <-- This is now sanitized
-        }
+        # Opening, writing and closing go to a worker thread so a slow disk doesn't stall the event loop
+        buffer = await run_in_threadpool(open, file_path, "wb")
+        try:
+            while content := await file.read(1024 * 1024):  
+                await run_in_threadpool(buffer.write, content)
+        finally:
+            await run_in_threadpool(buffer.close)
+
+        return _start_processing(file_path, collection_name, background_tasks)
         
+    except HTTPException as h:
+        raise h
     except Exception as e:
         print(f"Error during file upload: {e}")
+        if collection_name is not None:
+            await run_in_threadpool(job_registry.update_job, collection_name, job_registry.STATUS_FAILED,
+                                    error=f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=f"Could not upload file: {e}")
 
 
+# --- Resumable chunked uploads (see upload_store.py) ---
+@app.post("/uploads/")
+async def init_upload(request: UploadInitRequest):
+    """Starts a resumable upload. Returns its upload_id and how to split the file into parts."""
+    try:
+        upload = await run_in_threadpool(upload_store.create_upload, request.filename, request.size, request.part_size)
+    except upload_store.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return upload_store.describe(upload)
+
+
+@app.get("/uploads/{upload_id}")
+async def get_upload(upload_id: str):
+    """Which parts of an upload have been received; a client resumes by sending the missing ones."""
+    try:
+        return upload_store.describe(await run_in_threadpool(upload_store.get_upload, upload_id))
+    except upload_store.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@app.put("/uploads/{upload_id}/parts/{part}")
+async def upload_part(upload_id: str, part: int, request: Request):
+    """
+    Receives one part as the raw request body. Parts may arrive in any order,
+    in parallel and on any worker. With an X-Part-SHA256 header the part is
+    rejected (422) if its hash doesn't match.
+    """
+    try:
+        upload = await run_in_threadpool(upload_store.get_upload, upload_id)
+        return await upload_store.write_part(upload, part, request.stream(), request.headers.get("x-part-sha256"))
+    except upload_store.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+
+@app.post("/uploads/{upload_id}/complete")
+async def complete_upload(upload_id: str, background_tasks: BackgroundTasks = BackgroundTasks()):
+    """
+    Finishes an upload once every part is in, and starts processing it like
+    /upload-pdf/. The response also has the upload's digest: the SHA-256 of
+    the part digests, followed by "-<number of parts>".
+    """
+    try:
+        upload = await run_in_threadpool(upload_store.get_upload, upload_id)
+        missing = upload_store.missing_parts(upload)
+        if missing:
+            raise upload_store.UploadError(f"Parts still missing: {missing[:20]}", 409)
+
+        file_path = PDF_FOLDER / upload["filename"]
+        collection_name = await run_in_threadpool(ingest_pipeline.collection_name_for, file_path)
+        if not await run_in_threadpool(job_registry.claim_job, collection_name, str(file_path)):
+            # The parts are kept, so the client can complete again later
+            raise HTTPException(status_code=409, detail=f"'{upload['filename']}' is already being processed.")
+        try:
+            digest = await run_in_threadpool(upload_store.complete_upload, upload, file_path)
+        except Exception as e:
+            await run_in_threadpool(job_registry.update_job, collection_name, job_registry.STATUS_FAILED,
+                                    error=f"Upload failed: {e}")
+            raise
+    except upload_store.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+    return {**_start_processing(file_path, collection_name, background_tasks), "digest": digest}
+
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    """Discards an unfinished upload."""
+    try:
+        await run_in_threadpool(upload_store.get_upload, upload_id)
+    except upload_store.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    await run_in_threadpool(upload_store.abort_upload, upload_id)
+    return {"upload_id": upload_id, "aborted": True}
+
+
+@app.get("/status/{collection_name}")
+async def get_processing_status(collection_name: str):
+    """
+    Returns the processing state of an uploaded document.
+    Backed by the shared job registry, so it is correct regardless of
+    which worker handled the upload.
+    """
+    job = job_registry.get_job(collection_name)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"No job found for collection '{collection_name}'.")
+    return {
+        "collection_name": collection_name,
+        "status": job["status"],
+        "stage": job["stage"],
+        "error": job["error"],
+        "updated_at": job["updated_at"],
+    }
+
+
 @app.post("/transcribe-audio/")
 async def transcribe_audio(audio_file: UploadFile = File(...)):
-    """Receives an audio file, converts it, and transcribes it (English-only)."""
+    """
+    Receives an audio file, converts it, and transcribes it (English-only).
+    The upload is streamed through ffmpeg and recognition runs off the event loop.
+    """
     try:
-        audio_content = await audio_file.read()
-        result = transcribe_and_translate_audio(audio_content)
-        return result
+        async with stt_semaphore:
+            return await transcribe_audio_stream(iter_upload(audio_file))
+    except stt_engines.SpeechBackendError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except HTTPException as h:
         raise h
     except Exception as e:
         print(f"Error during audio transcription: {e}")
         raise HTTPException(status_code=500, detail=f"Could not process audio: {e}")
 
+async def _send_error(websocket: WebSocket, detail: str):
+    try:
+        await websocket.send_json({"type": "error", "detail": detail})
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+
+
+@app.websocket("/ws/transcribe")
+async def transcribe_websocket(websocket: WebSocket, collection_name: Optional[str] = None):
+    """
+    Incremental transcription for push-to-talk.
+    The client sends encoded audio chunks (e.g. MediaRecorder opus/webm) as
+    binary frames while recording and the text frame "stop" on release.
+    The server answers with {"type": "partial", "text"} messages while audio
+    arrives and one {"type": "final", "text_english"} after "stop".
+    With ?collection_name=..., partial transcripts are also used to warm
+    retrieval for that collection before the question is sent.
+    """
+    await websocket.accept()
+    if stt_stream_semaphore.locked():
+        await websocket.close(code=1013, reason="Too many live transcriptions")
+        return
+
+    async with stt_stream_semaphore:
+        decoder = stt_engines.IncrementalDecoder()
+        recognizer = None
+        try:
+            engine = stt_engines.get_engine()
+            stream = engine.stream()
+            await decoder.start()
+
+            speculator = None
+            if STT_SPECULATIVE_RETRIEVAL and collection_name and models_loaded():
+                if await run_in_threadpool(collection_exists, collection_name):
+                    speculator = SpeculativeRetriever(collection_name)
+
+            async def recognize():
+                # Decoded audio is recognized as it comes out of ffmpeg, in order
+                while pcm := await decoder.read_pcm(STT_STREAM_READ_SIZE):
+                    text = await run_in_threadpool(stream.accept, pcm)
+                    if text:
+                        await websocket.send_json({"type": "partial", "text": text})
+                        if speculator:
+                            speculator.submit(text)
+                return await run_in_threadpool(stream.finish)
+
+            recognizer = asyncio.create_task(recognize())
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes"):
+                    await decoder.feed(message["bytes"])
+                elif message.get("text") == "stop":
+                    break
+
+            # Released: flush ffmpeg and finish recognition on the audio that is left
+            decoder.close_input()
+            try:
+                with metrics.span("stt", "stream_finalize", engine=engine.name):
+                    text = await recognizer
+            except stt_engines.SpeechNotUnderstood:
+                await websocket.send_json({"type": "final", "text_english": "Could not understand audio."})
+                return
+            if speculator:
+                speculator.submit(text)
+            await websocket.send_json({"type": "final", "text_english": text})
+
+        except WebSocketDisconnect:
+            pass
+        except (stt_engines.SpeechBackendError, stt_engines.AudioDecodeError) as e:
+            await _send_error(websocket, str(e))
+        except Exception as e:
+            print(f"Error during live transcription: {e}")
+            await _send_error(websocket, f"Transcription failed: {e}")
+        finally:
+            if recognizer is not None and not recognizer.done():
+                recognizer.cancel()
+            await decoder.stop()
+            try:
+                await websocket.close()
+            except RuntimeError:
+                pass  # Already closed by the client
+
+
+def _collection_not_ready_answer(collection_name: str) -> Optional[str]:
+    """
+    Raises 503 if the models aren't loaded. Returns the answer to give
+    while the collection is missing (still processing or failed), else None.
+    Restores a collection from cold storage first, so call it off the event loop.
+    """
+    if not models_loaded():
+        raise HTTPException(status_code=503, detail="Models are not loaded yet.")
+
+    collection_admin.record_use(collection_name)
+    if not collection_exists(collection_name):
+        if collection_admin.is_cold(collection_name):
+            # Evicted for being idle: load it back into Chroma before answering
+            try:
+                collection_admin.restore(rag_components.chroma_client, collection_name)
+            except Exception as e:
+                print(f"Error restoring collection '{collection_name}' from cold storage: {e}")
+            if not collection_exists(collection_name):
+                return "That document is being restored from cold storage. Please try again in a moment."
+            return None
+        job = job_registry.get_job(collection_name)
+        if job is not None and job["status"] == job_registry.STATUS_FAILED:
+            return f"Sorry, processing of that document failed during {job['stage'] or 'the pipeline'}. Please upload it again."
+        return "Sorry, I'm still processing that document or I can't find it. Please wait a moment and try again."
+    return None
+
+
+def _answer_chat_request(request: ChatRequest):
+    """Answers one chat request inside a trace covering all of its stages."""
+    trace = metrics.start_trace("chat", collection=request.collection_name)
+    profile_run = profiler.start("chat", request.collection_name)
+    try:
+        with metrics.span("chat", "total"):
+            return answer_in_session(request.collection_name, request.message, request.session_id, request.client_id)
+    finally:
+        profiler.stop(profile_run)
+        metrics.finish_trace(trace)
+
+
 # --- NEW: Chat Endpoint for RAG ---
 @app.post("/chat/")
 async def handle_chat_message(request: ChatRequest):
     """
-    Receives a message and a collection_name,
-    gets the RAG chain for that collection,
-    and returns the model's answer.
+    Receives a message, a collection_name and an optional session_id,
+    answers it within that conversation session,
+    and returns the model's answer plus the session_id to use for follow-ups.
+    With citations=true the response also has "sources": chunk id, similarity
+    score, pages and heading path of each chunk, from the same retrieval.
     """
     print(f"Received chat request for collection: {request.collection_name}")
     try:
-        # 1. Get the pre-loaded RAG chain for the specific collection
-        rag_chain = get_rag_chain_for_collection(request.collection_name)
-        
-        if rag_chain is None:
-            return {"answer": "Sorry, I'm still processing that document or I can't find it. Please wait a moment and try again."}
+        # 1. Make sure the models are loaded and the collection is ready
+        not_ready_answer = await run_in_threadpool(_collection_not_ready_answer, request.collection_name)
+        if not_ready_answer:
+            return {"answer": not_ready_answer, "sources": []} if request.citations else {"answer": not_ready_answer}
 
-        # 2. Invoke the chain with the user's message
-        answer = rag_chain.invoke(request.message)
+        # 2. Answer within the conversation session (reuses earlier context)
+        # (Runs in a worker thread: retries and hedging must not block the event loop)
+        answer, session = await run_in_threadpool(_answer_chat_request, request)
         
         # --- Print the answer to the terminal for debugging ---
         print(f"--- RAG Answer: {answer} ---")
+        print(f"--- Session stats: {session.stats()} ---")
         
         # 3. Return the answer
-        return {"answer": answer}
+        response = {"answer": answer, "session_id": session.session_id}
+        if request.citations:
+            response["sources"] = session.last_sources()
+        return response
         
+    except HTTPException as h:
+        raise h
+    except LLMError as e:
+        # The remote model kept failing after retries: report it as unavailable, not as our bug
+        print(f"LLM backend unavailable: {e}")
+        raise HTTPException(status_code=503, detail="The language model is temporarily unavailable. Please try again.")
     except Exception as e:
         print(f"Error during RAG chain invocation: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing chat message: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing chat message: {e}")
+
+
+@app.post("/chat/prefetch")
+async def prefetch_chat_message(request: PrefetchRequest):
+    """
+    Speculative retrieval while the user is typing (the chat page calls it,
+    debounced, as the question changes). A /chat/ question from the same
+    client_id that matches the prefetched text (rag_components.prefetch_match)
+    skips query embedding and search.
+    Best effort: failures are reported as {"prefetched": false}, never as errors.
+    """
+    try:
+        if await run_in_threadpool(_collection_not_ready_answer, request.collection_name):
+            return {"prefetched": False, "reason": "not_ready"}
+        return await run_in_threadpool(rag_components.prefetch, request.collection_name, request.message,
+                                       request.client_id)
+    except HTTPException as h:
+        raise h
+    except Exception as e:
+        print(f"Prefetch for '{request.collection_name}' failed: {e}")
+        return {"prefetched": False, "reason": "error"}
+
+
+@app.post("/chat/batch")
+async def handle_chat_batch(request: ChatBatchRequest):
+    """
+    Answers many independent questions about one collection (no sessions).
+    All questions are embedded in one pass and searched together, then the
+    LLM calls run in parallel. Streams NDJSON, one line per question in
+    completion order, then a summary:
+
+        {"type": "answer", "index": 3, "question": "...", "answer": "...", "tier": "large", "seconds": 1.2}
+        {"type": "error", "index": 5, "question": "...", "detail": "..."}
+        {"type": "done", "questions": 100, "answered": 99, "errors": 1, "seconds": 14.2, "questions_per_sec": 7.04}
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="No questions given.")
+    if len(request.questions) > rag_components.BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=413,
+                            detail=f"At most {rag_components.BATCH_MAX_QUESTIONS} questions per batch.")
+    not_ready_answer = await run_in_threadpool(_collection_not_ready_answer, request.collection_name)
+    if not_ready_answer:
+        raise HTTPException(status_code=409, detail=not_ready_answer)
+
+    concurrency = min(request.concurrency or rag_components.BATCH_LLM_CONCURRENCY, rag_components.BATCH_LLM_CONCURRENCY)
+    print(f"Received a batch of {len(request.questions)} questions for collection: {request.collection_name}")
+
+    def lines():
+        # A sync generator: Starlette runs it in a worker thread
+        try:
+            for result in rag_components.answer_batch(request.collection_name, request.questions,
+                                                      concurrency, request.citations):
+                yield json.dumps(result) + "\n"
+        except Exception as e:
+            print(f"Batch failed: {e}")
+            yield json.dumps({"type": "error", "detail": str(e)}) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+
+# --- Text-to-Speech Endpoints ---
+@app.post("/tts/")
+async def text_to_speech(request: TTSRequest):
+    """
+    Synthesizes text to MP3, streamed sentence by sentence. Sentences are
+    synthesized in parallel and served from the content-addressed cache
+    when they were spoken before.
+    """
+    sentences = tts_engines.split_sentences(request.text)
+    if not sentences:
+        raise HTTPException(status_code=400, detail="No text to synthesize.")
+    try:
+        engine = tts_engines.get_engine()
+    except tts_engines.SpeechSynthesisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    def audio():
+        for _, mp3 in tts_engines.synthesize_stream(sentences, engine):
+            yield mp3
+
+    return StreamingResponse(audio(), media_type=tts_engines.AUDIO_MEDIA_TYPE)
+
+
+@app.post("/chat/speak")
+async def speak_chat_message(request: ChatRequest):
+    """
+    Answers like /chat/, but streams the answer as it is generated, one
+    NDJSON line per sentence with its audio (base64 MP3):
+
+        {"type": "sentence", "text": "...", "audio": "..."}
+        {"type": "done", "answer": "...", "session_id": "..."}   (+ "sources" with citations=true)
+
+    Each sentence is synthesized as soon as the LLM finishes it, so the
+    client can start playing after the first sentence instead of the
+    whole answer. Errors after the stream started arrive as {"type": "error"}.
+    """
+    start = time.perf_counter()
+    try:
+        engine = tts_engines.get_engine()
+    except tts_engines.SpeechSynthesisError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    not_ready_answer = await run_in_threadpool(_collection_not_ready_answer, request.collection_name)
+    if not_ready_answer:
+        session, session_id, pieces = None, request.session_id, iter([not_ready_answer])
+    else:
+        # Retrieval and prompt building happen here; generation happens while streaming
+        session, pieces = await run_in_threadpool(
+            stream_answer_in_session, request.collection_name, request.message, request.session_id, request.client_id
+        )
+        session_id = session.session_id
+
+    # Set when the client goes away, so the producer thread stops reading the LLM
+    stopped = threading.Event()
+
+    def events():
+        answer = []
+        splitter = tts_engines.SentenceSplitter()
+
+        def sentences():
+            try:
+                for piece in pieces:
+                    if stopped.is_set():
+                        return
+                    answer.append(piece)
+                    yield from splitter.feed(piece)
+                yield from splitter.flush()
+            finally:
+                # Ends the LLM call (and frees its scheduler slot) even if the answer wasn't read to the end
+                close = getattr(pieces, "close", None)
+                if close is not None:
+                    close()
+
+        first = True
+        stream = tts_engines.synthesize_stream(sentences(), engine, stopped)
+        try:
+            for sentence, mp3 in stream:
+                if first:
+                    metrics.record_stage("tts", "first_audio", time.perf_counter() - start)
+                    first = False
+                yield json.dumps({
+                    "type": "sentence", "text": sentence, "audio": base64.b64encode(mp3).decode("ascii"),
+                }) + "\n"
+            metrics.record_stage("tts", "total", time.perf_counter() - start)
+            done = {"type": "done", "answer": "".join(answer), "session_id": session_id}
+            if request.citations:
+                done["sources"] = session.last_sources() if session is not None else []
+            yield json.dumps(done) + "\n"
+        except (LLMError, tts_engines.SpeechSynthesisError) as e:
+            print(f"Spoken answer failed: {e}")
+            yield json.dumps({"type": "error", "detail": str(e), "answer": "".join(answer)}) + "\n"
+        finally:
+            stream.close()
+
+    async def body():
+        lines = events()
+        try:
+            async for line in iterate_in_threadpool(lines):
+                yield line
+        finally:
+            # Starlette abandons the body iterator when the client disconnects;
+            # closing it stops synthesis and the LLM producer right away
+            stopped.set()
+            lines.close()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+# --- Observability Endpoints ---
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Per-stage latency histograms and counters of all workers, in the Prometheus text format."""
+    return PlainTextResponse(await run_in_threadpool(metrics.render_prometheus))
+
+
+@app.get("/metrics/traces")
+async def get_traces(limit: int = 50):
+    """The most recent request/ingestion traces recorded by this worker, as JSON."""
+    return {"worker_pid": os.getpid(), "traces": metrics.recent_traces(limit)}
+
+
+# -----------------------------------------------------------
+# --- Collection Admin Endpoints ---
+# -----------------------------------------------------------
+# Disabled unless ADMIN_TOKEN is set; callers send it in the X-Admin-Token header
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="The admin API is disabled. Set ADMIN_TOKEN to enable it.")
+    if x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=401, detail="Invalid admin token.")
+
+
+def _require_chroma():
+    if rag_components.chroma_client is None:
+        raise HTTPException(status_code=503, detail="Models are not loaded yet.")
+    return rag_components.chroma_client
+
+
+async def evict_idle_collections():
+    """Background loop: moves collections idle for longer than COLLECTION_TTL to cold storage."""
+    while True:
+        await asyncio.sleep(collection_admin.COLLECTION_SWEEP_INTERVAL)
+        if rag_components.chroma_client is None:
+            continue
+        try:
+            evicted = await run_in_threadpool(collection_admin.evict_idle, rag_components.chroma_client)
+            if evicted:
+                print(f"Moved idle collections to cold storage: {evicted}")
+        except Exception as e:
+            print(f"Error while evicting idle collections: {e}")
+
+
+@app.get("/admin/collections", dependencies=[Depends(require_admin)])
+async def list_collections():
+    """Every collection (hot or cold) with its chunk count and on-disk bytes."""
+    return await run_in_threadpool(collection_admin.list_collections, _require_chroma(), rag_components.DB_PATH)
+
+
+@app.delete("/admin/collections/{collection_name}", dependencies=[Depends(require_admin)])
+async def delete_collection(collection_name: str, delete_pdf: bool = True):
+    """Deletes a document's collection, its Markdown/image directory and (by default) its PDF."""
+    job = job_registry.get_job(collection_name)
+    if job is not None and job["status"] in (job_registry.STATUS_QUEUED, job_registry.STATUS_RUNNING):
+        raise HTTPException(status_code=409, detail=f"'{collection_name}' is still being processed.")
+    client = _require_chroma()
+    if job is None and not collection_admin.is_cold(collection_name) \
+            and not await run_in_threadpool(collection_exists, collection_name):
+        raise HTTPException(status_code=404, detail=f"No collection named '{collection_name}'.")
+    removed = await run_in_threadpool(collection_admin.delete_collection, client, collection_name, delete_pdf)
+    return {"collection_name": collection_name, **removed}
+
+
+@app.post("/admin/compact", dependencies=[Depends(require_admin)])
+async def compact_store():
+    """Vacuums Chroma's database and the registry and removes orphaned index files."""
+    return await run_in_threadpool(collection_admin.compact_store, _require_chroma(), rag_components.DB_PATH)
+
+
+@app.post("/admin/collections/{collection_name}/evict", dependencies=[Depends(require_admin)])
+async def evict_collection(collection_name: str):
+    """Moves a collection to cold storage now; it is restored on its next query."""
+    client = _require_chroma()
+    if not await run_in_threadpool(collection_exists, collection_name):
+        raise HTTPException(status_code=404, detail=f"No collection named '{collection_name}' in Chroma.")
+    evicted = await run_in_threadpool(collection_admin.evict, client, collection_name)
+    return {"collection_name": collection_name, "evicted": evicted}
+
+
+@app.post("/admin/collections/evict-idle", dependencies=[Depends(require_admin)])
+async def evict_idle(ttl: Optional[float] = None):
+    """Runs the TTL sweep now (ttl in seconds, default COLLECTION_TTL)."""
+    if ttl is None and collection_admin.COLLECTION_TTL <= 0:
+        raise HTTPException(status_code=400, detail="Pass ttl or set COLLECTION_TTL.")
+    evicted = await run_in_threadpool(collection_admin.evict_idle, _require_chroma(), ttl)
+    return {"evicted": evicted}
+
+
+@app.get("/admin/scheduler", dependencies=[Depends(require_admin)])
+async def get_scheduler_status():
+    """Model scheduler settings and the calls currently queued or running, by document and priority."""
+    return await run_in_threadpool(scheduler.status)
+
+
+# -----------------------------------------------------------
+# On-demand Profiling (admin)
+# -----------------------------------------------------------
+class ProfileRequest(BaseModel):
+    target: str  # "chat" (the next chat requests) or "ingest" (the next ingestion jobs)
+    count: int = 1
+    mode: str = "sampling"  # or "deterministic" (adds cProfile; slower)
+    collection_name: Optional[str] = None  # Only requests/jobs for this collection
+
+
+@app.post("/admin/profiles", dependencies=[Depends(require_admin)])
+async def arm_profile(request: ProfileRequest):
+    """Profiles the next `count` chat requests or ingestion jobs handled by any worker."""
+    try:
+        return await run_in_threadpool(profiler.arm, request.target, request.count, request.mode,
+                                       request.collection_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@app.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    return await run_in_threadpool(profiler.list_all)
+
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def get_profile(profile_id: str):
+    """A profile's progress and result files."""
+    profile = await run_in_threadpool(profiler.describe, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail=f"Unknown profile '{profile_id}'.")
+    return profile
+
+
+@app.get("/admin/profiles/{profile_id}/files/{name}", dependencies=[Depends(require_admin)])
+async def get_profile_file(profile_id: str, name: str):
+    """One result file: .collapsed (flamegraph input), .pstats or .txt."""
+    path = profiler.result_path(profile_id, name)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"No file '{name}' in profile '{profile_id}'.")
+    if path.suffix == ".pstats":
+        return FileResponse(path, media_type="application/octet-stream", filename=name)
+    return PlainTextResponse(path.read_text())
+
+
+@app.delete("/admin/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def delete_profile(profile_id: str):
+    """Disarms a profile and deletes its results."""
+    if not await run_in_threadpool(profiler.delete, profile_id):
+        raise HTTPException(status_code=404, detail=f"Unknown profile '{profile_id}'.")
+    return {"profile_id": profile_id, "deleted": True}
@@ -0,0 +1,320 @@
+import re
+
+# --- Structure-aware Markdown chunker ---
+# Splits the Markdown written by Base.py + Image-Testo.py along its structure
+# instead of at fixed character offsets:
+#
+#   * chunks never cross a section boundary unless the section is tiny,
+#   * tables, image descriptions and code blocks are never cut in half
+#     (an oversized table is split by rows, repeating its header),
+#   * every chunk carries its heading path and the pages it came from,
+#   * chunk size is measured in tokens of the embedding model.
+#
+# The file is read line by line, so memory stays flat for large documents.
+
+# --- 1. Configuration ---
+
+MAX_TOKENS = 384   # BGE truncates at 512 tokens; leave room for the query prefix
+MIN_TOKENS = 64    # A section smaller than this is merged with the following one
+
+# marker puts <span id="page-N-M"></span> anchors (N = 0-based page index) before blocks
+_PAGE_ANCHOR = re.compile(r'<span id="page-(\d+)-\d+"></span>')
+_HEADING = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+_FENCE = re.compile(r"^(```|~~~)")
+_TABLE_ROW = re.compile(r"^\s*\|")
+_TABLE_SEPARATOR = re.compile(r"^\s*\|?\s*:?-{3,}")
+_IMAGE_DESCRIPTION = "> **Image Description:**"
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# Block kinds
+HEADING, PARAGRAPH, TABLE, IMAGE, CODE = "heading", "paragraph", "table", "image", "code"
+
+
+def approximate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) when no tokenizer is given."""
+    return max(1, len(text) // 4)
+
+
+def tokenizer_counter(tokenizer):
+    """Token counter using a Hugging Face tokenizer (e.g. SentenceTransformer(...).tokenizer)."""
+    def count(text: str) -> int:
+        return len(tokenizer.encode(text, add_special_tokens=False))
+    return count
+
+
+class Chunk:
+    """One chunk: its text and Chroma-compatible metadata (scalar values only)."""
+
+    __slots__ = ("text", "metadata")
+
+    def __init__(self, text: str, metadata: dict):
+        self.text = text
+        self.metadata = metadata
+
+    def __repr__(self):
+        return f"Chunk({self.metadata!r}, {self.text[:40]!r})"
+
+
+# -----------------------------------------------------------
+# Pass 1: lines -> blocks
+# -----------------------------------------------------------
+def iter_blocks(lines):
+    """
+    Groups Markdown lines into blocks and yields (kind, text, page, level).
+    `page` is the 1-based page the block starts on (None before the first
+    anchor); `level` is the heading level for headings, else 0.
+    """
+    page = None
+    kind, buffer, block_page = None, [], None
+    fence = None
+
+    def flush():
+        nonlocal kind, buffer
+        block = None
+        if buffer:
+            text = "\n".join(buffer).strip()
+            if text:
+                block = (kind, text, block_page, 0)
+        kind, buffer = None, []
+        return block
+
+    for raw in lines:
+        line = raw.rstrip("\n")
+
+        # Inside a fenced code block everything is kept verbatim
+        if fence is not None:
+            buffer.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+                block = flush()
+                if block:
+                    yield block
+            continue
+
+        for match in _PAGE_ANCHOR.finditer(line):
+            page = int(match.group(1)) + 1
+        line = _PAGE_ANCHOR.sub("", line)
+        stripped = line.strip()
+
+        fence_match = _FENCE.match(stripped)
+        heading = _HEADING.match(stripped)
+        if fence_match:
+            block = flush()
+            if block:
+                yield block
+            kind, block_page, fence = CODE, page, fence_match.group(1)
+            buffer.append(line)
+        elif heading:
+            block = flush()
+            if block:
+                yield block
+            title = heading.group(2).strip()
+            if title:
+                yield HEADING, title, page, len(heading.group(1))
+        elif not stripped:
+            # A blank line ends paragraphs, tables and image descriptions
+            block = flush()
+            if block:
+                yield block
+        elif stripped.startswith(_IMAGE_DESCRIPTION):
+            block = flush()
+            if block:
+                yield block
+            kind, block_page = IMAGE, page
+            buffer.append(stripped)
+        elif _TABLE_ROW.match(line) and kind != IMAGE:
+            if kind != TABLE:
+                block = flush()
+                if block:
+                    yield block
+                kind, block_page = TABLE, page
+            buffer.append(stripped)
+        elif kind == TABLE:
+            # Text directly after a table starts a new paragraph
+            block = flush()
+            if block:
+                yield block
+            kind, block_page = PARAGRAPH, page
+            buffer.append(line)
+        else:
+            if kind is None:
+                kind, block_page = PARAGRAPH, page
+            buffer.append(line)
+
+    block = flush()
+    if block:
+        yield block
+
+
+# -----------------------------------------------------------
+# Pass 2: blocks -> chunks
+# -----------------------------------------------------------
+def _split_long(text: str, max_tokens: int, count_tokens):
+    """Splits one sentence that is over max_tokens at word boundaries (and an overlong word into slices)."""
+    pieces, current = [], []
+    for word in text.split():
+        if count_tokens(word) > max_tokens:
+            # e.g. a long URL or a run of characters without spaces
+            if current:
+                pieces.append(" ".join(current))
+                current = []
+            size = max(1, len(word) * max_tokens // count_tokens(word))
+            while size > 1 and count_tokens(word[:size]) > max_tokens:
+                size -= max(1, size // 10)
+            pieces.extend(word[i:i + size] for i in range(0, len(word), size))
+            continue
+        if current and count_tokens(" ".join(current + [word])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(word)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _split_text(text: str, max_tokens: int, count_tokens):
+    """Splits an oversized paragraph at sentence boundaries (a sentence over the budget at word boundaries)."""
+    pieces, current = [], []
+    for sentence in _SENTENCE_END.split(text):
+        if count_tokens(sentence) > max_tokens:
+            if current:
+                pieces.append(" ".join(current))
+                current = []
+            pieces.extend(_split_long(sentence, max_tokens, count_tokens))
+            continue
+        # Counted on the joined text: per-sentence counts don't add up exactly
+        if current and count_tokens(" ".join(current + [sentence])) > max_tokens:
+            pieces.append(" ".join(current))
+            current = []
+        current.append(sentence)
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+
+def _split_table(text: str, max_tokens: int, count_tokens):
+    """Splits an oversized table into row groups, each repeating the header."""
+    rows = text.split("\n")
+    header = rows[:2] if len(rows) > 1 and _TABLE_SEPARATOR.match(rows[1]) else rows[:1]
+    header_tokens = count_tokens("\n".join(header))
+    pieces, current, current_tokens = [], [], header_tokens
+    for row in rows[len(header):]:
+        tokens = count_tokens(row)
+        if current and current_tokens + tokens > max_tokens:
+            pieces.append("\n".join(header + current))
+            current, current_tokens = [], header_tokens
+        current.append(row)
+        current_tokens += tokens
+    if current or not pieces:
+        pieces.append("\n".join(header + current))
+    return pieces
+
+
+def _common_prefix(paths):
+    prefix = list(paths[0])
+    for path in paths[1:]:
+        n = 0
+        while n < min(len(prefix), len(path)) and prefix[n] == path[n]:
+            n += 1
+        prefix = prefix[:n]
+    return prefix
+
+
+def chunk_markdown_lines(lines, max_tokens: int = MAX_TOKENS, min_tokens: int = MIN_TOKENS,
+                         count_tokens=approximate_tokens, source: str = None):
+    """
+    Yields Chunks for an iterable of Markdown lines (e.g. an open file).
+    Metadata: heading_path ("A > B > C", the deepest heading shared by all
+    blocks of the chunk), page_start/page_end when known, block kinds,
+    token count and chunk_index.
+    """
+    headings = []   # [(level, title)]
+    parts = []      # [(text, tokens, kind, page, heading titles)]
+    part_tokens = 0
+    index = 0
+
+    def emit():
+        nonlocal parts, part_tokens, index
+        if all(p[2] == HEADING for p in parts):
+            # Nothing but headings: keep them as the prefix of the next block
+            return None
+        titles = _common_prefix([p[4] for p in parts])
+        pages = [p[3] for p in parts if p[3] is not None]
+        kinds = {p[2] for p in parts}
+        metadata = {
+            "heading_path": " > ".join(titles),
+            "chunk_index": index,
+            "tokens": part_tokens,
+            "has_table": TABLE in kinds,
+            "has_image": IMAGE in kinds,
+            "has_code": CODE in kinds,
+        }
+        if pages:
+            metadata["page_start"], metadata["page_end"] = min(pages), max(pages)
+        if source:
+            metadata["source"] = source
+        chunk = Chunk("\n\n".join(p[0] for p in parts), metadata)
+        parts, part_tokens = [], 0
+        index += 1
+        return chunk
+
+    def pending_headings():
+        """The headings at the end of the current chunk, which belong to the next block."""
+        n = len(parts)
+        while n and parts[n - 1][2] == HEADING:
+            n -= 1
+        return parts[n:]
+
+    def add(text, kind, page, titles):
+        nonlocal parts, part_tokens
+        tokens = count_tokens(text)
+        if parts and part_tokens + tokens > max_tokens:
+            # A heading never ends a chunk: it moves on with the block it introduces
+            carried = pending_headings()
+            carried_tokens = sum(p[1] for p in carried)
+            parts = parts[:len(parts) - len(carried)]
+            part_tokens -= carried_tokens
+            chunk = emit()
+            if chunk:
+                yield chunk
+            parts, part_tokens = parts + carried, part_tokens + carried_tokens
+        parts.append((text, tokens, kind, page, titles))
+        part_tokens += tokens
+
+    for kind, text, page, level in iter_blocks(lines):
+        if kind == HEADING:
+            # Section boundary: close the chunk unless it is still too small to stand alone
+            if part_tokens >= min_tokens:
+                chunk = emit()
+                if chunk:
+                    yield chunk
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, text))
+            titles = tuple(title for _, title in headings)
+            yield from add("#" * level + " " + text, HEADING, page, titles)
+            continue
+
+        titles = tuple(title for _, title in headings)
+        # Leave room for the headings that will lead the block's first chunk
+        budget = max(max_tokens // 2, max_tokens - sum(p[1] for p in pending_headings()))
+        if count_tokens(text) <= budget or kind in (IMAGE, CODE):
+            # Images and code are kept whole even when oversized
+            yield from add(text, kind, page, titles)
+        elif kind == TABLE:
+            for piece in _split_table(text, budget, count_tokens):
+                yield from add(piece, TABLE, page, titles)
+        else:
+            for piece in _split_text(text, budget, count_tokens):
+                yield from add(piece, kind, page, titles)
+
+    chunk = emit()
+    if chunk:
+        yield chunk
+    # Headings at the very end of the document have no text to go with
+
+
+def chunk_markdown_file(path, **kwargs):
+    """Yields Chunks for a Markdown file, reading it as a stream."""
+    with open(path, encoding="utf-8") as f:
+        yield from chunk_markdown_lines(f, source=str(path), **kwargs)
@@ -0,0 +1,311 @@
+import atexit
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+# --- 1. Configuration ---
+
+# Every process (server workers and the pipeline scripts, which run as
+# subprocesses) periodically writes its metrics to <METRICS_DIR>/<pid>.json.
+# /metrics merges all of them, so one scrape covers every worker and every
+# ingestion run, whichever process handled it.
+METRICS_DIR = Path(os.getenv("RAG_METRICS_DIR", Path(__file__).parent / "metrics_data"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("RAG_METRICS_FLUSH_INTERVAL", 5))
+# Optional: append every finished trace as one JSON line to this file
+TRACE_FILE = os.getenv("RAG_TRACE_FILE")
+# How many finished traces each process keeps in memory for /metrics/traces
+TRACE_BUFFER_SIZE = int(os.getenv("RAG_TRACE_BUFFER_SIZE", 200))
+
+# Histogram bucket upper bounds (seconds): from sub-ms cache hits to multi-minute marker runs
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+_ARCHIVE_FILE = "_archive.json"
+
+_HELP = {
+    "rag_stage_seconds": "Duration of each request/pipeline stage in seconds.",
+}
+
+_lock = threading.Lock()
+_histograms = {}   # name -> {labels_key: {"buckets": [...], "sum": float, "count": int}}
+_counters = {}     # name -> {labels_key: float}
+_gauges = {}       # name -> {labels_key: float}
+_recent_traces = deque(maxlen=TRACE_BUFFER_SIZE)
+_current_trace = contextvars.ContextVar("rag_current_trace", default=None)
+_flush_thread = None
+
+
+def describe(name: str, help_text: str):
+    """Registers the HELP text shown for a metric on /metrics."""
+    _HELP[name] = help_text
+
+
+def _labels_key(labels: dict) -> str:
+    return json.dumps(labels, sort_keys=True)
+
+
+# --- 2. Recording ---
+
+def observe(name: str, value: float, **labels):
+    """Adds one observation to a histogram."""
+    key = _labels_key(labels)
+    with _lock:
+        series = _histograms.setdefault(name, {}).get(key)
+        if series is None:
+            series = {"buckets": [0] * len(DEFAULT_BUCKETS), "sum": 0.0, "count": 0}
+            _histograms[name][key] = series
+        for i, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                series["buckets"][i] += 1
+                break
+        series["sum"] += value
+        series["count"] += 1
+
+
+def inc(name: str, value: float = 1.0, **labels):
+    """Increments a counter."""
+    key = _labels_key(labels)
+    with _lock:
+        series = _counters.setdefault(name, {})
+        series[key] = series.get(key, 0.0) + value
+
+
+def set_gauge(name: str, value: float, **labels):
+    """Sets a gauge to the current value."""
+    key = _labels_key(labels)
+    with _lock:
+        _gauges.setdefault(name, {})[key] = value
+
+
+def record_stage(pipeline: str, stage: str, seconds: float, **attrs):
+    """Records a stage duration into the stage histogram and the active trace."""
+    observe("rag_stage_seconds", seconds, pipeline=pipeline, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        span = {"stage": stage, "start": round(time.time() - seconds, 6), "duration_s": round(seconds, 6)}
+        if attrs:
+            span["attrs"] = attrs
+        trace["spans"].append(span)
+
+
+@contextmanager
+def span(pipeline: str, stage: str, **attrs):
+    """
+    Times a block of code as one stage:
+
+        with metrics.span("chat", "chroma_search"):
+            ...
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(pipeline, stage, time.perf_counter() - start, **attrs)
+
+
+# --- 3. Traces ---
+
+def start_trace(kind: str, **attrs):
+    """Starts collecting the spans of one request or ingestion job in this context."""
+    trace = {"kind": kind, "pid": os.getpid(), "start": time.time(), "attrs": attrs, "spans": []}
+    trace["_token"] = _current_trace.set(trace)
+    trace["_t0"] = time.perf_counter()
+    return trace
+
+
+def finish_trace(trace, **attrs):
+    """Ends a trace started with start_trace() and stores it."""
+    trace["duration_s"] = round(time.perf_counter() - trace.pop("_t0"), 6)
+    trace["attrs"].update(attrs)
+    try:
+        _current_trace.reset(trace.pop("_token"))
+    except ValueError:
+        # Finished from a different context than it was started in
+        _current_trace.set(None)
+    _recent_traces.append(trace)
+    if TRACE_FILE:
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps(trace) + "\n")
+
+
+@contextmanager
+def trace(kind: str, **attrs):
+    current = start_trace(kind, **attrs)
+    try:
+        yield current
+    finally:
+        finish_trace(current)
+
+
+def recent_traces(limit: int = 50):
+    return list(_recent_traces)[-limit:]
+
+
+# --- 4. Cross-process aggregation ---
+
+def _snapshot() -> dict:
+    with _lock:
+        return json.loads(json.dumps({"histograms": _histograms, "counters": _counters, "gauges": _gauges}))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge(into: dict, state: dict, include_gauges: bool = True):
+    for name, series in state.get("histograms", {}).items():
+        target = into["histograms"].setdefault(name, {})
+        for key, value in series.items():
+            if key not in target:
+                target[key] = {"buckets": list(value["buckets"]), "sum": value["sum"], "count": value["count"]}
+            else:
+                target[key]["buckets"] = [a + b for a, b in zip(target[key]["buckets"], value["buckets"])]
+                target[key]["sum"] += value["sum"]
+                target[key]["count"] += value["count"]
+    for name, series in state.get("counters", {}).items():
+        target = into["counters"].setdefault(name, {})
+        for key, value in series.items():
+            target[key] = target.get(key, 0.0) + value
+    if include_gauges:
+        # Gauges describe live processes, so they are summed (e.g. queue depth across workers)
+        for name, series in state.get("gauges", {}).items():
+            target = into["gauges"].setdefault(name, {})
+            for key, value in series.items():
+                target[key] = target.get(key, 0.0) + value
+
+
+def _empty_state() -> dict:
+    return {"histograms": {}, "counters": {}, "gauges": {}}
+
+
+def flush():
+    """Writes this process's metrics to its file in METRICS_DIR."""
+    METRICS_DIR.mkdir(exist_ok=True)
+    path = METRICS_DIR / f"{os.getpid()}.json"
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(_snapshot(), f)
+    os.replace(tmp, path)
+
+
+def collect() -> dict:
+    """
+    Merges the metrics of all processes. Files left behind by processes
+    that have exited are folded into an archive file so their counts are kept.
+    """
+    flush()
+    merged = _empty_state()
+    lock_path = METRICS_DIR / ".lock"
+    with open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        archive_path = METRICS_DIR / _ARCHIVE_FILE
+        archive = _empty_state()
+        if archive_path.exists():
+            with open(archive_path, encoding="utf-8") as f:
+                archive = json.load(f)
+        archive_changed = False
+
+        for path in METRICS_DIR.glob("*.json"):
+            if path.name == _ARCHIVE_FILE:
+                continue
+            try:
+                pid = int(path.stem)
+                with open(path, encoding="utf-8") as f:
+                    state = json.load(f)
+            except (ValueError, OSError, json.JSONDecodeError):
+                continue
+            if pid != os.getpid() and not _pid_alive(pid):
+                _merge(archive, state, include_gauges=False)
+                path.unlink(missing_ok=True)
+                archive_changed = True
+            else:
+                _merge(merged, state)
+
+        if archive_changed:
+            tmp = archive_path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(archive, f)
+            os.replace(tmp, archive_path)
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    _merge(merged, archive, include_gauges=False)
+    return merged
+
+
+def _background_flush():
+    while True:
+        time.sleep(METRICS_FLUSH_INTERVAL)
+        try:
+            flush()
+        except Exception as e:
+            print(f"Warning: could not flush metrics: {e}")
+
+
+def start_background_flush():
+    """Starts the periodic flush thread (server workers call this once at startup)."""
+    global _flush_thread
+    if _flush_thread is None:
+        _flush_thread = threading.Thread(target=_background_flush, daemon=True, name="metrics-flush")
+        _flush_thread.start()
+
+
+# Pipeline scripts are short-lived: make sure their metrics reach the directory on exit
+atexit.register(lambda: flush() if (_histograms or _counters) else None)
+
+
+# --- 5. Prometheus text exposition ---
+
+def _format_labels(labels: dict, extra: dict = None) -> str:
+    labels = dict(labels, **(extra or {}))
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+def render_prometheus() -> str:
+    """Renders all metrics of all processes in the Prometheus text format."""
+    state = collect()
+    lines = []
+
+    for name, series in sorted(state["histograms"].items()):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, value in sorted(series.items()):
+            labels = json.loads(key)
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS, value["buckets"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, {'le': bound})} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, {'le': '+Inf'})} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+
+    for name, series in sorted(state["counters"].items()):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} counter")
+        for key, value in sorted(series.items()):
+            lines.append(f"{name}{_format_labels(json.loads(key))} {value}")
+
+    for name, series in sorted(state["gauges"].items()):
+        lines.append(f"# HELP {name} {_HELP.get(name, name)}")
+        lines.append(f"# TYPE {name} gauge")
+        for key, value in sorted(series.items()):
+            lines.append(f"{name}{_format_labels(json.loads(key))} {value}")
+
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,292 @@
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import re
+import runpy
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+import job_registry
+import metrics
+from ingest_pipeline import BACKEND_DIR
+
+# --- On-demand profiling ---
+# An admin arms a profile for the next N chat requests or ingestion jobs
+# (POST /admin/profiles). Whichever worker handles a matching request
+# takes one run from it and profiles that request's thread:
+#
+#   sampling       the thread's stack every PROFILE_SAMPLE_INTERVAL, written as
+#                  collapsed stacks ("a;b;c 12" lines, the input of flamegraph.pl,
+#                  speedscope and inferno). Cheap enough for production traffic.
+#   deterministic  sampling plus cProfile: exact call counts and times, written
+#                  as .pstats (snakeviz, pstats) and a text summary. Slows the
+#                  profiled request down noticeably.
+#
+# An ingestion job is profiled in the server (the pipeline driver) and in
+# each stage subprocess, which is started through this file as a wrapper
+# (see ProfileRun.wrap_command). Results go to PROFILE_DIR/<profile id>/.
+#
+# While nothing is armed, a request costs one clock read: each worker
+# re-checks the registry at most every PROFILE_POLL_INTERVAL seconds.
+
+# --- 1. Configuration ---
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", BACKEND_DIR / "profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", 0.005))
+PROFILE_POLL_INTERVAL = float(os.getenv("PROFILE_POLL_INTERVAL", 1.0))
+# Armed profiles that haven't captured all their runs by then are dropped
+PROFILE_TTL = int(os.getenv("PROFILE_TTL_SECONDS", 3600))
+PROFILE_MAX_RUNS = 100
+# Rows in the text summary of a deterministic profile
+PROFILE_TOP_N = 60
+
+TARGETS = ("chat", "ingest")
+MODES = ("sampling", "deterministic")
+
+_PROFILE_ID = re.compile(r"^[0-9a-f]{32}$")
+_FILE_NAME = re.compile(r"^[\w.-]+\.(collapsed|pstats|txt)$")
+
+metrics.describe("rag_profile_runs_total", "Chat requests and ingestion jobs captured by an armed profile.")
+
+
+# --- 2. Stack sampler ---
+
+_labels = {}
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        name = getattr(code, "co_qualname", code.co_name)
+        label = f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+        _labels[code] = label
+    return label
+
+
+class StackSampler:
+    """
+    Samples the Python stacks of some threads from a background thread and
+    counts identical stacks. With thread_ids=None every other thread is
+    sampled and each stack is rooted at its thread's name.
+    """
+
+    def __init__(self, thread_ids=None, interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.thread_ids = thread_ids
+        self.interval = interval
+        self.counts = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()} if self.thread_ids is None else None
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if names is not None:
+                    stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def write_results(prefix: Path, sampler: StackSampler, profile: cProfile.Profile = None) -> list:
+    """Writes <prefix>.collapsed (and .pstats + .txt for cProfile). Returns the files written."""
+    prefix.parent.mkdir(parents=True, exist_ok=True)
+    collapsed = prefix.with_name(f"{prefix.name}.collapsed")
+    collapsed.write_text("".join(f"{stack} {count}\n" for stack, count in sampler.counts.most_common()))
+    written = [collapsed]
+    if profile is not None:
+        stats_file = prefix.with_name(f"{prefix.name}.pstats")
+        profile.dump_stats(stats_file)
+        summary = io.StringIO()
+        pstats.Stats(profile, stream=summary).sort_stats("cumulative").print_stats(PROFILE_TOP_N)
+        text_file = prefix.with_name(f"{prefix.name}.txt")
+        text_file.write_text(summary.getvalue())
+        written += [stats_file, text_file]
+    return written
+
+
+# --- 3. Profiled runs ---
+
+class ProfileRun:
+    """One captured chat request or ingestion job, profiled on the thread that started it."""
+
+    def __init__(self, profile_id: str, target: str, mode: str, run: int, label: str):
+        self.profile_id = profile_id
+        self.target = target
+        self.mode = mode
+        self.prefix = PROFILE_DIR / profile_id / f"{run:03d}-{label}"
+        self._sampler = None
+        self._cprofile = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._sampler = StackSampler({threading.get_ident()})
+        self._sampler.start()
+        if self.mode == "deterministic":
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    def stop(self):
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        self._sampler.stop()
+        try:
+            write_results(self.prefix, self._sampler, self._cprofile)
+            print(f"Profile {self.profile_id}: wrote {self.prefix.name} "
+                  f"({self._sampler.samples} samples in {time.perf_counter() - self._started:.2f}s)")
+        except OSError as e:
+            print(f"Profile {self.profile_id}: could not write {self.prefix}: {e}")
+        metrics.inc("rag_profile_runs_total", target=self.target, mode=self.mode)
+
+    def wrap_command(self, command: list, stage: str) -> list:
+        """Runs a stage command ([python, script, *args]) under this file, profiled the same way."""
+        output = self.prefix.with_name(f"{self.prefix.name}-{Path(stage).stem}")
+        return [command[0], str(Path(__file__).resolve()), "--mode", self.mode, "--output", str(output),
+                "--", *command[1:]]
+
+
+_armed = False
+_next_poll = 0.0
+
+
+def start(target: str, collection_name: str, label: str = None):
+    """
+    Starts profiling the current thread if an armed profile wants this chat
+    request or ingestion job. Returns the ProfileRun (pass it to stop()) or None.
+    """
+    global _armed, _next_poll
+    now = time.monotonic()
+    if now >= _next_poll:
+        _next_poll = now + PROFILE_POLL_INTERVAL
+        try:
+            _armed = job_registry.count_armed_profiles() > 0
+        except sqlite3.Error as e:
+            print(f"Could not check for armed profiles: {e}")
+            _armed = False
+    if not _armed:
+        return None
+
+    claimed = job_registry.claim_profile_run(target, collection_name)
+    if claimed is None:
+        return None
+    profile_id, mode, run = claimed
+    profile_run = ProfileRun(profile_id, target, mode, run, label or target)
+    profile_run.start()
+    return profile_run
+
+
+def stop(profile_run):
+    if profile_run is not None:
+        profile_run.stop()
+
+
+# --- 4. Admin API helpers ---
+
+def arm(target: str, count: int = 1, mode: str = "sampling", collection_name: str = None) -> dict:
+    """Arms a profile for the next `count` matching requests. Raises ValueError for bad arguments."""
+    global _next_poll
+    if target not in TARGETS:
+        raise ValueError(f"target must be one of {TARGETS}.")
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}.")
+    if not 1 <= count <= PROFILE_MAX_RUNS:
+        raise ValueError(f"count must be between 1 and {PROFILE_MAX_RUNS}.")
+    profile_id = uuid.uuid4().hex
+    job_registry.create_profile(profile_id, target, collection_name, mode, count, PROFILE_TTL)
+    _next_poll = 0.0  # This worker notices right away; the others within PROFILE_POLL_INTERVAL
+    return describe(profile_id)
+
+
+def describe(profile_id: str):
+    """A profile with its settings, progress and result files, or None if unknown."""
+    profile = job_registry.get_profile(profile_id) if _PROFILE_ID.match(profile_id) else None
+    if profile is None:
+        return None
+    directory = PROFILE_DIR / profile_id
+    files = sorted(directory.iterdir()) if directory.is_dir() else []
+    profile["armed"] = profile["remaining"] > 0 and profile["expires_at"] > time.time()
+    profile["files"] = [{"name": f.name, "bytes": f.stat().st_size} for f in files if _FILE_NAME.match(f.name)]
+    return profile
+
+
+def list_all() -> list:
+    return [describe(profile["profile_id"]) for profile in job_registry.list_profiles()]
+
+
+def result_path(profile_id: str, name: str):
+    """The path of one result file, or None if it doesn't exist (never outside PROFILE_DIR)."""
+    if not _PROFILE_ID.match(profile_id) or not _FILE_NAME.match(name):
+        return None
+    path = PROFILE_DIR / profile_id / name
+    return path if path.is_file() else None
+
+
+def delete(profile_id: str) -> bool:
+    """Disarms a profile and deletes its results. Returns False if it is unknown."""
+    if job_registry.get_profile(profile_id) is None:
+        return False
+    job_registry.delete_profile(profile_id)
+    shutil.rmtree(PROFILE_DIR / profile_id, ignore_errors=True)
+    return True
+
+
+# --- 5. Stage wrapper ---
+# python profiler.py --mode sampling --output profiles/<id>/001-ingest-Base -- Base.py doc.pdf
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a Python script under the profiler.")
+    parser.add_argument("--mode", choices=MODES, default="sampling")
+    parser.add_argument("--output", required=True, help="Path prefix of the result files")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="-- script.py [args...]")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command:
+        parser.error("missing the script to run")
+
+    # Make the script see the same argv and import path as when run directly
+    sys.argv = command
+    sys.path[0] = str(Path(command[0]).resolve().parent)
+
+    # Stage scripts may use worker threads, so sample every thread
+    sampler = StackSampler()
+    profile = cProfile.Profile() if args.mode == "deterministic" else None
+    exit_code = 0
+    sampler.start()
+    if profile is not None:
+        profile.enable()
+    try:
+        runpy.run_path(command[0], run_name="__main__")
+    except SystemExit as e:
+        exit_code = e.code
+    finally:
+        if profile is not None:
+            profile.disable()
+        sampler.stop()
+        write_results(Path(args.output), sampler, profile)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,15 +3,27 @@ import chromadb
 import os
 from dotenv import load_dotenv
 
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+
+import job_registry
+import conversation
+import metrics
+import scheduler
+import section_index
+from retrieval_cache import RetrievalCache, normalize_query
+
 # --- Imports for Ollama Cloud LLM ---
-from langchain_ollama.chat_models import ChatOllama
+from llm_client import LLMError, OllamaChatClient
 
 # --- Imports for RAG ---
 from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_chroma import Chroma
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
 
 # --- 1. Configuration ---
 load_dotenv()
@@ -23,33 +35,118 @@ DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 
 # Ollama Cloud LLM Configuration
 OLLAMA_API_KEY = os.getenv("OLLAMA_API_KEY")
-OLLAMA_BASE_URL = "https://ollama.com"
+# Point OLLAMA_BASE_URL at a local Ollama or at fake_ollama.py for offline testing
+DEFAULT_OLLAMA_BASE_URL = "https://ollama.com"
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", DEFAULT_OLLAMA_BASE_URL)
 LLM_MODEL_ID = "gpt-oss:120b"
 
+# Tiered routing: easy questions go to a small model served locally (CPU is
+# enough), everything else to LLM_MODEL_ID. Unset SMALL_LLM_MODEL_ID to disable.
+SMALL_LLM_MODEL_ID = os.getenv("SMALL_LLM_MODEL_ID")   # e.g. "qwen2.5:3b-instruct"
+SMALL_LLM_BASE_URL = os.getenv("SMALL_LLM_BASE_URL", "http://127.0.0.1:11434")
+# A question is "easy" only if every check passes (see route_question()):
+ROUTE_MIN_TOP_SCORE = float(os.getenv("ROUTE_MIN_TOP_SCORE", 0.75))       # best chunk is clearly on topic
+ROUTE_MIN_MARGIN = float(os.getenv("ROUTE_MIN_MARGIN", 0.05))             # ...and stands out from the next one,
+ROUTE_MIN_AGREEMENT = float(os.getenv("ROUTE_MIN_AGREEMENT", 0.6))        # ...or the chunks come from the same place
+ROUTE_MAX_QUESTION_WORDS = int(os.getenv("ROUTE_MAX_QUESTION_WORDS", 20))
+ROUTE_MAX_PROMPT_TOKENS = int(os.getenv("ROUTE_MAX_PROMPT_TOKENS", 3000))  # small models have small contexts
+
+# Retrieval Config
+# Candidates fetched per question; select_chunks() keeps between
+# RETRIEVAL_MIN_K and this many, depending on their similarity scores
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 8))
+RETRIEVAL_MIN_K = int(os.getenv("RETRIEVAL_MIN_K", 2))
+# Chunks past RETRIEVAL_MIN_K are kept while their cosine similarity is at
+# least this and has not dropped by more than RETRIEVAL_SCORE_GAP from the previous one
+RETRIEVAL_SCORE_THRESHOLD = float(os.getenv("RETRIEVAL_SCORE_THRESHOLD", 0.6))
+RETRIEVAL_SCORE_GAP = float(os.getenv("RETRIEVAL_SCORE_GAP", 0.08))
+# If even the best chunk is below this, the document doesn't cover the question:
+# answer with LOW_CONFIDENCE_ANSWER without calling the LLM (0 disables)
+RETRIEVAL_CONFIDENCE_FLOOR = float(os.getenv("RETRIEVAL_CONFIDENCE_FLOOR", 0.45))
+LOW_CONFIDENCE_ANSWER = (
+    "I couldn't find anything about that in this document, so I don't know. "
+    "Try rephrasing the question or asking about a topic the document covers."
+)
+
+# Batch answering (/chat/batch): LLM generations run in parallel up to this many
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", 8))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 500))
+
+# Speculative retrieval while the user types (/chat/prefetch): the in-progress
+# question is embedded and searched ahead of time, and /chat/ reuses the chunks
+# if the final question matches it or differs by at most a few characters
+PREFETCH_MIN_CHARS = int(os.getenv("PREFETCH_MIN_CHARS", 12))
+PREFETCH_TTL = float(os.getenv("PREFETCH_TTL_SECONDS", 120))
+# Prefetches each worker runs at once; more are turned away so real questions aren't slowed down
+PREFETCH_MAX_CONCURRENCY = int(os.getenv("PREFETCH_MAX_CONCURRENCY", 2))
+
+metrics.describe("rag_retrieval_cache_hits_total", "Retrievals answered from the retrieval cache.")
+metrics.describe("rag_retrieval_cache_misses_total", "Retrievals that had to embed and/or search Chroma.")
+metrics.describe("rag_prompt_tokens_total", "Estimated prompt tokens sent to the chat LLM.")
+metrics.describe("rag_retrieval_candidates_total", "Chunks retrieved as candidates for a prompt.")
+metrics.describe("rag_retrieval_selected_total", "Candidate chunks kept for the prompt by the adaptive k selection.")
+metrics.describe("rag_llm_calls_avoided_total", "Questions answered without an LLM call, by reason.")
+metrics.describe("rag_prefetch_requests_total", "Speculative retrievals requested while typing, by outcome.")
+metrics.describe("rag_prefetch_lookups_total", "Chat questions checked against prefetches: exact, close or miss.")
+metrics.describe("rag_prefetch_saved_seconds", "Embedding + search time a prefetch took off a chat question.")
+metrics.describe("rag_batch_questions_total", "Questions answered through the batch API.")
+metrics.describe("rag_llm_route_total", "Questions routed to each model tier.")
+metrics.describe("rag_llm_tier_seconds", "LLM time-to-first-token and total generation time per model tier.")
+metrics.describe("rag_llm_escalations_total", "Questions escalated from the small model to the large one because it failed.")
+
 # --- 2. Global Variables to hold loaded models ---
 llm = None
+small_llm = None
 embeddings = None
 chroma_client = None
+retrieval_cache = RetrievalCache()
+
+def load_embedding_model():
+    """
+    Loads the embedding model into the global variable.
+
+    In multi-worker mode this is called once in the gunicorn master
+    (before fork), so every worker shares the same model weights
+    through copy-on-write memory instead of loading its own copy.
+    """
+    global embeddings
+
+    if embeddings is not None:
+        return
+
+    print(f"Loading embedding model: {EMBEDDING_MODEL_NAME} on {DEVICE}...")
+    try:
+        embeddings = HuggingFaceEmbeddings(
+            model_name=EMBEDDING_MODEL_NAME,
+            model_kwargs={'device': DEVICE},
+            encode_kwargs={'normalize_embeddings': True}
+        )
+        print("Embedding model loaded.")
+    except Exception as e:
+        print(f"FATAL Error loading embedding model: {e}")
+        exit()
+
 
 def load_models():
     """
     Loads the LLM, Embedding Model, and Chroma Client into global variables.
-    This is called once when the FastAPI app starts.
+    This is called once per worker when the FastAPI app starts.
+    The embedding model is skipped if it was already preloaded before fork.
     """
-    global llm, embeddings, chroma_client
+    global llm, small_llm, chroma_client
 
     print("--- Loading RAG models ---")
     
     # --- Load LLM ---
-    print(f"Connecting to LLM: {LLM_MODEL_ID}...")
-    if not OLLAMA_API_KEY:
+    print(f"Connecting to LLM: {LLM_MODEL_ID} at {OLLAMA_BASE_URL}...")
+    if not OLLAMA_API_KEY and OLLAMA_BASE_URL == DEFAULT_OLLAMA_BASE_URL:
         print("FATAL Error: OLLAMA_API_KEY environment variable is not set.")
         exit()
     try:
-        llm = ChatOllama(
+        llm = OllamaChatClient(
             base_url=OLLAMA_BASE_URL,
             model=LLM_MODEL_ID,
-            headers={'Authorization': f'Bearer {OLLAMA_API_KEY}'},
+            api_key=OLLAMA_API_KEY,
             temperature=0.7,
         )
         print("Successfully connected to Ollama cloud LLM.")
@@ -57,18 +154,15 @@ def load_models():
         print(f"FATAL Error connecting to Ollama cloud LLM: {e}")
         exit()
 
+    # --- Load the small local LLM (optional) ---
+    if SMALL_LLM_MODEL_ID:
+        print(f"Routing easy questions to {SMALL_LLM_MODEL_ID} at {SMALL_LLM_BASE_URL}")
+        # Local: fail fast and let the large model answer instead of retrying
+        small_llm = OllamaChatClient(base_url=SMALL_LLM_BASE_URL, model=SMALL_LLM_MODEL_ID,
+                                     temperature=0.7, max_retries=0, hedge=False)
+
     # --- Load Embedding Model ---
-    print(f"Loading embedding model: {EMBEDDING_MODEL_NAME} on {DEVICE}...")
-    try:
-        embeddings = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL_NAME,
-            model_kwargs={'device': DEVICE},
-            encode_kwargs={'normalize_embeddings': True}
-        )
-        print("Embedding model loaded.")
-    except Exception as e:
-        print(f"FATAL Error loading embedding model: {e}")
-        exit()
+    load_embedding_model()
 
     # --- Connect to ChromaDB ---
     # This is "get or create" and is safe. It just ensures the client
@@ -83,20 +177,231 @@ def load_models():
     print("--- All RAG models loaded successfully ---")
 
 
-def get_rag_chain_for_collection(collection_name: str):
+def embed_query(query: str):
+    """Embeds a query, reusing the cached embedding of an identical (normalized) query."""
+    normalized = normalize_query(query)
+    query_embedding = retrieval_cache.get_embedding(normalized)
+    if query_embedding is None:
+        with metrics.span("chat", "query_embedding"):
+            query_embedding = embeddings.embed_query(query)
+        retrieval_cache.put_embedding(normalized, query_embedding)
+    return query_embedding
+
+
+def similarity(distance: float) -> float:
+    """
+    Cosine similarity from a Chroma distance. Collections use the default
+    squared L2 space and the embeddings are normalized, so d = 2 - 2cos.
+    """
+    return 1.0 - distance / 2.0
+
+
+def retrieve(collection_name: str, query: str, k: int = RETRIEVAL_K):
+    """
+    Embeds the query and searches the collection, going through the
+    retrieval cache first. Cached results are keyed by the collection's
+    version, which Emmbed.py bumps on every ingestion, so a re-ingested
+    document never serves stale chunks.
+    Returns a list of LangChain Documents (chunk id, distance and
+    similarity score in metadata).
+    """
+    normalized = normalize_query(query)
+    version = job_registry.get_collection_version(collection_name)
+
+    cached = retrieval_cache.get_results(collection_name, version, normalized, k)
+    if cached is not None:
+        metrics.inc("rag_retrieval_cache_hits_total")
+        return cached
+    metrics.inc("rag_retrieval_cache_misses_total")
+
+    query_embedding = embed_query(query)
+
+    with metrics.span("chat", "chroma_search"):
+        docs = _search(collection_name, [query_embedding], k)[0]
+
+    retrieval_cache.put_results(collection_name, version, normalized, k, docs)
+    return docs
+
+
+def _search(collection_name: str, query_embeddings: list, k: int):
+    """Searches the collection for several embeddings at once. Returns one list of Documents per embedding."""
+    collection = chroma_client.get_collection(collection_name)
+    include = ["documents", "metadatas", "distances"]
+    if (collection.metadata or {}).get("sections"):
+        # Large document: search the closest sections only (see section_index.py)
+        rows = [section_index.query(chroma_client, collection, e, k, include) for e in query_embeddings]
+    else:
+        results = collection.query(query_embeddings=query_embeddings, n_results=k, include=include)
+        rows = [{field: [results[field][i]] for field in ("ids", "documents", "metadatas", "distances")}
+                for i in range(len(query_embeddings))]
+
+    found = []
+    for results in rows:
+        docs = []
+        for chunk_id, text, metadata, distance in zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+        ):
+            metadata = dict(metadata or {})
+            metadata["chunk_id"] = chunk_id
+            metadata["distance"] = distance
+            metadata["score"] = similarity(distance)
+            docs.append(Document(page_content=text, metadata=metadata))
+        found.append(docs)
+    return found
+
+
+def retrieve_many(collection_name: str, queries: list, k: int = RETRIEVAL_K):
+    """
+    retrieve() for many queries at once: the queries missing from the
+    retrieval cache are embedded in one batched pass and searched with one
+    Chroma query. Returns a list of Document lists, in the order of queries.
+    """
+    normalized = [normalize_query(q) for q in queries]
+    version = job_registry.get_collection_version(collection_name)
+
+    found = {}
+    for query, key in zip(queries, normalized):
+        if key in found:
+            continue
+        found[key] = retrieval_cache.get_results(collection_name, version, key, k)
+        metrics.inc("rag_retrieval_cache_hits_total" if found[key] is not None else "rag_retrieval_cache_misses_total")
+    missing = [key for key, docs in found.items() if docs is None]
+
+    if missing:
+        texts = {key: query for query, key in zip(queries, normalized)}
+        # Kept here rather than read back from the cache: a batch can be larger
+        # than the LRU, and other requests evict entries concurrently
+        vectors = {key: retrieval_cache.get_embedding(key) for key in missing}
+        to_embed = [key for key, vector in vectors.items() if vector is None]
+        if to_embed:
+            with metrics.span("chat", "query_embedding", queries=len(to_embed)):
+                embedded = embeddings.embed_documents([texts[key] for key in to_embed])
+            for key, vector in zip(to_embed, embedded):
+                retrieval_cache.put_embedding(key, vector)
+                vectors[key] = vector
+        with metrics.span("chat", "chroma_search", queries=len(missing)):
+            results = _search(collection_name, [vectors[key] for key in missing], k)
+        for key, docs in zip(missing, results):
+            retrieval_cache.put_results(collection_name, version, key, k, docs)
+            found[key] = docs
+
+    return [found[key] for key in normalized]
+
+
+_prefetch_slots = threading.BoundedSemaphore(PREFETCH_MAX_CONCURRENCY)
+
+
+def prefetch(collection_name: str, text: str, client_id: str) -> dict:
+    """
+    Embeds an in-progress question and retrieves its chunks ahead of the
+    /chat/ call. The result goes to the retrieval cache of this worker and
+    to the registry under the client's id, so /chat/ can use it whichever
+    worker answers, but only for the same client.
+    """
+    normalized = normalize_query(text)
+    if len(normalized) < PREFETCH_MIN_CHARS:
+        metrics.inc("rag_prefetch_requests_total", outcome="too_short")
+        return {"prefetched": False, "reason": "too_short"}
+    if not _prefetch_slots.acquire(blocking=False):
+        metrics.inc("rag_prefetch_requests_total", outcome="busy")
+        return {"prefetched": False, "reason": "busy"}
+    try:
+        version = job_registry.get_collection_version(collection_name)
+        start = time.perf_counter()
+        query_embedding = embed_query(text)
+        docs = retrieve(collection_name, text)
+        seconds = time.perf_counter() - start
+        serialized = json.dumps([{"page_content": doc.page_content, "metadata": doc.metadata} for doc in docs])
+        job_registry.save_prefetch(client_id, collection_name, normalized, version,
+                                   np.asarray(query_embedding, dtype=np.float32).tobytes(), serialized, seconds,
+                                   PREFETCH_TTL)
+    finally:
+        _prefetch_slots.release()
+    metrics.inc("rag_prefetch_requests_total", outcome="prefetched")
+    return {"prefetched": True, "chunks": len(docs), "seconds": round(seconds, 4)}
+
+
+def prefetch_match(prefetched: str, question: str):
+    """
+    "exact" if a prefetched (normalized) text can stand in for the final
+    question, "close" if it differs only in words that don't change what is
+    asked (the question uses no term the prefetched text didn't, as for
+    session reuse), else None. A one-word difference like "max voltage" /
+    "min voltage" or "usb 2.0" / "usb 3.0" is never a match.
+    """
+    if prefetched == question:
+        return "exact"
+    terms = conversation.question_terms(question)
+    if terms and terms <= conversation.question_terms(prefetched):
+        return "close"
+    return None
+
+
+def use_prefetch(collection_name: str, question: str, client_id: str = None):
     """
-    Dynamically creates a RAG chain for a specific collection.
-    It reuses the globally loaded models.
+    This client's prefetch for a chat question (see prefetch_match), newest
+    first. Returns (query_embedding, docs) or None. Prefetches from an older
+    version of the collection, or of other clients, are never used.
     """
-    global llm, embeddings, chroma_client
+    if not client_id:
+        return None
+    candidates = job_registry.list_prefetch_queries(client_id, collection_name, PREFETCH_TTL)
+    if not candidates:
+        return None
+    version = job_registry.get_collection_version(collection_name)
+    normalized = normalize_query(question)
 
-    if not all([llm, embeddings, chroma_client]):
-        print("Error: Models are not loaded. Call load_models() first.")
+    match, result = None, "miss"
+    for query, query_version in candidates:
+        kind = prefetch_match(query, normalized) if query_version == version else None
+        if kind is not None:
+            match, result = query, kind
+            if kind == "exact":
+                break
+    row = job_registry.get_prefetch(client_id, collection_name, match) if match else None
+    if row is None:
+        metrics.inc("rag_prefetch_lookups_total", result="miss")
         return None
 
-    print(f"Attempting to build RAG chain for collection: {collection_name}")
-    
-    # --- MODIFICATION: Check if the collection exists *before* using it ---
+    metrics.inc("rag_prefetch_lookups_total", result=result)
+    metrics.observe("rag_prefetch_saved_seconds", row["seconds"])
+    print(f"Prefetch {result} for '{question[:50]}' (prefetched '{match[:50]}')")
+    query_embedding = np.frombuffer(row["embedding"], dtype=np.float32).tolist()
+    docs = [Document(page_content=doc["page_content"], metadata=doc["metadata"]) for doc in json.loads(row["docs"])]
+    return query_embedding, docs
+
+
+def select_chunks(docs):
+    """
+    Chooses k for one question from the scores of the retrieved candidates
+    (sorted best first): the first RETRIEVAL_MIN_K are always kept, later
+    ones only while they stay above RETRIEVAL_SCORE_THRESHOLD and don't fall
+    more than RETRIEVAL_SCORE_GAP below the previous chunk. A sharp drop
+    means the rest are only loosely related, and sending them costs prompt
+    tokens without helping the answer.
+    """
+    selected = list(docs[:RETRIEVAL_MIN_K])
+    for doc in docs[RETRIEVAL_MIN_K:]:
+        score = doc.metadata["score"]
+        if score < RETRIEVAL_SCORE_THRESHOLD or selected[-1].metadata["score"] - score > RETRIEVAL_SCORE_GAP:
+            break
+        selected.append(doc)
+    metrics.inc("rag_retrieval_candidates_total", len(docs))
+    metrics.inc("rag_retrieval_selected_total", len(selected))
+    return selected
+
+
+def is_low_confidence(docs) -> bool:
+    """True if no retrieved chunk is similar enough to the question to be worth an LLM call."""
+    return not docs or docs[0].metadata["score"] < RETRIEVAL_CONFIDENCE_FLOOR
+
+
+def models_loaded() -> bool:
+    return all([llm, embeddings, chroma_client])
+
+
+def collection_exists(collection_name: str) -> bool:
+    """Checks if the collection exists *before* using it."""
     try:
         # Get a list of all collection names
         collection_names = [c.name for c in chroma_client.list_collections()]
@@ -105,60 +410,304 @@ def get_rag_chain_for_collection(collection_name: str):
             print(f"Warning: Collection '{collection_name}' does not exist yet.")
             print(f"Available collections: {collection_names}")
             # This is expected if the background task hasn't finished.
-            # Returning None will trigger the "still processing" message in main.py
-            return None
+            return False
             
     except Exception as e:
         print(f"Error while checking for collection '{collection_name}': {e}")
-        return None
-    # --- END MODIFICATION ---
+        return False
+    return True
 
-    print(f"Collection '{collection_name}' found. Building retriever...")
-    
+
+def chunk_agreement(sources) -> float:
+    """
+    Share of the chunks that come from the same place as the best one (same
+    heading path, or pages at most one apart). High agreement means the
+    answer sits in one passage rather than being spread over the document.
+    """
+    if not sources:
+        return 0.0
+    top = sources[0]
+
+    def same_place(source):
+        if top.get("heading_path") and source.get("heading_path") == top["heading_path"]:
+            return True
+        if top.get("page_start") is None or source.get("page_start") is None:
+            return False
+        return (source["page_start"] <= (top.get("page_end") or top["page_start"]) + 1
+                and (source.get("page_end") or source["page_start"]) >= top["page_start"] - 1)
+
+    return sum(1 for source in sources if same_place(source)) / len(sources)
+
+
+def route_question(question: str, sources, prompt_tokens: int):
+    """
+    Decides which model answers a question. The features come from the
+    retrieval that was already done (the citations of the chunks used):
+
+    * top score  - similarity of the best chunk
+    * margin     - how far the best chunk is ahead of the second one
+    * agreement  - see chunk_agreement()
+    * question length (words) and prompt size (estimated tokens)
+
+    A question is easy, and goes to the small model, only if every check
+    passes; each failing check is listed as a reason for escalating.
+    Returns (tier, features, reasons) with tier "small" or "large".
+    """
+    scores = [source["score"] for source in sources if source.get("score") is not None]
+    features = {
+        "top_score": round(scores[0], 4) if scores else 0.0,
+        "margin": round(scores[0] - scores[1], 4) if len(scores) > 1 else 1.0,
+        "agreement": round(chunk_agreement(sources), 3),
+        "question_words": len(question.split()),
+        "prompt_tokens": prompt_tokens,
+    }
+    reasons = []
+    if features["top_score"] < ROUTE_MIN_TOP_SCORE:
+        reasons.append("low_top_score")
+    if features["margin"] < ROUTE_MIN_MARGIN and features["agreement"] < ROUTE_MIN_AGREEMENT:
+        reasons.append("spread_out")
+    if features["question_words"] > ROUTE_MAX_QUESTION_WORDS:
+        reasons.append("long_question")
+    if features["prompt_tokens"] > ROUTE_MAX_PROMPT_TOKENS:
+        reasons.append("long_prompt")
+    return ("large" if reasons else "small"), features, reasons
+
+
+def choose_llm(question: str, sources, messages):
+    """Returns (client, tier) for a question, logging and counting the routing decision."""
+    if small_llm is None:
+        return llm, "large"
+    prompt_tokens = conversation.estimate_tokens("".join(c for _, c in messages))
+    tier, features, reasons = route_question(question, sources, prompt_tokens)
+    print(f"LLM route: {tier} {features}" + (f" escalated: {', '.join(reasons)}" if reasons else ""))
+    metrics.inc("rag_llm_route_total", tier=tier)
+    return (small_llm if tier == "small" else llm), tier
+
+
+@contextmanager
+def model_slot(client, tenant: str = None, priority: str = "interactive"):
+    """
+    Waits for the tenant's turn in the shared model scheduler before a call
+    to the remote LLM (see scheduler.py). The small local model isn't scheduled.
+    """
+    if client is not llm:
+        yield
+        return
     try:
-        # 1. Create a VectorStore for the specific collection
-        vector_store = Chroma(
-            client=chroma_client,
-            collection_name=collection_name,
-            embedding_function=embeddings,
-        )
+        with scheduler.slot(tenant, priority):
+            yield
+    except scheduler.SchedulerTimeout as e:
+        raise LLMError(str(e))
 
-        # 2. Create a retriever
-        retriever = vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 5} # Retrieve top 5 chunks
-        )
-    except Exception as e:
-        print(f"Error creating retriever for collection '{collection_name}': {e}")
-        return None
 
-    # 3. Define the RAG prompt template
-    template = """
-    You are an assistant for question-answering tasks.
-    Use the following pieces of retrieved context to answer the question.
-    If you don't know the answer based on the context, just say that you don't know.
-    Keep the answer concise and helpful.
+def generate(messages, client=None, tier: str = "large", tenant: str = None, priority: str = "interactive") -> str:
+    """
+    Calls the LLM and records time-to-first-token and total generation time.
+    Streams from the backend so the first token can be timed; with hedging
+    enabled the (non-streaming) hedged path is used and only the total is timed.
+    """
+    client = client or llm
+    if client.hedge:
+        with model_slot(client, tenant, priority), metrics.span("chat", "llm_total", tier=tier):
+            return client.chat(messages)
 
-    CONTEXT:
-    {context}
+    return "".join(generate_stream(messages, client, tier, tenant, priority))
 
-    QUESTION:
-    {question}
 
-    ANSWER:
+def generate_stream(messages, client=None, tier: str = "large", tenant: str = None, priority: str = "interactive"):
     """
-    prompt = ChatPromptTemplate.from_template(template)
+    Streams the LLM reply piece by piece, recording time-to-first-token and
+    total time, overall and per tier (from when the scheduler let the call
+    through). If the small model fails before producing any output, the
+    question is escalated to the large one.
+    """
+    client = client or llm
+    with model_slot(client, tenant, priority):
+        start = time.perf_counter()
+        first = True
+        try:
+            for piece in client.stream_chat(messages):
+                if first:
+                    ttft = time.perf_counter() - start
+                    metrics.record_stage("chat", "llm_ttft", ttft, tier=tier)
+                    metrics.observe("rag_llm_tier_seconds", ttft, tier=tier, phase="ttft")
+                    first = False
+                yield piece
+        except LLMError as e:
+            if client is llm or not first:
+                raise
+            print(f"Small LLM failed ({e}); escalating to {LLM_MODEL_ID}")
+            metrics.inc("rag_llm_escalations_total")
+            yield from generate_stream(messages, llm, "large", tenant, priority)
+            return
+        total = time.perf_counter() - start
+        metrics.record_stage("chat", "llm_total", total, tier=tier)
+        metrics.observe("rag_llm_tier_seconds", total, tier=tier, phase="total")
 
-    # 4. Helper function
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
 
-    # 5. Build and return the RAG chain
-    rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-    
-    return rag_chain
\ No newline at end of file
+def answer_in_session(collection_name: str, question: str, session_id: str = None, client_id: str = None):
+    """
+    Answers a question as part of a server-side conversation session.
+
+    * A follow-up close to an earlier question of the session reuses the
+      chunks already in the conversation instead of retrieving again.
+    * Otherwise it retrieves, and only chunks not yet in the conversation
+      are added to the prompt.
+    * The prompt is append-only (see conversation.ConversationSession), so
+      the LLM backend can reuse its cached prefix from the previous turn.
+
+    Returns (answer, session); session.last_sources() cites the chunks used.
+    """
+    session, message, messages, query_embedding, new_docs, sources = _prepare_turn(collection_name, question,
+                                                                                   session_id, client_id)
+    if messages is None:
+        return _answer_low_confidence(session), session
+    client, tier = choose_llm(question, sources, messages)
+    answer = generate(messages, client, tier, tenant=collection_name)
+    _finish_turn(session, question, message, answer, query_embedding, new_docs, messages, sources)
+    return answer, session
+
+
+def stream_answer_in_session(collection_name: str, question: str, session_id: str = None, client_id: str = None):
+    """
+    Like answer_in_session(), but returns (session, pieces): pieces is a
+    generator yielding the answer as the LLM produces it. The turn is
+    recorded in the session once the generator is exhausted; closing it
+    early ends the LLM call and records nothing.
+    """
+    session, message, messages, query_embedding, new_docs, sources = _prepare_turn(collection_name, question,
+                                                                                   session_id, client_id)
+    if messages is None:
+        return session, iter([_answer_low_confidence(session)])
+    client, tier = choose_llm(question, sources, messages)
+
+    def pieces():
+        answer = []
+        stream = generate_stream(messages, client, tier, tenant=collection_name)
+        try:
+            for piece in stream:
+                answer.append(piece)
+                yield piece
+        finally:
+            # If the caller stops early, end the LLM call now (freeing its scheduler slot)
+            stream.close()
+        _finish_turn(session, question, message, "".join(answer), query_embedding, new_docs, messages, sources)
+
+    return session, pieces()
+
+
+def answer_batch(collection_name: str, questions: list, concurrency: int = BATCH_LLM_CONCURRENCY,
+                 citations: bool = False):
+    """
+    Answers many independent questions about one collection (no sessions),
+    e.g. for evaluation runs or FAQ generation. Retrieval is done for all
+    questions up front (see retrieve_many()); the LLM calls then run in
+    parallel, at most `concurrency` at a time.
+
+    Yields one dict per question as soon as it is answered (completion
+    order, so "index" says which question it is):
+        {"type": "answer", "index", "question", "answer", "tier", "seconds"}   (+ "sources")
+        {"type": "error", "index", "question", "detail"}
+    and finally {"type": "done", "questions", "answered", "errors", "seconds", "questions_per_sec"}.
+    """
+    start = time.perf_counter()
+    retrieved = retrieve_many(collection_name, questions)
+
+    def answer_one(index: int) -> dict:
+        question = questions[index]
+        question_start = time.perf_counter()
+        docs = retrieved[index]
+        result = {"type": "answer", "index": index, "question": question}
+        if RETRIEVAL_CONFIDENCE_FLOOR > 0 and is_low_confidence(docs):
+            metrics.inc("rag_llm_calls_avoided_total", reason="low_confidence")
+            answer, tier, sources = LOW_CONFIDENCE_ANSWER, None, []
+        else:
+            docs = select_chunks(docs)
+            sources = [conversation.citation(doc) for doc in docs]
+            message = f"CONTEXT:\n{conversation.format_context(docs)}\n\nQUESTION:\n{question}"
+            messages = [("system", conversation.SYSTEM_PROMPT), ("human", message)]
+            client, tier = choose_llm(question, sources, messages)
+            try:
+                answer = generate(messages, client, tier, tenant=collection_name, priority="batch")
+            except LLMError as e:
+                return {"type": "error", "index": index, "question": question, "detail": str(e)}
+            metrics.inc("rag_prompt_tokens_total", conversation.estimate_tokens(message))
+        result.update(answer=answer, tier=tier, seconds=round(time.perf_counter() - question_start, 3))
+        if citations:
+            result["sources"] = sources
+        return result
+
+    answered = errors = 0
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch-llm")
+    try:
+        futures = [pool.submit(answer_one, index) for index in range(len(questions))]
+        for future in as_completed(futures):
+            result = future.result()
+            if result["type"] == "answer":
+                answered += 1
+            else:
+                errors += 1
+            metrics.inc("rag_batch_questions_total")
+            yield result
+    finally:
+        # If the consumer stops early (client disconnected), don't start the remaining questions
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    seconds = time.perf_counter() - start
+    print(f"Batch of {len(questions)} questions on '{collection_name}' answered in {seconds:.2f}s")
+    yield {
+        "type": "done",
+        "questions": len(questions),
+        "answered": answered,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "questions_per_sec": round(len(questions) / seconds, 3) if seconds else None,
+    }
+
+
+def _prepare_turn(collection_name: str, question: str, session_id: str = None, client_id: str = None):
+    """
+    Loads the session and builds the prompt for the next turn (retrieving only if needed).
+    Also returns the citations of the chunks the answer will be based on.
+    If retrieval found nothing relevant, message and messages are None.
+    """
+    session = conversation.load_or_create_session(session_id, collection_name)
+    prefetched = use_prefetch(collection_name, question, client_id)
+    query_embedding = prefetched[0] if prefetched else embed_query(question)
+
+    reusable_turn = session.find_reusable_turn(question, query_embedding)
+    if reusable_turn is not None:
+        print(f"Session {session.session_id}: reusing context from '{reusable_turn['question'][:50]}'")
+        session.mark_reused(reusable_turn)
+        new_docs = []
+        sources = reusable_turn.get("sources", [])
+    else:
+        docs = prefetched[1] if prefetched else retrieve(collection_name, question)
+        if RETRIEVAL_CONFIDENCE_FLOOR > 0 and is_low_confidence(docs):
+            return session, None, None, query_embedding, [], []
+        docs = select_chunks(docs)
+        sources = [conversation.citation(doc) for doc in docs]
+        new_docs = session.new_chunks(docs)
+
+    with metrics.span("chat", "prompt_build"):
+        message = session.build_message(question, new_docs)
+        messages = session.build_messages(message)
+    return session, message, messages, query_embedding, new_docs, sources
+
+
+def _answer_low_confidence(session) -> str:
+    """
+    The templated answer for a question the document doesn't cover. The
+    turn is not added to the conversation, so the next prompt still extends
+    the previous one and its cached prefix stays valid.
+    """
+    print(f"Session {session.session_id}: retrieval below the confidence floor, answering without the LLM")
+    metrics.inc("rag_llm_calls_avoided_total", reason="low_confidence")
+    conversation.save_session(session)
+    return LOW_CONFIDENCE_ANSWER
+
+
+def _finish_turn(session, question, message, answer, query_embedding, new_docs, messages, sources):
+    session.record_turn(question, message, answer, query_embedding, new_docs, messages, sources)
+    conversation.save_session(session)
+    metrics.inc("rag_prompt_tokens_total", conversation.estimate_tokens("".join(c for _, c in messages)))
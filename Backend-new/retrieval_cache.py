@@ -0,0 +1,93 @@
+import os
+import re
+import threading
+from collections import OrderedDict
+
+# --- 1. Configuration ---
+
+# Maximum number of entries kept in each cache (LRU eviction beyond this)
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", 1024))
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalizes a user query so trivially different spellings of the same
+    question ("What is RAG?" vs "  what is  rag? ") share a cache entry.
+    """
+    return _WHITESPACE.sub(" ", query).strip().lower()
+
+
+class LRUCache:
+    """A small thread-safe, size-bounded LRU mapping."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RetrievalCache:
+    """
+    Caches the embed + Chroma search stage of the RAG chain.
+
+    * query_embeddings: normalized query -> embedding vector.
+      Independent of the collection, so it survives re-ingestion.
+    * results: (collection, version, normalized query, k) -> retrieved chunks.
+      The collection version is bumped by Emmbed.py on every ingestion,
+      so results from an older version of a collection are never served.
+    """
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE):
+        self.query_embeddings = LRUCache(max_entries)
+        self.results = LRUCache(max_entries)
+
+    def get_embedding(self, normalized_query: str):
+        return self.query_embeddings.get(normalized_query)
+
+    def put_embedding(self, normalized_query: str, embedding):
+        self.query_embeddings.put(normalized_query, embedding)
+
+    def get_results(self, collection_name: str, version: int, normalized_query: str, k: int):
+        return self.results.get((collection_name, version, normalized_query, k))
+
+    def put_results(self, collection_name: str, version: int, normalized_query: str, k: int, results):
+        self.results.put((collection_name, version, normalized_query, k), results)
+
+    def stats(self) -> dict:
+        return {
+            "embedding_entries": len(self.query_embeddings),
+            "embedding_hits": self.query_embeddings.hits,
+            "embedding_misses": self.query_embeddings.misses,
+            "result_entries": len(self.results),
+            "result_hits": self.results.hits,
+            "result_misses": self.results.misses,
+        }
@@ -0,0 +1,181 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+import job_registry
+import metrics
+
+# --- Fair-share scheduling of model calls ---
+# Every call to the remote model backend (chat LLM in the server workers,
+# VLM in Image-Testo.py) first takes a slot from a shared pool of
+# SCHEDULER_SLOTS concurrent calls. The queue lives in the job registry,
+# so it is shared by all workers and pipeline subprocesses on this host.
+#
+# * Priority classes: "interactive" chat calls always go before waiting
+#   "batch" (/chat/batch) and "ingest" (image description) calls, and
+#   background classes together never hold more than
+#   SCHEDULER_BACKGROUND_SLOTS, so chat always finds a free slot quickly.
+# * Within a class, tenants share the slots by weight (start-time fair
+#   queuing): a tenant with a long backlog doesn't delay a tenant that
+#   just sent its first call.
+# * Optional per-tenant token buckets cap each tenant's call rate
+#   (SCHEDULER_TENANT_RATE calls/s, bursts of SCHEDULER_TENANT_BURST). Off by
+#   default: one bucket covers all of a tenant's classes, so a document being
+#   ingested would use up the budget of its own chat questions.
+#
+# The tenant is the document (collection name): the app has no user
+# accounts, and a document's chat and ingestion share one budget.
+#
+# Off by default (SCHEDULER_SLOTS=0): every scheduled call costs two registry
+# write transactions, which only pays off when the backend has a concurrency
+# quota to share. Set SCHEDULER_SLOTS to that quota to turn it on.
+
+# --- 1. Configuration ---
+
+# Concurrent remote model calls on this host (0, the default, disables scheduling)
+SCHEDULER_SLOTS = int(os.getenv("SCHEDULER_SLOTS", 0))
+# Slots that batch/ingest calls may hold at once; the rest are kept for chat
+SCHEDULER_BACKGROUND_SLOTS = int(os.getenv("SCHEDULER_BACKGROUND_SLOTS", max(1, SCHEDULER_SLOTS // 2)))
+# Token bucket per tenant (0 = no rate limit)
+SCHEDULER_TENANT_RATE = float(os.getenv("SCHEDULER_TENANT_RATE", 0))
+SCHEDULER_TENANT_BURST = float(os.getenv("SCHEDULER_TENANT_BURST", 20))
+# Tenant weights, e.g. "handbook=3,scratch=0.5" (default weight 1)
+SCHEDULER_WEIGHTS = os.getenv("SCHEDULER_WEIGHTS", "")
+# A call waiting longer than this fails; a slot held longer than SCHEDULER_MAX_HOLD is reclaimed
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", 120))
+SCHEDULER_MAX_HOLD = float(os.getenv("SCHEDULER_MAX_HOLD", 900))
+# Waiting calls re-check their ticket after POLL_INTERVAL, backing off up to
+# MAX_POLL_INTERVAL, and are woken at once when a call of this process ends.
+# They re-run dispatch (token refills, reclaimed slots) every DISPATCH_INTERVAL.
+POLL_INTERVAL = 0.01
+MAX_POLL_INTERVAL = 0.2
+DISPATCH_INTERVAL = 0.25
+
+PRIORITIES = {"interactive": 0, "batch": 1, "ingest": 2}
+DEFAULT_POOL = "remote"
+
+metrics.describe("rag_scheduler_wait_seconds", "Time model calls waited for a scheduler slot.")
+metrics.describe("rag_scheduler_queue_depth", "Model calls waiting for a scheduler slot.")
+metrics.describe("rag_scheduler_in_flight", "Model calls holding a scheduler slot.")
+metrics.describe("rag_scheduler_timeouts_total", "Model calls that gave up waiting for a slot.")
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a model call waited longer than SCHEDULER_MAX_WAIT for a slot."""
+
+
+def _parse_weights(spec: str) -> dict:
+    weights = {}
+    for item in spec.split(","):
+        tenant, _, weight = item.partition("=")
+        if tenant.strip() and weight.strip():
+            weights[tenant.strip()] = max(0.01, float(weight))
+    return weights
+
+
+_weights = _parse_weights(SCHEDULER_WEIGHTS)
+
+
+def limits() -> dict:
+    return {
+        "slots": SCHEDULER_SLOTS,
+        "background_slots": min(SCHEDULER_BACKGROUND_SLOTS, SCHEDULER_SLOTS),
+        "rate": SCHEDULER_TENANT_RATE,
+        "burst": max(1.0, SCHEDULER_TENANT_BURST),
+        "max_hold": SCHEDULER_MAX_HOLD,
+    }
+
+
+# This process's queued / running calls; gauges are summed over all processes on /metrics
+_counts = Counter()
+_counts_lock = threading.Lock()
+# Notified whenever a call of this process gives its slot back
+_released = threading.Condition()
+
+
+def _count(kind: str, pool: str, priority: str, delta: int):
+    with _counts_lock:
+        _counts[(kind, pool, priority)] += delta
+        value = _counts[(kind, pool, priority)]
+    metrics.set_gauge(f"rag_scheduler_{kind}", value, pool=pool, priority=priority)
+
+
+def _wait_for_slot(ticket_id: int, state: str, pool: str, started: float):
+    last_dispatch = time.perf_counter()
+    delay = POLL_INTERVAL
+    while state == job_registry.CALL_WAITING:
+        if time.perf_counter() - started > SCHEDULER_MAX_WAIT:
+            raise SchedulerTimeout(f"No model slot became free within {SCHEDULER_MAX_WAIT:.0f}s.")
+        with _released:
+            _released.wait(delay)
+        delay = min(delay * 2, MAX_POLL_INTERVAL)
+        if time.perf_counter() - last_dispatch >= DISPATCH_INTERVAL:
+            last_dispatch = time.perf_counter()
+            state = job_registry.model_call_state(ticket_id, pool, limits())
+        else:
+            state = job_registry.model_call_state(ticket_id)
+    if state is None:
+        print(f"Scheduler ticket {ticket_id} disappeared while waiting; calling the model anyway.")
+
+
+def _release(ticket_id: int, pool: str):
+    try:
+        job_registry.release_model_call(ticket_id, pool, limits())
+    except sqlite3.Error as e:
+        # A running call's slot is reclaimed after SCHEDULER_MAX_HOLD
+        print(f"Could not release scheduler ticket {ticket_id}: {e}")
+    with _released:
+        _released.notify_all()
+
+
+@contextmanager
+def slot(tenant: str = None, priority: str = "interactive", pool: str = DEFAULT_POOL, cost: float = 1.0):
+    """
+    Holds a slot of the model pool for the duration of the block, waiting
+    for the tenant's fair turn first. Raises SchedulerTimeout if none frees
+    up in time. If the registry is unavailable the call is not scheduled.
+    """
+    if SCHEDULER_SLOTS <= 0:
+        yield
+        return
+    tenant = tenant or "default"
+    started = time.perf_counter()
+    try:
+        ticket_id, state = job_registry.enqueue_model_call(
+            pool, tenant, PRIORITIES[priority], cost, _weights.get(tenant, 1.0), limits()
+        )
+    except sqlite3.Error as e:
+        print(f"Scheduler unavailable ({e}); calling the model unscheduled.")
+        yield
+        return
+
+    _count("queue_depth", pool, priority, 1)
+    try:
+        _wait_for_slot(ticket_id, state, pool, started)
+    except BaseException as e:
+        if isinstance(e, SchedulerTimeout):
+            metrics.inc("rag_scheduler_timeouts_total", pool=pool, priority=priority)
+        _release(ticket_id, pool)
+        raise
+    finally:
+        _count("queue_depth", pool, priority, -1)
+    metrics.observe("rag_scheduler_wait_seconds", time.perf_counter() - started, pool=pool, priority=priority)
+
+    _count("in_flight", pool, priority, 1)
+    try:
+        yield
+    finally:
+        _count("in_flight", pool, priority, -1)
+        _release(ticket_id, pool)
+
+
+def status(pool: str = DEFAULT_POOL) -> dict:
+    """The pool's configuration and its queued/running calls by tenant and class."""
+    names = {level: name for name, level in PRIORITIES.items()}
+    calls = job_registry.list_model_calls(pool)
+    for call in calls:
+        call["priority"] = names.get(call["priority"], call["priority"])
+    return {"pool": pool, "weights": _weights, **limits(), "calls": calls}
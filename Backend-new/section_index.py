@@ -0,0 +1,190 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import metrics
+
+# --- Section-level index (coarse-to-fine retrieval) ---
+# For large documents Emmbed.py also writes a small "<collection>__sections"
+# collection with one entry per section: a run of consecutive chunks under
+# the same top-level headings, embedded as the normalized mean of its
+# chunks. Every chunk records its section number in its metadata.
+#
+# A query first finds the SECTION_TOP_N closest sections and then scores
+# only the chunks of those sections, so its cost is bounded by section
+# size rather than document size, and chunks from unrelated parts of a
+# 1000-page document can't crowd out the relevant ones. Chroma's filtered
+# query (where={"section": {"$in": ...}}) scans the filter on every call
+# and is slower than a flat search, so each worker instead keeps the chunk
+# embeddings of recently used sections in memory and scores them directly.
+
+# --- 1. Configuration ---
+
+# Documents with fewer chunks stay flat (0 disables the section index)
+SECTION_INDEX_MIN_CHUNKS = int(os.getenv("SECTION_INDEX_MIN_CHUNKS", 400))
+# Heading levels that define a section ("Chapter > Section" with 2)
+SECTION_DEPTH = int(os.getenv("SECTION_DEPTH", 2))
+# Smaller sections are merged with the next one, larger ones are split
+SECTION_MIN_CHUNKS = int(os.getenv("SECTION_MIN_CHUNKS", 4))
+SECTION_MAX_CHUNKS = int(os.getenv("SECTION_MAX_CHUNKS", 64))
+# Sections searched per query; more sections = better recall, slower queries
+SECTION_TOP_N = int(os.getenv("SECTION_TOP_N", 4))
+# Sections whose chunk embeddings each worker keeps in memory (~256 KB each at 64 chunks)
+SECTION_CACHE_SIZE = int(os.getenv("SECTION_CACHE_SIZE", 256))
+
+SECTION_SUFFIX = "__sections"
+# Chroma collection names are at most 63 characters
+_MAX_NAME_LENGTH = 63
+
+
+def section_index_name(collection_name: str) -> str:
+    name = f"{collection_name}{SECTION_SUFFIX}"
+    if len(name) <= _MAX_NAME_LENGTH:
+        return name
+    digest = hashlib.sha1(collection_name.encode("utf-8")).hexdigest()[:6]
+    return f"{collection_name[:_MAX_NAME_LENGTH - len(SECTION_SUFFIX) - 7]}_{digest}{SECTION_SUFFIX}"
+
+
+def is_section_index(name: str) -> bool:
+    return name.endswith(SECTION_SUFFIX)
+
+
+def assign_sections(metadatas: list) -> int:
+    """
+    Sets metadata["section"] on every chunk (in document order) and returns
+    the number of sections, or 0 (and sets nothing) for a document too
+    small to need a section index.
+    """
+    if not SECTION_INDEX_MIN_CHUNKS or len(metadatas) < SECTION_INDEX_MIN_CHUNKS:
+        return 0
+    section, size, current = 0, 0, None
+    for metadata in metadatas:
+        key = tuple((metadata.get("heading_path") or "").split(" > ")[:SECTION_DEPTH])
+        if size and ((key != current and size >= SECTION_MIN_CHUNKS) or size >= SECTION_MAX_CHUNKS):
+            section += 1
+            size = 0
+        current = key
+        metadata["section"] = section
+        size += 1
+    return section + 1
+
+
+def section_count(metadatas: list) -> int:
+    """Number of sections recorded in the chunk metadata (0 if the document has none)."""
+    sections = [m["section"] for m in metadatas if m and "section" in m]
+    return max(sections) + 1 if sections else 0
+
+
+def drop_section_index(client, collection_name: str):
+    try:
+        client.delete_collection(section_index_name(collection_name))
+    except Exception:
+        pass  # The document has no section index
+
+
+def build_section_index(client, collection_name: str, ids: list, embeddings, metadatas: list) -> int:
+    """
+    (Re)writes the section collection from the chunks' ids, embeddings and
+    "section" metadata (see assign_sections). Each section lists its chunk
+    ids, so a query fetches them by id instead of filtering the whole
+    collection. Returns the number of sections.
+    """
+    drop_section_index(client, collection_name)
+    count = section_count(metadatas)
+    if not count:
+        return 0
+
+    with metrics.span("ingest", "section_index", sections=count):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        sections = np.array([m["section"] for m in metadatas])
+        centroids = np.zeros((count, embeddings.shape[1]), dtype=np.float32)
+        np.add.at(centroids, sections, embeddings)
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12)
+
+        section_metadatas = [{"section": n, "chunks": 0} for n in range(count)]
+        section_ids = [[] for _ in range(count)]
+        titles = [""] * count
+        for chunk_id, metadata in zip(ids, metadatas):
+            entry = section_metadatas[metadata["section"]]
+            if not entry["chunks"]:
+                titles[metadata["section"]] = metadata.get("heading_path") or ""
+            entry["chunks"] += 1
+            section_ids[metadata["section"]].append(chunk_id)
+            for key, pick in (("page_start", min), ("page_end", max)):
+                if metadata.get(key) is not None:
+                    entry[key] = pick(entry.get(key, metadata[key]), metadata[key])
+        for entry, chunk_ids in zip(section_metadatas, section_ids):
+            entry["chunk_ids"] = ",".join(chunk_ids)
+
+        collection = client.create_collection(section_index_name(collection_name))
+        collection.add(
+            ids=[f"section-{n}" for n in range(count)],
+            embeddings=centroids,
+            documents=titles,
+            metadatas=section_metadatas,
+        )
+    print(f"Built section index for '{collection_name}': {count} sections over {len(metadatas)} chunks.")
+    return count
+
+
+# (section index id, section) -> (chunk ids, embedding matrix). The section
+# index is re-created whenever its chunks change (re-ingestion, restore), so
+# stale entries are never hit and simply age out.
+_section_cache = OrderedDict()
+_section_cache_lock = threading.Lock()
+
+
+def _section_chunks(collection, index_id, section: dict):
+    key = (str(index_id), section["section"])
+    with _section_cache_lock:
+        cached = _section_cache.get(key)
+        if cached is not None:
+            _section_cache.move_to_end(key)
+            return cached
+    data = collection.get(ids=section["chunk_ids"].split(","), include=["embeddings"])
+    cached = (data["ids"], np.asarray(data["embeddings"], dtype=np.float32))
+    with _section_cache_lock:
+        _section_cache[key] = cached
+        while len(_section_cache) > SECTION_CACHE_SIZE:
+            _section_cache.popitem(last=False)
+    return cached
+
+
+def query(client, collection, query_embedding, n_results: int, include: list, top_n: int = SECTION_TOP_N):
+    """
+    Coarse-to-fine search: the top_n closest sections, then the closest
+    chunks within them. Returns Chroma query results like collection.query()
+    (distances are squared L2 on normalized embeddings, as in Chroma).
+    Falls back to a flat search if the section index is missing.
+    """
+    try:
+        sections = client.get_collection(section_index_name(collection.name))
+    except Exception:
+        print(f"Section index for '{collection.name}' is missing; searching all chunks.")
+        return collection.query(query_embeddings=[query_embedding], n_results=n_results, include=include)
+
+    with metrics.span("chat", "section_search"):
+        found = sections.query(query_embeddings=[query_embedding], n_results=top_n, include=["metadatas"])
+        ids, matrices = [], []
+        for metadata in found["metadatas"][0]:
+            section_ids, matrix = _section_chunks(collection, sections.id, metadata)
+            ids.extend(section_ids)
+            matrices.append(matrix)
+
+    with metrics.span("chat", "section_chunk_search"):
+        scores = np.vstack(matrices) @ np.asarray(query_embedding, dtype=np.float32)
+        best = np.argsort(-scores)[:n_results]
+        results = {
+            "ids": [[ids[i] for i in best]],
+            "distances": [[float(2.0 - 2.0 * scores[i]) for i in best]],
+        }
+        fields = [field for field in ("documents", "metadatas") if field in include]
+        if fields:
+            data = collection.get(ids=results["ids"][0], include=fields)
+            position = {chunk_id: n for n, chunk_id in enumerate(data["ids"])}
+            for field in fields:
+                results[field] = [[data[field][position[chunk_id]] for chunk_id in results["ids"][0]]]
+    return results
@@ -0,0 +1,310 @@
+import asyncio
+import json
+import os
+
+# --- 1. Configuration ---
+
+# Which recognizer /transcribe-audio/ uses: "google" (remote API),
+# "sphinx" (offline, pocketsphinx) or "vosk" (offline, needs VOSK_MODEL_PATH)
+STT_ENGINE = os.getenv("STT_ENGINE", "google")
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "en-US")
+VOSK_MODEL_PATH = os.getenv("VOSK_MODEL_PATH")
+# Engines without native streaming re-transcribe the buffered audio for a
+# partial result at most this often (seconds of new audio)
+STT_PARTIAL_INTERVAL = float(os.getenv("STT_PARTIAL_INTERVAL", 1.5))
+
+# Every engine receives the same format: 16 kHz, mono, signed 16-bit little-endian PCM
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+FFMPEG_DECODE_CMD = [
+    "ffmpeg", "-hide_banner", "-loglevel", "error",
+    "-i", "pipe:0",
+    "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+    "pipe:1",
+]
+
+
+# Same conversion for a live stream: start decoding after minimal probing and don't buffer output
+FFMPEG_STREAM_DECODE_CMD = [
+    "ffmpeg", "-hide_banner", "-loglevel", "error",
+    "-fflags", "+nobuffer", "-probesize", "32768", "-analyzeduration", "0",
+    "-i", "pipe:0",
+    "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "1", "-ar", str(SAMPLE_RATE),
+    "-flush_packets", "1",
+    "pipe:1",
+]
+
+# One second of decoded audio
+PCM_BYTES_PER_SECOND = SAMPLE_RATE * SAMPLE_WIDTH
+
+
+class SpeechNotUnderstood(Exception):
+    """The audio was decoded but no speech could be recognized."""
+
+
+class SpeechBackendError(Exception):
+    """The recognizer itself failed (API unreachable, model missing, ...)."""
+
+
+class AudioDecodeError(Exception):
+    """ffmpeg could not decode the uploaded audio."""
+
+
+# -----------------------------------------------------------
+# Decoding: stream the upload through ffmpeg
+# -----------------------------------------------------------
+async def decode_stream_to_pcm(chunks) -> bytes:
+    """
+    Pipes an async iterator of encoded audio chunks (webm/opus, mp3, wav, ...)
+    through ffmpeg and returns raw PCM. The upload is never held in memory
+    as a whole; stdin is fed while stdout is drained, so neither pipe blocks.
+    """
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *FFMPEG_DECODE_CMD,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise SpeechBackendError("FFmpeg not found. Please install it and make sure it is on PATH.")
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ffmpeg exited early; its stderr explains why
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    stdout_reader = asyncio.create_task(process.stdout.read())
+    stderr_reader = asyncio.create_task(process.stderr.read())
+    try:
+        await feeder
+    except BaseException:
+        process.kill()
+        raise
+    pcm = await stdout_reader
+    stderr = await stderr_reader
+    return_code = await process.wait()
+
+    if return_code != 0:
+        raise AudioDecodeError(stderr.decode("utf-8", "replace").strip() or f"ffmpeg exited with {return_code}")
+    return pcm
+
+
+class IncrementalDecoder:
+    """
+    A long-lived ffmpeg process for a live recording: encoded chunks go in
+    as they arrive (e.g. opus/webm from MediaRecorder), PCM comes out as
+    soon as ffmpeg has decoded it.
+    """
+
+    def __init__(self):
+        self.process = None
+
+    async def start(self):
+        try:
+            self.process = await asyncio.create_subprocess_exec(
+                *FFMPEG_STREAM_DECODE_CMD,
+                stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.DEVNULL,
+            )
+        except FileNotFoundError:
+            raise SpeechBackendError("FFmpeg not found. Please install it and make sure it is on PATH.")
+
+    async def feed(self, chunk: bytes):
+        try:
+            self.process.stdin.write(chunk)
+            await self.process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            raise AudioDecodeError("ffmpeg stopped accepting audio.")
+
+    def close_input(self):
+        """Signals end of the recording; ffmpeg then flushes the remaining PCM."""
+        if not self.process.stdin.is_closing():
+            self.process.stdin.close()
+
+    async def read_pcm(self, max_bytes: int) -> bytes:
+        """Returns the next decoded PCM (b"" once ffmpeg has finished)."""
+        return await self.process.stdout.read(max_bytes)
+
+    async def stop(self):
+        if self.process is not None and self.process.returncode is None:
+            self.process.kill()
+            await self.process.wait()
+
+
+# -----------------------------------------------------------
+# Streaming recognition
+# -----------------------------------------------------------
+class BufferedStream:
+    """
+    Incremental recognition for engines that only transcribe whole clips.
+    Audio is buffered; a partial result is produced by re-transcribing the
+    buffer every STT_PARTIAL_INTERVAL seconds of new audio. If no audio
+    arrived since the last partial, finish() returns it without another call.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._pcm = bytearray()
+        self._pcm_at_last_partial = 0
+        self._last_text = ""
+
+    def accept(self, pcm: bytes):
+        """Adds decoded audio. Returns a new partial transcript, or None."""
+        self._pcm.extend(pcm)
+        if len(self._pcm) - self._pcm_at_last_partial < STT_PARTIAL_INTERVAL * PCM_BYTES_PER_SECOND:
+            return None
+        return self._transcribe()
+
+    def _transcribe(self):
+        self._pcm_at_last_partial = len(self._pcm)
+        try:
+            text = self.engine.transcribe(bytes(self._pcm))
+        except SpeechNotUnderstood:
+            return None
+        if text == self._last_text:
+            return None
+        self._last_text = text
+        return text
+
+    def finish(self) -> str:
+        if len(self._pcm) > self._pcm_at_last_partial:
+            self._transcribe()
+        if not self._last_text:
+            raise SpeechNotUnderstood()
+        return self._last_text
+
+
+class VoskStream:
+    """Native incremental recognition: every chunk is decoded once, as it arrives."""
+
+    def __init__(self, engine):
+        self._recognizer = engine._vosk.KaldiRecognizer(engine._model, SAMPLE_RATE)
+        self._segments = []
+        self._last_text = ""
+
+    def _text(self, partial: str = "") -> str:
+        return " ".join(s for s in self._segments + [partial] if s)
+
+    def accept(self, pcm: bytes):
+        if self._recognizer.AcceptWaveform(pcm):
+            self._segments.append(json.loads(self._recognizer.Result()).get("text", "").strip())
+            text = self._text()
+        else:
+            text = self._text(json.loads(self._recognizer.PartialResult()).get("partial", "").strip())
+        if text == self._last_text:
+            return None
+        self._last_text = text
+        return text
+
+    def finish(self) -> str:
+        self._segments.append(json.loads(self._recognizer.FinalResult()).get("text", "").strip())
+        text = self._text()
+        if not text:
+            raise SpeechNotUnderstood()
+        return text
+
+
+# -----------------------------------------------------------
+# Recognizer backends
+# -----------------------------------------------------------
+class GoogleEngine:
+    """Google Web Speech API through speech_recognition (remote, needs internet)."""
+
+    name = "google"
+
+    def __init__(self):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def transcribe(self, pcm: bytes) -> str:
+        audio = self._sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self._recognizer.recognize_google(audio, language=STT_LANGUAGE)
+        except self._sr.UnknownValueError:
+            raise SpeechNotUnderstood()
+        except self._sr.RequestError as e:
+            raise SpeechBackendError(f"Speech API error: {e}")
+
+    def stream(self):
+        return BufferedStream(self)
+
+
+class SphinxEngine:
+    """CMU PocketSphinx through speech_recognition (offline, `pip install pocketsphinx`)."""
+
+    name = "sphinx"
+
+    def __init__(self):
+        import speech_recognition as sr
+        self._sr = sr
+        self._recognizer = sr.Recognizer()
+
+    def transcribe(self, pcm: bytes) -> str:
+        audio = self._sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            return self._recognizer.recognize_sphinx(audio, language=STT_LANGUAGE)
+        except self._sr.UnknownValueError:
+            raise SpeechNotUnderstood()
+        except self._sr.RequestError as e:
+            raise SpeechBackendError(f"PocketSphinx error: {e}")
+
+    def stream(self):
+        return BufferedStream(self)
+
+
+class VoskEngine:
+    """Vosk/Kaldi (offline, `pip install vosk` and a model from alphacephei.com/vosk/models)."""
+
+    name = "vosk"
+
+    def __init__(self):
+        try:
+            import vosk
+        except ImportError:
+            raise SpeechBackendError("The 'vosk' package is not installed.")
+        if not VOSK_MODEL_PATH:
+            raise SpeechBackendError("VOSK_MODEL_PATH is not set.")
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        # The model is loaded once and shared by all recognizers (it is read-only)
+        self._model = vosk.Model(VOSK_MODEL_PATH)
+
+    def transcribe(self, pcm: bytes) -> str:
+        recognizer = self._vosk.KaldiRecognizer(self._model, SAMPLE_RATE)
+        recognizer.AcceptWaveform(pcm)
+        text = json.loads(recognizer.FinalResult()).get("text", "").strip()
+        if not text:
+            raise SpeechNotUnderstood()
+        return text
+
+    def stream(self):
+        return VoskStream(self)
+
+
+ENGINES = {
+    "google": GoogleEngine,
+    "sphinx": SphinxEngine,
+    "vosk": VoskEngine,
+}
+
+_engine_instances = {}
+
+
+def get_engine(name: str = None):
+    """Returns the (cached) recognizer backend by name, defaulting to STT_ENGINE."""
+    name = name or STT_ENGINE
+    if name not in ENGINES:
+        raise SpeechBackendError(f"Unknown STT engine '{name}'. Available: {sorted(ENGINES)}")
+    if name not in _engine_instances:
+        _engine_instances[name] = ENGINES[name]()
+    return _engine_instances[name]
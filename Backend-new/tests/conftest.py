@@ -0,0 +1,104 @@
+import importlib.util
+import os
+import sys
+import tempfile
+import threading
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# Module-level config of the app is read at import time: keep state out of the source tree
+_state_dir = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.setdefault("RAG_STATE_DB", os.path.join(_state_dir, "rag_state.db"))
+os.environ.setdefault("RAG_METRICS_DIR", os.path.join(_state_dir, "metrics"))
+os.environ.setdefault("DOCUMENTS_DIR", os.path.join(_state_dir, "documents"))
+
+
+def _stub_module(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+
+
+# rag_components and Emmbed.py import torch, LangChain and sentence-transformers
+# at module level. The tests never load a model (they pass FakeEmbeddings
+# instead), so where those packages aren't installed, minimal stand-ins are enough.
+if importlib.util.find_spec("torch") is None:
+    _stub_module("torch", cuda=types.SimpleNamespace(is_available=lambda: False))
+if importlib.util.find_spec("langchain_core") is None:
+    class Document:
+        def __init__(self, page_content, metadata=None):
+            self.page_content = page_content
+            self.metadata = metadata or {}
+
+    _stub_module("langchain_core")
+    _stub_module("langchain_core.documents", Document=Document)
+if importlib.util.find_spec("langchain_huggingface") is None:
+    _stub_module("langchain_huggingface", HuggingFaceEmbeddings=None)
+if importlib.util.find_spec("sentence_transformers") is None:
+    _stub_module("sentence_transformers", SentenceTransformer=None)
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    """A fresh, empty job registry for one test."""
+    import job_registry
+    monkeypatch.setattr(job_registry, "REGISTRY_PATH", tmp_path / "rag_state.db")
+    monkeypatch.setattr(job_registry, "_initialized", False)
+    monkeypatch.setattr(job_registry, "_local", threading.local())  # Cached read connections
+    job_registry.init_registry()
+    return job_registry
+
+
+class FakeEmbeddings:
+    """Deterministic bag-of-words embeddings (normalized), enough to make retrieval meaningful."""
+
+    dim = 64
+
+    def embed_query(self, text):
+        import zlib
+        import numpy as np
+        vector = np.zeros(self.dim)
+        for word in text.lower().split():
+            vector[zlib.crc32(word.strip("?.,!").encode()) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+
+class FakeSentenceTransformer(FakeEmbeddings):
+    """What Emmbed.py uses of a SentenceTransformer: encode() and a tokenizer."""
+
+    class tokenizer:
+        @staticmethod
+        def encode(text, add_special_tokens=False):
+            return text.split()
+
+    def encode(self, texts, normalize_embeddings=True, show_progress_bar=False):
+        import numpy as np
+        return np.asarray(self.embed_documents(texts), dtype=np.float32)
+
+
+@pytest.fixture
+def rag(registry, tmp_path, monkeypatch):
+    """rag_components with fake embeddings, a real Chroma store in tmp_path and an empty retrieval cache."""
+    import chromadb
+    import rag_components
+    from retrieval_cache import RetrievalCache
+    monkeypatch.setattr(rag_components, "embeddings", FakeEmbeddings())
+    monkeypatch.setattr(rag_components, "chroma_client", chromadb.PersistentClient(path=str(tmp_path / "chroma")))
+    monkeypatch.setattr(rag_components, "retrieval_cache", RetrievalCache())
+    return rag_components
+
+
+def add_chunks(rag_components, collection_name, texts):
+    """Stores texts as the chunks c0, c1, ... of a collection."""
+    collection = rag_components.chroma_client.get_or_create_collection(collection_name)
+    collection.add(ids=[f"c{i}" for i in range(len(texts))], documents=list(texts),
+                   embeddings=rag_components.embeddings.embed_documents(list(texts)),
+                   metadatas=[{"heading_path": f"Section {i}"} for i in range(len(texts))])
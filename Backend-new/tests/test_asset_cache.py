@@ -0,0 +1,18 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import asset_cache
+
+
+def test_not_modified_only_for_the_selected_encoding(tmp_path):
+    (tmp_path / "app.js").write_text("console.log('hello');\n" * 200)
+    cache = asset_cache.AssetCache(tmp_path)
+    gzip_etag = cache.response("app.js", {"accept-encoding": "gzip"}).headers["etag"]
+
+    assert cache.response("app.js", {"accept-encoding": "gzip", "if-none-match": gzip_etag}).status_code == 304
+    # The client's cached copy is gzip, but it now asks for identity: send the body
+    response = cache.response("app.js", {"accept-encoding": "identity", "if-none-match": gzip_etag})
+    assert response.status_code == 200 and response.headers["etag"] != gzip_etag
+    assert cache.response("app.js", {"accept-encoding": "identity", "if-none-match": "*"}).status_code == 304
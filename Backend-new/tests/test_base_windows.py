@@ -0,0 +1,82 @@
+import os
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("RAG_METRICS_DIR", tempfile.mkdtemp(prefix="rag-test-metrics-"))
+
+# Base.py imports marker at module level; the converter itself is stubbed below
+try:
+    import marker  # noqa: F401
+except ImportError:
+    for name in ("marker", "marker.converters", "marker.converters.pdf", "marker.models", "marker.output"):
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules["marker.converters.pdf"].PdfConverter = None
+    sys.modules["marker.models"].create_model_dict = None
+    sys.modules["marker.output"].text_from_rendered = None
+
+import Base
+
+MB = 1024 * 1024
+
+
+def stub_converter(monkeypatch, total_pages, page_bytes):
+    """Replaces marker with a converter that holds page_bytes(page) of memory per rendered page."""
+    windows = []
+
+    def convert_window(converter, pdf_filename, pages=None):
+        pages = list(pages) if pages is not None else list(range(total_pages))
+        windows.append(pages)
+        held = [b"\x01" * page_bytes(page) for page in pages]  # Touched, so it counts towards RSS
+        time.sleep(3 * Base.RSS_SAMPLE_INTERVAL)
+        del held
+        return "\n\n".join(f"Page {page + 1}" for page in pages), {}
+
+    monkeypatch.setattr(Base, "page_count", lambda pdf_filename: total_pages)
+    monkeypatch.setattr(Base, "convert_window", convert_window)
+    return windows
+
+
+def budget_mb(headroom_mb):
+    return Base.current_rss() / MB + headroom_mb
+
+
+def test_peak_rss_stays_under_budget(monkeypatch, tmp_path):
+    windows = stub_converter(monkeypatch, 40, lambda page: 8 * MB)
+    budget = budget_mb(96)
+
+    with Base.RssMonitor() as monitor:
+        output_dir = Base.convert_pdf(None, tmp_path / "doc.pdf", tmp_path, window_pages=0, rss_budget_mb=budget)
+
+    assert monitor.peak <= budget * MB
+    assert [page for window in windows for page in window] == list(range(40))
+    assert len(windows[0]) == Base.RSS_PROBE_PAGES and max(len(window) for window in windows) > Base.RSS_PROBE_PAGES
+    assert (output_dir / "doc.md").read_text().split("\n\n") == [f"Page {n}" for n in range(1, 41)]
+
+
+def test_no_budget_converts_in_one_pass(monkeypatch, tmp_path):
+    windows = stub_converter(monkeypatch, 40, lambda page: 0)
+    Base.convert_pdf(None, tmp_path / "doc.pdf", tmp_path, window_pages=0, rss_budget_mb=0)
+    assert windows == [list(range(40))]
+
+
+def test_overrun_falls_back_to_single_pages(monkeypatch, tmp_path):
+    # Cheap pages first, so the probe underestimates the expensive ones that follow
+    windows = stub_converter(monkeypatch, 24, lambda page: 30 * MB if page >= 8 else 2 * MB)
+    Base.convert_pdf(None, tmp_path / "doc.pdf", tmp_path, window_pages=0, rss_budget_mb=budget_mb(64))
+
+    overrun = next(n for n, window in enumerate(windows) if window[-1] >= 8)
+    assert len(windows[overrun]) > 1
+    assert all(len(window) == 1 for window in windows[overrun + 1:])
+    assert [page for window in windows for page in window] == list(range(24))
+
+
+def test_single_page_over_budget_aborts(monkeypatch, tmp_path):
+    stub_converter(monkeypatch, 8, lambda page: 48 * MB)
+    with pytest.raises(Base.RssBudgetExceeded):
+        Base.convert_pdf(None, tmp_path / "doc.pdf", tmp_path, window_pages=0, rss_budget_mb=budget_mb(32))
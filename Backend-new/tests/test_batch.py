@@ -0,0 +1,49 @@
+from conftest import add_chunks
+from retrieval_cache import RetrievalCache
+
+CHUNKS = [f"Port {n} supports a maximum voltage of {n} volts." for n in range(1, 31)]
+
+
+def test_retrieve_many_survives_a_batch_larger_than_the_cache(rag, monkeypatch):
+    add_chunks(rag, "doc", CHUNKS)
+    monkeypatch.setattr(rag, "retrieval_cache", RetrievalCache(max_entries=4))
+    questions = [f"What voltage does port {n} support?" for n in range(1, 31)]
+
+    results = rag.retrieve_many("doc", questions, k=3)
+
+    assert len(results) == len(questions) and all(len(docs) == 3 for docs in results)
+    assert [docs[0].page_content for docs in results] == [rag.retrieve("doc", q, k=3)[0].page_content
+                                                           for q in questions]
+
+
+def test_retrieve_many_embeds_each_distinct_question_once(rag, monkeypatch):
+    add_chunks(rag, "doc", CHUNKS)
+    calls = []
+    embed_documents = rag.embeddings.embed_documents
+    monkeypatch.setattr(rag.embeddings, "embed_documents", lambda texts: calls.append(texts) or embed_documents(texts))
+
+    results = rag.retrieve_many("doc", ["Port 1 voltage?", "port 1  VOLTAGE?", "Port 2 voltage?"])
+
+    assert len(calls) == 1 and len(calls[0]) == 2
+    assert [doc.metadata["chunk_id"] for doc in results[0]] == [doc.metadata["chunk_id"] for doc in results[1]]
+
+
+def test_answer_batch_reports_answers_and_errors(rag, monkeypatch):
+    add_chunks(rag, "doc", CHUNKS)
+    monkeypatch.setattr(rag, "RETRIEVAL_CONFIDENCE_FLOOR", 0.0)
+
+    def generate(messages, client=None, tier="large", tenant=None, priority="interactive"):
+        assert priority == "batch" and tenant == "doc"
+        if "port 3" in messages[-1][1].lower():
+            raise rag.LLMError("backend down")
+        return "answer"
+
+    monkeypatch.setattr(rag, "generate", generate)
+    questions = ["What voltage does port 1 support?", "What voltage does port 3 support?"]
+
+    events = list(rag.answer_batch("doc", questions, concurrency=2, citations=True))
+
+    by_index = {event["index"]: event for event in events[:-1]}
+    assert by_index[0]["type"] == "answer" and by_index[0]["answer"] == "answer" and by_index[0]["sources"]
+    assert by_index[1]["type"] == "error" and "backend down" in by_index[1]["detail"]
+    assert events[-1]["type"] == "done" and events[-1]["answered"] == 1 and events[-1]["errors"] == 1
@@ -0,0 +1,86 @@
+import chromadb
+import pytest
+
+import collection_admin
+import ingest_pipeline
+
+
+@pytest.fixture
+def documents(tmp_path, monkeypatch):
+    root = tmp_path / "backend" / "documents"
+    monkeypatch.setattr(ingest_pipeline, "BACKEND_DIR", tmp_path / "backend")
+    monkeypatch.setattr(ingest_pipeline, "DOCUMENTS_DIR", root)
+    return root
+
+
+@pytest.fixture
+def client(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+
+def ingested(registry, client, pdf_path, name):
+    """Registers a PDF's job, writes its intermediate files and creates its collection."""
+    paths = ingest_pipeline.DocumentPaths(pdf_path, name)
+    registry.claim_job(name, str(pdf_path))
+    paths.output_dir.mkdir(parents=True)
+    paths.base_md_file.write_text("# Title\n\nText.\n")
+    client.get_or_create_collection(name).add(ids=["c1"], embeddings=[[1.0, 0.0]], documents=["Text."])
+    return paths
+
+
+def test_collection_named_like_an_app_directory_stays_in_documents(registry, client, documents, tmp_path):
+    # pdf.pdf -> collection "pdf", the same name as the folder holding every upload
+    uploads = tmp_path / "backend" / "pdf"
+    uploads.mkdir(parents=True)
+    other_upload = uploads / "other.pdf"
+    other_upload.write_bytes(b"%PDF")
+    paths = ingested(registry, client, uploads / "pdf.pdf", "pdf")
+    (uploads / "pdf.pdf").write_bytes(b"%PDF")
+    assert paths.output_dir == documents / "pdf"
+
+    removed = collection_admin.delete_collection(client, "pdf")
+
+    assert removed["collection"] and removed["document_dir"] and removed["pdf"]
+    assert not paths.output_dir.exists() and documents.is_dir()
+    assert other_upload.is_file()
+    assert registry.get_job("pdf") is None
+
+
+def test_directory_outside_documents_is_never_removed(registry, client, documents, tmp_path, monkeypatch):
+    paths = ingested(registry, client, tmp_path / "doc.pdf", "doc")
+    outside = tmp_path / "backend" / "chroma_db"
+    outside.mkdir(parents=True)
+    monkeypatch.setattr(paths, "output_dir", outside)
+    monkeypatch.setattr(collection_admin, "document_paths", lambda name: paths)
+
+    removed = collection_admin.delete_collection(client, "doc", delete_pdf=False)
+
+    assert removed["collection"] and not removed["document_dir"]
+    assert outside.is_dir()
+
+
+def test_is_document_dir(documents, tmp_path):
+    assert ingest_pipeline.is_document_dir(documents / "doc")
+    assert not ingest_pipeline.is_document_dir(documents)
+    assert not ingest_pipeline.is_document_dir(documents / ".." / "pdf")
+    assert not ingest_pipeline.is_document_dir(tmp_path / "backend")
+
+
+def test_evicted_collection_is_restored_as_it_was(registry, client, tmp_path, monkeypatch):
+    monkeypatch.setattr(collection_admin, "COLD_STORAGE_DIR", tmp_path / "cold_storage")
+    collection = client.get_or_create_collection("doc")
+    collection.add(ids=["c1", "c2"], embeddings=[[1.0, 0.0], [0.0, 1.0]], documents=["One.", "Two."],
+                   metadatas=[{"heading_path": "A"}, {"heading_path": "B"}])
+
+    assert collection_admin.evict(client, "doc")
+    assert collection_admin.is_cold("doc")
+    assert "doc" not in [c.name for c in client.list_collections()]
+    # Another worker doesn't evict it twice
+    assert not collection_admin.evict(client, "doc")
+
+    assert collection_admin.restore(client, "doc")
+    assert not collection_admin.is_cold("doc")
+    data = client.get_collection("doc").get(include=["documents", "metadatas"])
+    assert sorted(zip(data["ids"], data["documents"])) == [("c1", "One."), ("c2", "Two.")]
+    assert not list((tmp_path / "cold_storage").iterdir())
+    assert not collection_admin.restore(client, "doc")
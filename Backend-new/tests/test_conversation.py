@@ -0,0 +1,85 @@
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import conversation
+
+
+def unit(vector):
+    vector = np.asarray(vector, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def session_with_turn(question, embedding):
+    session = conversation.ConversationSession("s", "doc")
+    session.turns.append({
+        "question": question, "message": question, "answer": "42 V", "chunk_ids": ["c1"],
+        "sources": [], "query_embedding": [float(x) for x in embedding],
+    })
+    return session
+
+
+def test_near_miss_question_is_retrieved_again():
+    # Embedding models put these two almost on top of each other
+    previous, follow_up = unit([1.0, 0.02, 0.0]), unit([1.0, 0.0, 0.02])
+    assert float(previous @ follow_up) > conversation.SESSION_REUSE_THRESHOLD
+    session = session_with_turn("What is the max voltage?", previous)
+
+    assert session.find_reusable_turn("What is the min voltage?", follow_up) is None
+
+
+def test_restated_question_reuses_the_turn():
+    previous, follow_up = unit([1.0, 0.02, 0.0]), unit([1.0, 0.0, 0.02])
+    session = session_with_turn("What is the max voltage?", previous)
+
+    assert session.find_reusable_turn("max voltage?", follow_up) is session.turns[0]
+
+
+def test_dissimilar_question_is_retrieved_again():
+    session = session_with_turn("What is the max voltage?", unit([1.0, 0.0, 0.0]))
+    assert session.find_reusable_turn("What is the max voltage?", unit([1.0, 0.5, 0.0])) is None
+
+
+class Chunk:
+    def __init__(self, chunk_id):
+        self.page_content = f"text of {chunk_id}"
+        self.metadata = {"chunk_id": chunk_id}
+
+
+def ask(session, question, chunk_ids):
+    docs = [Chunk(chunk_id) for chunk_id in chunk_ids]
+    new_docs = session.new_chunks(docs)
+    message = session.build_message(question, new_docs)
+    messages = session.build_messages(message)
+    sources = [conversation.citation(doc) for doc in docs]
+    session.record_turn(question, message, "answer", unit([1.0, 0.0]), new_docs, messages, sources)
+
+
+def test_trimming_keeps_chunks_that_retained_turns_relied_on(monkeypatch):
+    monkeypatch.setattr(conversation, "SESSION_MAX_TURNS", 2)
+    session = conversation.ConversationSession("s", "doc")
+    ask(session, "q1", ["c1", "c2"])
+    ask(session, "q2", ["c2", "c3"])  # c2 was skipped: it is in q1's message
+    ask(session, "q3", ["c4"])
+
+    prompt = "".join(content for _, content in session.build_messages("next"))
+    assert [turn["question"] for turn in session.turns] == ["q2", "q3"]
+    assert "text of c2" in prompt and "text of c3" in prompt
+    # Chunks no retained turn relied on are not carried over
+    assert "text of c1" not in prompt
+    assert session.turns[0]["message"] == "CONTEXT:\ntext of c2\n\ntext of c3\n\nQUESTION:\nq2"
+
+
+def test_reused_turn_keeps_its_context_after_trimming(monkeypatch):
+    monkeypatch.setattr(conversation, "SESSION_MAX_TURNS", 2)
+    session = conversation.ConversationSession("s", "doc")
+    ask(session, "max voltage", ["c1"])
+    first = session.turns[0]
+    session.record_turn("max voltage?", "QUESTION:\nmax voltage?", "answer", unit([1.0, 0.0]), [],
+                        [], first["sources"])
+    ask(session, "q3", ["c2"])
+
+    assert "text of c1" in session.turns[0]["message"]
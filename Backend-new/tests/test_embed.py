@@ -0,0 +1,48 @@
+import chromadb
+import pytest
+
+import Emmbed
+from conftest import FakeSentenceTransformer
+
+VERSION_1 = "# Manual\n\n## Power\n\nThe max voltage is 42 V.\n\n## Fuses\n\nUse 5 A fuses.\n"
+VERSION_2 = "# Manual\n\n## Power\n\nThe max voltage is 48 V.\n"
+
+
+@pytest.fixture
+def client(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+
+def ingest(client, tmp_path, text):
+    markdown_file = tmp_path / "doc.md"
+    markdown_file.write_text(text)
+    return Emmbed.embed_markdown(FakeSentenceTransformer(), client, markdown_file, "doc")
+
+
+def test_reingesting_replaces_the_chunks(registry, client, tmp_path):
+    ingest(client, tmp_path, VERSION_1)
+    old_id = client.get_collection("doc").id
+
+    ingest(client, tmp_path, VERSION_2)
+
+    collection = client.get_collection("doc")
+    documents = collection.get()["documents"]
+    assert any("48 V" in text for text in documents)
+    assert not any("42 V" in text or "fuses" in text for text in documents)
+    # Updated in place: the collection was never dropped
+    assert collection.id == old_id
+    assert registry.get_collection_version("doc") == 2
+
+
+def test_failed_reingestion_keeps_the_previous_version(registry, client, tmp_path, monkeypatch):
+    ingest(client, tmp_path, VERSION_1)
+    before = sorted(client.get_collection("doc").get()["documents"])
+
+    def failing_add(self, **kwargs):
+        raise RuntimeError("disk full")
+    monkeypatch.setattr(chromadb.api.models.Collection.Collection, "add", failing_add)
+    with pytest.raises(RuntimeError):
+        ingest(client, tmp_path, VERSION_2)
+
+    assert sorted(client.get_collection("doc").get()["documents"]) == before
+    assert registry.get_collection_version("doc") == 1
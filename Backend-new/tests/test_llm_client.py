@@ -0,0 +1,58 @@
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import llm_client
+from llm_client import LLMError, OllamaChatClient
+
+
+def client_for(replies, max_retries=2):
+    """A client whose backend answers the requests with `replies` (bytes bodies), in order."""
+    replies = list(replies)
+    client = OllamaChatClient("http://llm", "stub", max_retries=max_retries, hedge=False)
+    client._http = httpx.Client(base_url="http://llm",
+                                transport=httpx.MockTransport(lambda request: httpx.Response(200, content=replies.pop(0))))
+    return client, replies
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm_client, "LLM_BACKOFF_BASE", 0.0)
+
+
+ANSWER = json.dumps({"message": {"role": "assistant", "content": "42 V"}, "done": True}).encode()
+
+
+@pytest.mark.parametrize("bad", [b"<html>502 Bad Gateway</html>", b'{"error": "model is overloaded"}',
+                                 b'{"message": {"role": "assistant"}}', b"[]"])
+def test_malformed_reply_is_retried(bad):
+    client, replies = client_for([bad, ANSWER])
+    assert client.chat([("human", "max voltage?")]) == "42 V"
+    assert replies == []
+
+
+def test_malformed_replies_end_in_llm_error():
+    client, _ = client_for([b'{"error": "model not found"}'] * 3)
+    with pytest.raises(LLMError, match="model not found"):
+        client.chat([("human", "max voltage?")])
+
+
+def stream_body(*lines):
+    return b"\n".join(lines)
+
+
+def test_stream_error_before_output_is_retried():
+    ok = stream_body(b'{"message": {"content": "42"}}', b'{"message": {"content": " V"}}', b'{"done": true}')
+    client, _ = client_for([stream_body(b'{"error": "overloaded"}'), ok])
+    assert "".join(client.stream_chat([("human", "max voltage?")])) == "42 V"
+
+
+def test_stream_error_after_output_raises_llm_error():
+    client, _ = client_for([stream_body(b'{"message": {"content": "42"}}', b"not json")])
+    with pytest.raises(LLMError, match="broke off"):
+        list(client.stream_chat([("human", "max voltage?")]))
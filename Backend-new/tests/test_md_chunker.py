@@ -0,0 +1,84 @@
+import md_chunker
+
+
+def words(text):
+    return len(text.split())
+
+
+def chunk(markdown, max_tokens=40, min_tokens=5):
+    return list(md_chunker.chunk_markdown_lines(markdown.splitlines(), max_tokens=max_tokens,
+                                                min_tokens=min_tokens, count_tokens=words))
+
+
+def paragraph(n, word="word"):
+    return " ".join([word] * n)
+
+
+def test_sections_become_chunks_with_their_heading_path():
+    chunks = chunk(f"# Manual\n\n## Power\n\n{paragraph(10)}\n\n## Fuses\n\n{paragraph(10, 'fuse')}\n")
+
+    # The first chunk also holds the "# Manual" heading, so only that heading is shared by all its blocks
+    assert [c.metadata["heading_path"] for c in chunks] == ["Manual", "Manual > Fuses"]
+    assert chunks[0].text.startswith("# Manual\n\n## Power\n\n")
+    assert chunks[1].text.startswith("## Fuses\n\n") and "word" not in chunks[1].text
+
+
+def test_tiny_section_is_merged_with_the_next():
+    chunks = chunk(f"# A\n\nshort.\n\n# B\n\n{paragraph(10)}\n")
+
+    assert len(chunks) == 1
+    assert chunks[0].metadata["heading_path"] == ""
+
+
+def test_heading_moves_on_with_the_block_it_introduces():
+    chunks = chunk(f"# A\n\n{paragraph(30)}\n\n## B\n\n{paragraph(30)}\n", min_tokens=100)
+
+    assert not chunks[0].text.rstrip().endswith("## B")
+    assert chunks[1].text.startswith("## B\n\n")
+    assert chunks[1].metadata["heading_path"] == "A > B"
+
+
+def test_code_block_stays_whole_and_its_comments_are_not_headings():
+    code = "```python\n# not a heading\n\n" + "\n".join(f"x = {n}" for n in range(30)) + "\n```"
+    chunks = chunk(f"# Setup\n\n{code}\n\nAfter the code.\n")
+
+    assert [c for c in chunks if code in c.text]
+    assert all(c.metadata["heading_path"] in ("Setup", "") for c in chunks)
+    assert any(c.metadata["has_code"] for c in chunks)
+
+
+def test_oversized_table_is_split_by_rows_repeating_the_header():
+    rows = "\n".join(f"| {n} | {paragraph(4, 'cell')} |" for n in range(20))
+    table = f"| Pin | Function |\n|---|---|\n{rows}"
+    chunks = chunk(f"# Pins\n\n{table}\n")
+
+    assert len(chunks) > 1
+    for c in chunks:
+        assert c.metadata["has_table"]
+        assert "| Pin | Function |\n|---|---|\n|" in c.text
+    found = [line for c in chunks for line in c.text.splitlines() if line.startswith("| ") and "cell" in line]
+    assert found == rows.splitlines()
+
+
+def test_image_description_is_never_cut():
+    description = "> **Image Description:** " + paragraph(60, "pixel")
+    chunks = chunk(f"# Figure\n\n{description}\n")
+
+    assert [c for c in chunks if description in c.text and c.metadata["has_image"]]
+
+
+def test_overlong_sentence_is_split_at_word_boundaries():
+    chunks = chunk(f"# Long\n\n{paragraph(100)}\n")
+
+    assert len(chunks) > 1
+    assert all(c.metadata["tokens"] <= 40 for c in chunks)
+    assert sum(c.text.count("word") for c in chunks) == 100
+
+
+def test_page_anchors_set_the_page_range():
+    markdown = (f'<span id="page-0-0"></span>\n\n# A\n\n{paragraph(10)}\n\n'
+                f'<span id="page-2-0"></span>\n\n{paragraph(10)}\n')
+    chunks = chunk(markdown)
+
+    assert (chunks[0].metadata["page_start"], chunks[0].metadata["page_end"]) == (1, 3)
+    assert "<span" not in chunks[0].text
@@ -0,0 +1,49 @@
+import json
+
+import numpy as np
+import pytest
+
+import rag_components
+
+
+@pytest.fixture
+def prefetched(registry):
+    """Stores a prefetch of `text` for a client, as /chat/prefetch would."""
+    def save(client_id, text, collection_name="doc"):
+        docs = json.dumps([{"page_content": f"chunk for {text}", "metadata": {"chunk_id": text}}])
+        registry.save_prefetch(client_id, collection_name, rag_components.normalize_query(text),
+                               registry.get_collection_version(collection_name),
+                               np.ones(4, dtype=np.float32).tobytes(), docs, 0.1, rag_components.PREFETCH_TTL)
+    return save
+
+
+@pytest.mark.parametrize("prefetched_text, question, expected", [
+    ("what is the max voltage?", "what is the max voltage?", "exact"),
+    ("what is the max voltage of the board?", "max voltage of the board", "close"),
+    ("what is the max voltage?", "what is the min voltage?", None),
+    ("does it support usb 2.0", "does it support usb 3.0", None),
+    ("what is the max", "what is the max voltage?", None),
+])
+def test_prefetch_match(prefetched_text, question, expected):
+    assert rag_components.prefetch_match(prefetched_text, question) == expected
+
+
+def test_near_miss_is_not_answered_from_the_prefetch(prefetched):
+    prefetched("page-1", "What is the max voltage?")
+    assert rag_components.use_prefetch("doc", "What is the min voltage?", "page-1") is None
+
+    embedding, docs = rag_components.use_prefetch("doc", "what is the  max voltage?", "page-1")
+    assert docs[0].metadata["chunk_id"] == "What is the max voltage?" and len(embedding) == 4
+
+
+def test_prefetch_is_only_used_by_the_client_that_typed_it(prefetched):
+    prefetched("page-1", "What is the max voltage?")
+    assert rag_components.use_prefetch("doc", "What is the max voltage?", "page-2") is None
+    assert rag_components.use_prefetch("doc", "What is the max voltage?", None) is None
+    assert rag_components.use_prefetch("other", "What is the max voltage?", "page-1") is None
+
+
+def test_prefetch_of_an_older_collection_version_is_ignored(prefetched, registry):
+    prefetched("page-1", "What is the max voltage?")
+    registry.bump_collection_version("doc")
+    assert rag_components.use_prefetch("doc", "What is the max voltage?", "page-1") is None
@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+import scheduler
+
+LIMITS = {"slots": 1, "background_slots": 1, "rate": 0.0, "burst": 20.0, "max_hold": 900.0}
+INTERACTIVE, INGEST = scheduler.PRIORITIES["interactive"], scheduler.PRIORITIES["ingest"]
+
+
+def enqueue(registry, tenant, priority=INTERACTIVE, limits=LIMITS):
+    return registry.enqueue_model_call("test", tenant, priority, 1.0, 1.0, limits)[0]
+
+
+def grant_order(registry, tickets, limits=LIMITS):
+    """Releases running calls one at a time and returns the tickets in the order they got the slot."""
+    order = []
+    while len(order) < len(tickets):
+        running = [t for t in tickets if t not in order
+                   and registry.model_call_state(t) == registry.CALL_RUNNING]
+        assert len(running) <= limits["slots"]
+        order.extend(running)
+        for ticket in running:
+            registry.release_model_call(ticket, "test", limits)
+    return order
+
+
+def test_a_tenant_with_a_backlog_does_not_delay_a_new_tenant(registry):
+    holder = enqueue(registry, "other")
+    backlog = [enqueue(registry, "hog") for _ in range(5)]
+    newcomer = enqueue(registry, "small")
+    registry.release_model_call(holder, "test", LIMITS)
+
+    order = grant_order(registry, backlog + [newcomer])
+
+    assert order.index(newcomer) <= 1
+
+
+def test_interactive_calls_go_before_background_calls(registry):
+    holder = enqueue(registry, "doc")
+    ingest = [enqueue(registry, "doc", INGEST) for _ in range(3)]
+    chat = enqueue(registry, "other")
+    registry.release_model_call(holder, "test", LIMITS)
+
+    assert grant_order(registry, ingest + [chat])[0] == chat
+
+
+def test_background_calls_never_take_every_slot(registry):
+    limits = dict(LIMITS, slots=3, background_slots=1)
+    ingest = [enqueue(registry, "doc", INGEST, limits) for _ in range(3)]
+    chat = enqueue(registry, "other", INTERACTIVE, limits)
+
+    states = [registry.model_call_state(t) for t in ingest]
+    assert states.count(registry.CALL_RUNNING) == 1
+    assert registry.model_call_state(chat) == registry.CALL_RUNNING
+
+
+def test_slot_limits_concurrency_across_threads(registry, monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_SLOTS", 2)
+    monkeypatch.setattr(scheduler, "SCHEDULER_BACKGROUND_SLOTS", 1)
+    running, peak, lock = [0], [0], threading.Lock()
+
+    def call(n):
+        with scheduler.slot(f"doc-{n % 3}", "interactive" if n % 2 else "ingest", pool="test"):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+    threads = [threading.Thread(target=call, args=(n,)) for n in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+    assert registry.list_model_calls("test") == []
+
+
+def test_disabled_scheduler_bypasses_the_registry(registry, monkeypatch):
+    monkeypatch.setattr(scheduler, "SCHEDULER_SLOTS", 0)
+    monkeypatch.setattr(registry, "enqueue_model_call", pytest.fail)
+    with scheduler.slot("doc"):
+        pass
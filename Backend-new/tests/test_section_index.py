@@ -0,0 +1,105 @@
+import chromadb
+import numpy as np
+import pytest
+
+import section_index
+from conftest import FakeEmbeddings
+
+
+@pytest.fixture
+def client(tmp_path):
+    return chromadb.PersistentClient(path=str(tmp_path / "chroma"))
+
+
+def large_document(monkeypatch, chapters=("Power", "Fuses", "Cooling", "Wiring"), chunks_per_chapter=8):
+    """Chunk texts and metadata of a document with one topic word per chapter."""
+    monkeypatch.setattr(section_index, "SECTION_INDEX_MIN_CHUNKS", 10)
+    texts, metadatas = [], []
+    for chapter in chapters:
+        for n in range(chunks_per_chapter):
+            texts.append(f"{chapter.lower()} detail {n} of {chapter.lower()}")
+            metadatas.append({"heading_path": f"Manual > {chapter} > Part {n}", "page_start": len(texts)})
+    return texts, metadatas
+
+
+def indexed(client, texts, metadatas, name="doc"):
+    sections = section_index.assign_sections(metadatas)
+    ids = [f"c{i}" for i in range(len(texts))]
+    embeddings = FakeEmbeddings().embed_documents(texts)
+    collection = client.get_or_create_collection(name, metadata={"sections": sections})
+    collection.add(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+    section_index.build_section_index(client, name, ids, embeddings, metadatas)
+    return collection
+
+
+def test_small_documents_get_no_sections(monkeypatch):
+    monkeypatch.setattr(section_index, "SECTION_INDEX_MIN_CHUNKS", 10)
+    metadatas = [{"heading_path": "A"} for _ in range(9)]
+
+    assert section_index.assign_sections(metadatas) == 0
+    assert not any("section" in m for m in metadatas)
+
+
+def test_sections_follow_headings_and_size_limits(monkeypatch):
+    texts, metadatas = large_document(monkeypatch, chunks_per_chapter=10)
+    monkeypatch.setattr(section_index, "SECTION_MAX_CHUNKS", 5)
+
+    count = section_index.assign_sections(metadatas)
+
+    sections = [m["section"] for m in metadatas]
+    assert sections == sorted(sections) and count == sections[-1] + 1
+    # Chapters are never mixed, and each chapter of 10 chunks is split as 5 + 5
+    assert count == 8
+    for n in range(count):
+        chapters = {m["heading_path"].split(" > ")[1] for m in metadatas if m["section"] == n}
+        assert len(chapters) == 1
+
+
+def test_small_section_is_merged_with_the_next(monkeypatch):
+    texts, metadatas = large_document(monkeypatch, chunks_per_chapter=3)
+    monkeypatch.setattr(section_index, "SECTION_MIN_CHUNKS", 4)
+
+    section_index.assign_sections(metadatas)
+
+    assert metadatas[2]["section"] == metadatas[3]["section"]
+
+
+def test_query_searches_the_closest_section(client, monkeypatch):
+    texts, metadatas = large_document(monkeypatch)
+    collection = indexed(client, texts, metadatas)
+    query = FakeEmbeddings().embed_query("fuses fuses detail")
+
+    results = section_index.query(client, collection, query, 3, ["documents", "metadatas", "distances"], top_n=1)
+
+    assert len(results["ids"][0]) == 3
+    assert all("fuses" in text for text in results["documents"][0])
+    assert all("Fuses" in m["heading_path"] for m in results["metadatas"][0])
+    flat = collection.query(query_embeddings=[query], n_results=3)
+    np.testing.assert_allclose(sorted(results["distances"][0]), sorted(flat["distances"][0]), atol=1e-4)
+
+
+def test_missing_section_index_falls_back_to_a_flat_search(client, monkeypatch):
+    texts, metadatas = large_document(monkeypatch)
+    collection = indexed(client, texts, metadatas)
+    section_index.drop_section_index(client, "doc")
+
+    results = section_index.query(client, collection, FakeEmbeddings().embed_query("cooling"), 2, ["documents"])
+
+    assert all("cooling" in text for text in results["documents"][0])
+
+
+def test_rebuilt_index_is_not_served_from_the_section_cache(client, monkeypatch):
+    texts, metadatas = large_document(monkeypatch)
+    collection = indexed(client, texts, metadatas)
+    query = FakeEmbeddings().embed_query("power")
+    section_index.query(client, collection, query, 2, ["documents"], top_n=1)
+
+    # Re-ingested in place under new ids (as Emmbed.py does), then the old chunks are deleted
+    new_ids = [f"v2-{i}" for i in range(len(texts))]
+    embeddings = FakeEmbeddings().embed_documents(texts)
+    collection.add(ids=new_ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+    section_index.build_section_index(client, "doc", new_ids, embeddings, metadatas)
+    collection.delete(ids=[f"c{i}" for i in range(len(texts))])
+
+    results = section_index.query(client, collection, query, 2, ["documents"], top_n=1)
+    assert all(chunk_id.startswith("v2-") for chunk_id in results["ids"][0])
@@ -0,0 +1,43 @@
+import itertools
+import threading
+
+import tts_engines
+
+
+class FakeEngine:
+    name = "fake"
+    voice = "test"
+
+    def synthesize(self, sentence):
+        return sentence.encode("utf-8")
+
+
+def test_sentences_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(tts_engines, "TTS_CACHE_DIR", tmp_path)
+    sentences = ["One.", "Two.", "Three."]
+
+    result = list(tts_engines.synthesize_stream(iter(sentences), FakeEngine()))
+
+    assert result == [(sentence, sentence.encode("utf-8")) for sentence in sentences]
+
+
+def test_closing_early_closes_the_producer(tmp_path, monkeypatch):
+    monkeypatch.setattr(tts_engines, "TTS_CACHE_DIR", tmp_path)
+    closed = threading.Event()
+
+    def endless_llm():
+        try:
+            for n in itertools.count():
+                yield f"Sentence {n}."
+        finally:
+            closed.set()  # Where a real LLM stream would give back its scheduler slot
+
+    # Held here, like /chat/speak holds its answer generator, so only an explicit close() ends it
+    llm = endless_llm()
+    stopped = threading.Event()
+    stream = tts_engines.synthesize_stream(llm, FakeEngine(), stopped)
+    assert next(stream) == ("Sentence 0.", b"Sentence 0.")
+    stream.close()
+
+    assert stopped.is_set()
+    assert closed.wait(5)
@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import os
+import threading
+
+import pytest
+
+import upload_store
+
+PART = upload_store.UPLOAD_MIN_PART_SIZE
+
+
+@pytest.fixture
+def uploads(registry, tmp_path, monkeypatch):
+    monkeypatch.setattr(upload_store, "UPLOAD_DIR", tmp_path / "uploads")
+    return upload_store
+
+
+async def _stream(data: bytes, chunk: int = 64 * 1024):
+    for start in range(0, len(data), chunk):
+        yield data[start:start + chunk]
+
+
+def send(upload, part, data, sha256=None):
+    return asyncio.run(upload_store.write_part(upload, part, _stream(data), sha256))
+
+
+def test_parts_in_any_order_resume_and_complete(uploads, tmp_path):
+    data = os.urandom(2 * PART + 1000)
+    parts = [data[n * PART:(n + 1) * PART] for n in range(3)]
+    upload = uploads.create_upload("manual.pdf", len(data), PART)
+
+    send(upload, 2, parts[2])
+    send(upload, 0, parts[0])
+    # A client that lost its connection asks which parts are still missing
+    resumed = uploads.describe(uploads.get_upload(upload["upload_id"]))
+    assert resumed["received"] == [0, 2] and resumed["missing"] == [1]
+    with pytest.raises(upload_store.UploadError) as e:
+        uploads.complete_upload(uploads.get_upload(upload["upload_id"]), tmp_path / "manual.pdf")
+    assert e.value.status_code == 409
+
+    send(upload, 1, parts[1])
+    digest = uploads.complete_upload(uploads.get_upload(upload["upload_id"]), tmp_path / "manual.pdf")
+
+    assert (tmp_path / "manual.pdf").read_bytes() == data
+    expected = hashlib.sha256(b"".join(hashlib.sha256(p).digest() for p in parts)).hexdigest()
+    assert digest == f"{expected}-3"
+    with pytest.raises(upload_store.UploadError):
+        uploads.get_upload(upload["upload_id"])
+
+
+def test_part_with_wrong_sha256_is_rejected_and_not_recorded(uploads):
+    upload = uploads.create_upload("manual.pdf", PART, PART)
+    data = os.urandom(PART)
+
+    with pytest.raises(upload_store.UploadError) as e:
+        send(upload, 0, data, sha256=hashlib.sha256(b"something else").hexdigest())
+    assert e.value.status_code == 422
+    assert uploads.get_upload(upload["upload_id"])["parts"] == {}
+
+    assert send(upload, 0, data, sha256=hashlib.sha256(data).hexdigest())["sha256"] == hashlib.sha256(data).hexdigest()
+
+
+def test_part_of_the_wrong_length_is_rejected(uploads):
+    upload = uploads.create_upload("manual.pdf", 2 * PART, PART)
+    with pytest.raises(upload_store.UploadError):
+        send(upload, 0, os.urandom(PART - 1))
+    with pytest.raises(upload_store.UploadError):
+        send(upload, 0, os.urandom(PART + 1))
+    with pytest.raises(upload_store.UploadError):
+        send(upload, 2, os.urandom(PART))
+
+
+def test_registry_is_never_called_on_the_event_loop(uploads, monkeypatch):
+    upload = uploads.create_upload("manual.pdf", PART, PART)
+    send(upload, 0, os.urandom(PART))
+    upload = uploads.get_upload(upload["upload_id"])
+    loop_thread = threading.current_thread()
+    calls = []
+
+    def off_loop(function):
+        def wrapper(*args, **kwargs):
+            calls.append(threading.current_thread() is not loop_thread)
+            return function(*args, **kwargs)
+        return wrapper
+
+    job_registry = upload_store.job_registry
+    monkeypatch.setattr(job_registry, "forget_upload_part", off_loop(job_registry.forget_upload_part))
+    monkeypatch.setattr(job_registry, "record_upload_part", off_loop(job_registry.record_upload_part))
+    send(upload, 0, os.urandom(PART))  # Re-sent: forgets, then records the part
+
+    assert calls == [True, True]
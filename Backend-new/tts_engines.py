@@ -0,0 +1,264 @@
+import contextvars
+import hashlib
+import io
+import os
+import queue
+import re
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+from retrieval_cache import LRUCache
+
+# --- 1. Configuration ---
+
+# Which synthesizer /tts/ and /chat/speak use: "gtts" (Google, needs internet)
+# or "espeak" (local, needs the espeak-ng binary)
+TTS_ENGINE = os.getenv("TTS_ENGINE", "gtts")
+TTS_LANGUAGE = os.getenv("TTS_LANGUAGE", "en")
+ESPEAK_VOICE = os.getenv("ESPEAK_VOICE", "en-us")
+# Synthesized sentences are stored here by content hash, shared by all workers
+TTS_CACHE_DIR = Path(os.getenv("TTS_CACHE_DIR", Path(__file__).parent / "tts_cache"))
+TTS_MEMORY_CACHE_SIZE = int(os.getenv("TTS_MEMORY_CACHE_SIZE", 512))
+# Sentences synthesized in parallel (per request) while earlier ones are played
+TTS_MAX_PARALLEL = int(os.getenv("TTS_MAX_PARALLEL", 4))
+
+# Every engine returns MP3: MP3 frames can be concatenated, so the
+# sentences of one answer form a single playable stream
+AUDIO_MEDIA_TYPE = "audio/mpeg"
+
+FFMPEG_WAV_TO_MP3_CMD = [
+    "ffmpeg", "-hide_banner", "-loglevel", "error",
+    "-i", "pipe:0",
+    "-f", "mp3", "-ac", "1", "-b:a", "64k",
+    "pipe:1",
+]
+
+# A sentence ends at . ! ? (or a line break) followed by whitespace
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+|\n+")
+_WHITESPACE = re.compile(r"\s+")
+# Markdown the LLM emits that should not be read aloud: emphasis is
+# dropped, heading/quote/table markers become spaces
+_MARKDOWN_EMPHASIS = re.compile(r"[*_`]+")
+_MARKDOWN_MARKERS = re.compile(r"[#>|]+")
+
+metrics.describe("rag_tts_cache_hits_total", "Sentences served from the TTS cache.")
+metrics.describe("rag_tts_cache_misses_total", "Sentences that had to be synthesized.")
+
+
+class SpeechSynthesisError(Exception):
+    """The synthesizer failed (API unreachable, binary missing, ...)."""
+
+
+# -----------------------------------------------------------
+# Text preparation
+# -----------------------------------------------------------
+def clean_for_speech(text: str) -> str:
+    """Strips Markdown markup and collapses whitespace."""
+    text = _MARKDOWN_MARKERS.sub(" ", _MARKDOWN_EMPHASIS.sub("", text))
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+def split_sentences(text: str) -> list:
+    return [s for s in (clean_for_speech(p) for p in _SENTENCE_END.split(text)) if s]
+
+
+class SentenceSplitter:
+    """
+    Splits streamed text into sentences as soon as they are complete:
+
+        splitter.feed("Hello there. How")  -> ["Hello there."]
+        splitter.feed(" are you?")         -> []   (may continue)
+        splitter.flush()                   -> ["How are you?"]
+    """
+
+    def __init__(self):
+        self._buffer = ""
+
+    def feed(self, text: str) -> list:
+        self._buffer += text
+        parts = _SENTENCE_END.split(self._buffer)
+        # The last part may be an unfinished sentence
+        self._buffer = parts.pop()
+        return [s for s in (clean_for_speech(p) for p in parts) if s]
+
+    def flush(self) -> list:
+        rest, self._buffer = self._buffer, ""
+        return split_sentences(rest)
+
+
+# -----------------------------------------------------------
+# Synthesizer backends
+# -----------------------------------------------------------
+class GTTSEngine:
+    """Google Translate TTS through gTTS (remote, needs internet). Produces MP3 directly."""
+
+    name = "gtts"
+
+    def __init__(self):
+        try:
+            from gtts import gTTS
+        except ImportError:
+            raise SpeechSynthesisError("The 'gTTS' package is not installed.")
+        self._gtts = gTTS
+
+    @property
+    def voice(self):
+        return TTS_LANGUAGE
+
+    def synthesize(self, text: str) -> bytes:
+        buffer = io.BytesIO()
+        try:
+            self._gtts(text=text, lang=TTS_LANGUAGE, slow=False).write_to_fp(buffer)
+        except Exception as e:
+            raise SpeechSynthesisError(f"gTTS error (check internet connection): {e}")
+        return buffer.getvalue()
+
+
+class EspeakEngine:
+    """espeak-ng (local, offline). WAV from espeak-ng is encoded to MP3 through an ffmpeg pipe."""
+
+    name = "espeak"
+
+    def __init__(self):
+        self._binary = "espeak-ng"
+
+    @property
+    def voice(self):
+        return ESPEAK_VOICE
+
+    def synthesize(self, text: str) -> bytes:
+        try:
+            wav = subprocess.run(
+                [self._binary, "-v", ESPEAK_VOICE, "--stdout", text],
+                capture_output=True, check=True,
+            ).stdout
+            return subprocess.run(FFMPEG_WAV_TO_MP3_CMD, input=wav, capture_output=True, check=True).stdout
+        except FileNotFoundError as e:
+            raise SpeechSynthesisError(f"{e.filename} not found. Please install it and make sure it is on PATH.")
+        except subprocess.CalledProcessError as e:
+            raise SpeechSynthesisError(e.stderr.decode("utf-8", "replace").strip() or str(e))
+
+
+ENGINES = {
+    "gtts": GTTSEngine,
+    "espeak": EspeakEngine,
+}
+
+_engine_instances = {}
+
+
+def get_engine(name: str = None):
+    """Returns the (cached) synthesizer backend by name, defaulting to TTS_ENGINE."""
+    name = name or TTS_ENGINE
+    if name not in ENGINES:
+        raise SpeechSynthesisError(f"Unknown TTS engine '{name}'. Available: {sorted(ENGINES)}")
+    if name not in _engine_instances:
+        _engine_instances[name] = ENGINES[name]()
+    return _engine_instances[name]
+
+
+# -----------------------------------------------------------
+# Content-addressed sentence cache
+# -----------------------------------------------------------
+_memory_cache = LRUCache(TTS_MEMORY_CACHE_SIZE)
+_DONE = object()
+
+
+def cache_key(engine, sentence: str) -> str:
+    """Same engine, voice and text -> same audio, so the hash of those is the key."""
+    return hashlib.sha256(f"{engine.name}\0{engine.voice}\0{sentence}".encode("utf-8")).hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return TTS_CACHE_DIR / key[:2] / f"{key}.mp3"
+
+
+def synthesize_sentence(sentence: str, engine=None) -> bytes:
+    """
+    Returns MP3 audio for one sentence: from memory, then from TTS_CACHE_DIR
+    (shared by all workers), and only then from the engine.
+    """
+    engine = engine or get_engine()
+    key = cache_key(engine, sentence)
+
+    audio = _memory_cache.get(key)
+    if audio is None:
+        path = _cache_path(key)
+        try:
+            audio = path.read_bytes()
+        except FileNotFoundError:
+            metrics.inc("rag_tts_cache_misses_total", engine=engine.name)
+            with metrics.span("tts", "synthesize", engine=engine.name):
+                audio = engine.synthesize(sentence)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_name(f"{key}.{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp.write_bytes(audio)
+            os.replace(tmp, path)
+            _memory_cache.put(key, audio)
+            return audio
+        _memory_cache.put(key, audio)
+    metrics.inc("rag_tts_cache_hits_total", engine=engine.name)
+    return audio
+
+
+def synthesize_stream(sentences, engine=None, stopped=None):
+    """
+    Yields (sentence, mp3_bytes) in order for an iterable of sentences,
+    which may itself be produced while the LLM is still generating.
+    The iterable is consumed in a background thread and each sentence is
+    submitted for synthesis as soon as it exists, so a sentence is yielded
+    as soon as its audio is ready, not when the next sentence arrives.
+
+    If this generator is closed early (the client disconnected), `stopped`
+    is set, and the producer thread closes `sentences` (if it is a
+    generator) instead of reading it to the end. A `sentences` generator can
+    check `stopped` to give up between sentences too.
+    """
+    engine = engine or get_engine()
+    pool = ThreadPoolExecutor(max_workers=TTS_MAX_PARALLEL, thread_name_prefix="tts")
+    # Bounded: the producer waits if synthesis falls far behind generation
+    submitted = queue.Queue(maxsize=TTS_MAX_PARALLEL * 2)
+    stopped = stopped or threading.Event()
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                submitted.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def produce():
+        try:
+            for sentence in sentences:
+                if stopped.is_set():
+                    return  # The consumer went away (e.g. the client disconnected)
+                put((sentence, pool.submit(synthesize_sentence, sentence, engine)))
+            put(_DONE)
+        except BaseException as e:
+            put(e)
+        finally:
+            # Closed in the thread that runs it, so e.g. an LLM stream gives its slot back now
+            close = getattr(sentences, "close", None)
+            if close is not None:
+                close()
+
+    # The producer runs in a copy of this context, so its spans land in the caller's trace
+    context = contextvars.copy_context()
+    producer = threading.Thread(target=context.run, args=(produce,), daemon=True, name="tts-producer")
+    producer.start()
+    try:
+        while True:
+            item = submitted.get()
+            if item is _DONE:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            sentence, future = item
+            yield sentence, future.result()
+    finally:
+        stopped.set()
+        pool.shutdown(wait=False, cancel_futures=True)
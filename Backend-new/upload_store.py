@@ -0,0 +1,184 @@
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+
+from starlette.concurrency import run_in_threadpool
+
+import job_registry
+from ingest_pipeline import BACKEND_DIR
+
+# --- Resumable chunked uploads ---
+# Large PDFs are uploaded in parts (init, PUT each part, complete) so a
+# failed upload resumes with the missing parts instead of starting over:
+#
+#   POST   /uploads/                     {"filename", "size"} -> upload_id, part_size, parts
+#   PUT    /uploads/{id}/parts/{n}       raw bytes of part n (optional X-Part-SHA256 header)
+#   GET    /uploads/{id}                 which parts have been received
+#   POST   /uploads/{id}/complete        -> starts processing like /upload-pdf/
+#
+# The data file is preallocated at init and every part is written straight
+# to its offset, so completing an upload is a rename: the file is never
+# re-read or concatenated. Each part is hashed while it is written; the
+# upload's digest is the SHA-256 of the part digests (as in S3 multipart).
+# Parts and their digests are recorded in the job registry, so any worker
+# can receive any part.
+
+# --- 1. Configuration ---
+
+# Must be on the same filesystem as pdf/, so completing an upload is a rename
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", BACKEND_DIR / "uploads"))
+UPLOAD_PART_SIZE = int(os.getenv("UPLOAD_PART_SIZE", 8 * 1024 * 1024))
+UPLOAD_MIN_PART_SIZE = 256 * 1024
+UPLOAD_MAX_PART_SIZE = 64 * 1024 * 1024
+UPLOAD_MAX_SIZE = int(os.getenv("UPLOAD_MAX_SIZE", 2 * 1024 ** 3))
+# Unfinished uploads are discarded after this many seconds
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL_SECONDS", 24 * 3600))
+# Request body bytes are written (and hashed) off the event loop in blocks of this size
+WRITE_BLOCK_SIZE = 1024 * 1024
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """A request that can't be applied to an upload; status_code is the HTTP status to answer with."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def data_path(upload_id: str) -> Path:
+    return UPLOAD_DIR / f"{upload_id}.part"
+
+
+def part_count(upload: dict) -> int:
+    return max(1, -(-upload["size"] // upload["part_size"]))
+
+
+def part_length(upload: dict, part: int) -> int:
+    return min(upload["part_size"], upload["size"] - part * upload["part_size"])
+
+
+def missing_parts(upload: dict) -> list:
+    return [n for n in range(part_count(upload)) if n not in upload["parts"]]
+
+
+def combined_digest(upload: dict) -> str:
+    """SHA-256 over the binary digests of all parts in order, suffixed with the part count."""
+    digest = hashlib.sha256()
+    for n in range(part_count(upload)):
+        digest.update(bytes.fromhex(upload["parts"][n]["sha256"]))
+    return f"{digest.hexdigest()}-{part_count(upload)}"
+
+
+def describe(upload: dict) -> dict:
+    """The client's view of an upload: what to send next."""
+    return {
+        "upload_id": upload["upload_id"],
+        "filename": upload["filename"],
+        "size": upload["size"],
+        "part_size": upload["part_size"],
+        "parts": part_count(upload),
+        "received": sorted(upload["parts"]),
+        "missing": missing_parts(upload),
+    }
+
+
+def create_upload(filename: str, size: int, part_size: int = None) -> dict:
+    """Registers a new upload and preallocates its data file."""
+    if not filename.lower().endswith(".pdf"):
+        raise UploadError("Only PDF files are allowed.")
+    if size <= 0 or size > UPLOAD_MAX_SIZE:
+        raise UploadError(f"File size must be between 1 byte and {UPLOAD_MAX_SIZE} bytes.", 413)
+    part_size = part_size or UPLOAD_PART_SIZE
+    if not UPLOAD_MIN_PART_SIZE <= part_size <= UPLOAD_MAX_PART_SIZE:
+        raise UploadError(f"part_size must be between {UPLOAD_MIN_PART_SIZE} and {UPLOAD_MAX_PART_SIZE} bytes.")
+
+    upload_id = uuid.uuid4().hex
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    with open(data_path(upload_id), "wb") as f:
+        f.truncate(size)  # Sparse; parts fill it in at their offsets
+    job_registry.create_upload(upload_id, Path(filename).name, size, part_size)
+    return get_upload(upload_id)
+
+
+def get_upload(upload_id: str) -> dict:
+    upload = job_registry.get_upload(upload_id) if _UPLOAD_ID.match(upload_id) else None
+    if upload is None:
+        raise UploadError(f"Unknown or expired upload '{upload_id}'.", 404)
+    return upload
+
+
+def _write_block(fd: int, block: bytes, offset: int, digest):
+    # Runs in a worker thread; both hashlib and os.pwrite release the GIL
+    digest.update(block)
+    os.pwrite(fd, block, offset)
+
+
+async def write_part(upload: dict, part: int, chunks, expected_sha256: str = None) -> dict:
+    """
+    Streams one part from `chunks` (an async iterator of bytes) to its offset
+    in the data file, hashing it on the way. Re-sending a part overwrites it,
+    so a client can simply retry a part that failed. Every disk and registry
+    call runs in a worker thread, never on the event loop.
+    """
+    if not 0 <= part < part_count(upload):
+        raise UploadError(f"Part {part} is out of range (0-{part_count(upload) - 1}).")
+    expected_length = part_length(upload, part)
+    offset = part * upload["part_size"]
+    digest = hashlib.sha256()
+    received = 0
+    block = bytearray()
+
+    # Until this write succeeds, the part's old contents may be partly overwritten
+    if part in upload["parts"]:
+        await run_in_threadpool(job_registry.forget_upload_part, upload["upload_id"], part)
+    fd = await run_in_threadpool(os.open, data_path(upload["upload_id"]), os.O_WRONLY)
+    try:
+        async for chunk in chunks:
+            received += len(chunk)
+            if received > expected_length:
+                raise UploadError(f"Part {part} must be {expected_length} bytes.")
+            block += chunk
+            if len(block) >= WRITE_BLOCK_SIZE:
+                await run_in_threadpool(_write_block, fd, bytes(block), offset, digest)
+                offset += len(block)
+                block.clear()
+        if block:
+            await run_in_threadpool(_write_block, fd, bytes(block), offset, digest)
+    finally:
+        await run_in_threadpool(os.close, fd)
+
+    if received != expected_length:
+        raise UploadError(f"Part {part} must be {expected_length} bytes, got {received}.")
+    sha256 = digest.hexdigest()
+    if expected_sha256 and expected_sha256.lower() != sha256:
+        raise UploadError(f"Part {part} is corrupted: its SHA-256 doesn't match X-Part-SHA256.", 422)
+    await run_in_threadpool(job_registry.record_upload_part, upload["upload_id"], part, received, sha256)
+    return {"part": part, "size": received, "sha256": sha256}
+
+
+def complete_upload(upload: dict, destination: Path) -> str:
+    """Moves a fully received upload to `destination`. Returns the upload's digest."""
+    missing = missing_parts(upload)
+    if missing:
+        raise UploadError(f"Parts still missing: {missing[:20]}", 409)
+    digest = combined_digest(upload)
+    os.replace(data_path(upload["upload_id"]), destination)
+    job_registry.delete_upload(upload["upload_id"])
+    return digest
+
+
+def abort_upload(upload_id: str):
+    data_path(upload_id).unlink(missing_ok=True)
+    job_registry.delete_upload(upload_id)
+
+
+def purge_expired_uploads() -> int:
+    """Discards uploads older than UPLOAD_TTL. Returns how many were removed."""
+    expired = job_registry.list_expired_uploads(UPLOAD_TTL)
+    for upload_id in expired:
+        abort_upload(upload_id)
+    return len(expired)
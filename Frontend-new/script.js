@@ -10,6 +10,11 @@ const typingIndicatorTemplate = document.getElementById('typing-indicator-templa
 // Load from sessionStorage on page load
 let currentCollectionName = sessionStorage.getItem('activeCollectionName') || null;
 let currentFileName = sessionStorage.getItem('activeFileName') || null;
+// Server-side conversation session, so follow-up questions keep their context
+let currentSessionId = sessionStorage.getItem('activeSessionId') || null;
+// Identifies this page to /chat/prefetch, so only its own questions use what it prefetched
+const clientId = sessionStorage.getItem('clientId') || crypto.randomUUID();
+sessionStorage.setItem('clientId', clientId);
 
 const chatHistory = [{
     role: "model",
@@ -34,6 +39,67 @@ document.addEventListener('DOMContentLoaded', () => {
 let mediaRecorder;
 let audioChunks = [];
 let isRecording = false;
+// Live transcription socket: chunks are streamed while recording, partial text comes back
+let transcribeSocket = null;
+// MediaRecorder emits a chunk this often (ms) while recording
+const RECORDER_TIMESLICE_MS = 250;
+
+// Opens the live transcription socket; resolves to null if it can't connect
+const openTranscribeSocket = () => new Promise((resolve) => {
+    const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+    const params = currentCollectionName ? `?collection_name=${encodeURIComponent(currentCollectionName)}` : '';
+    let socket;
+    try {
+        socket = new WebSocket(`${protocol}//${window.location.host}/ws/transcribe${params}`);
+    } catch (error) {
+        resolve(null);
+        return;
+    }
+    socket.onopen = () => resolve(socket);
+    socket.onerror = () => resolve(null);
+});
+
+// Handles the messages of the live transcription socket.
+// Falls back to uploading the whole clip if the socket fails.
+const handleTranscribeSocket = (socket) => {
+    let finished = false;
+    socket.onmessage = (event) => {
+        const data = JSON.parse(event.data);
+        if (data.type === 'partial') {
+            messageInput.value = data.text;
+        } else if (data.type === 'final') {
+            finished = true;
+            socket.close();
+            const transcribedText = data.text_english;
+            if (!transcribedText || transcribedText.includes("Could not understand audio")) {
+                messageInput.value = '';
+                displayMessage(botMessageTemplate, `**⚠️ ${transcribedText}**`);
+                return;
+            }
+            messageInput.value = transcribedText;
+            sendMessage({ spoken: true });
+        } else if (data.type === 'error') {
+            finished = true;
+            socket.close();
+            console.error('Live transcription error:', data.detail);
+            messageInput.value = '';
+            if (!isRecording) {
+                uploadAudioForTranscription(new Blob(audioChunks, { type: 'audio/webm' }));
+            }
+        }
+    };
+    socket.onclose = () => {
+        if (transcribeSocket === socket) {
+            transcribeSocket = null;
+        }
+        if (!finished && !isRecording) {
+            // Closed before the final text (e.g. server busy): transcribe the clip in one go
+            messageInput.value = '';
+            uploadAudioForTranscription(new Blob(audioChunks, { type: 'audio/webm' }));
+        }
+        finished = true;
+    };
+};
 
 // Function to handle the upload of the recorded audio
 const uploadAudioForTranscription = async (audioBlob) => {
@@ -61,7 +127,7 @@ const uploadAudioForTranscription = async (audioBlob) => {
             return;
         }
         messageInput.value = transcribedText; 
-        sendMessage(); 
+        sendMessage({ spoken: true }); 
 
     } catch (error) {
         chatContainer.removeChild(uploadStatus);
@@ -70,6 +136,29 @@ const uploadAudioForTranscription = async (audioBlob) => {
     }
 };
 
+// --- Citations: "Sources: p. 3–4 (Intro › Methods), p. 7" under an answer ---
+const formatSources = (sources) => {
+    if (!sources || sources.length === 0) return '';
+    const seen = new Set();
+    const labels = [];
+    for (const source of sources) {
+        let label = '';
+        if (source.page_start) {
+            label = source.page_end && source.page_end !== source.page_start
+                ? `p. ${source.page_start}–${source.page_end}`
+                : `p. ${source.page_start}`;
+        }
+        if (source.heading_path) {
+            label += label ? ` (${source.heading_path})` : source.heading_path;
+        }
+        if (label && !seen.has(label)) {
+            seen.add(label);
+            labels.push(label);
+        }
+    }
+    return labels.length ? `\n\n---\n*Sources: ${labels.join('; ')}*` : '';
+};
+
 // --- Function to call your RAG backend (gpt-oss) ---
 const callRAGBackend = async (prompt) => {
     try {
@@ -78,7 +167,10 @@ const callRAGBackend = async (prompt) => {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 message: prompt,
-                collection_name: currentCollectionName 
+                collection_name: currentCollectionName,
+                session_id: currentSessionId,
+                client_id: clientId,
+                citations: true
             })
         });
 
@@ -90,10 +182,15 @@ const callRAGBackend = async (prompt) => {
         const data = await response.json();
         const text = data.answer;
 
+        if (data.session_id) {
+            currentSessionId = data.session_id;
+            sessionStorage.setItem('activeSessionId', currentSessionId);
+        }
+
         if (text) {
             chatHistory.push({ role: "user", parts: [{ text: prompt }] });
             chatHistory.push({ role: "model", parts: [{ text: text }] });
-            return text;
+            return text + formatSources(data.sources);
         } else {
             // This will now be displayed, thanks to our other fix
             return "Sorry, I received an empty response from the RAG backend.";
@@ -105,6 +202,91 @@ const callRAGBackend = async (prompt) => {
     }
 };
 
+// --- Spoken answers: plays the MP3 of each sentence in order as it arrives ---
+const audioQueue = [];
+let audioPlaying = false;
+
+const playNextAudio = () => {
+    if (audioPlaying || audioQueue.length === 0) return;
+    audioPlaying = true;
+    const url = audioQueue.shift();
+    const audio = new Audio(url);
+    const next = () => {
+        URL.revokeObjectURL(url);
+        audioPlaying = false;
+        playNextAudio();
+    };
+    audio.onended = next;
+    audio.onerror = next;
+    audio.play().catch(next);
+};
+
+const queueAudio = (base64Mp3) => {
+    const bytes = Uint8Array.from(atob(base64Mp3), c => c.charCodeAt(0));
+    audioQueue.push(URL.createObjectURL(new Blob([bytes], { type: 'audio/mpeg' })));
+    playNextAudio();
+};
+
+// Calls /chat/speak: the answer arrives sentence by sentence with its audio.
+// onSentence(textSoFar) is called for each sentence; resolves to the full answer.
+const callRAGBackendSpoken = async (prompt, onSentence) => {
+    try {
+        const response = await fetch('/chat/speak', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                message: prompt,
+                collection_name: currentCollectionName,
+                session_id: currentSessionId,
+                client_id: clientId,
+                citations: true
+            })
+        });
+
+        if (!response.ok) {
+            const errorData = await response.json();
+            throw new Error(errorData.detail || `Server error ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let spokenText = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const event = JSON.parse(line);
+                if (event.type === 'sentence') {
+                    queueAudio(event.audio);
+                    spokenText += (spokenText ? ' ' : '') + event.text;
+                    onSentence(spokenText);
+                } else if (event.type === 'done') {
+                    if (event.session_id) {
+                        currentSessionId = event.session_id;
+                        sessionStorage.setItem('activeSessionId', currentSessionId);
+                    }
+                    chatHistory.push({ role: "user", parts: [{ text: prompt }] });
+                    chatHistory.push({ role: "model", parts: [{ text: event.answer }] });
+                    if (!event.answer) return "Sorry, I received an empty response from the RAG backend.";
+                    return event.answer + formatSources(event.sources);
+                } else if (event.type === 'error') {
+                    throw new Error(event.detail);
+                }
+            }
+        }
+        return spokenText || "Sorry, I received an empty response from the RAG backend.";
+
+    } catch (error) {
+        console.error("Error calling RAG backend:", error);
+        return `Sorry, there was an error connecting to the document AI: ${error.message}`;
+    }
+};
+
 // --- Utility function to display messages ---
 const displayMessage = (template, text) => {
     const messageNode = template.cloneNode(true);
@@ -131,19 +313,61 @@ const displayMessage = (template, text) => {
     chatContainer.scrollTop = chatContainer.scrollHeight;
     return messageNode;
 }
+// --- Speculative retrieval while typing ---
+// When the user pauses, the question typed so far is sent to /chat/prefetch, which
+// searches the document in advance. If the question sent is the same (or only
+// drops words from it), /chat/ skips the search and goes straight to the answer.
+const PREFETCH_DEBOUNCE_MS = 400;
+const PREFETCH_MIN_CHARS = 12;
+let prefetchTimer = null;
+let lastPrefetchedText = '';
+
+const schedulePrefetch = () => {
+    clearTimeout(prefetchTimer);
+    const text = messageInput.value.trim();
+    if (!currentCollectionName || text.length < PREFETCH_MIN_CHARS || text === lastPrefetchedText) return;
+    prefetchTimer = setTimeout(() => {
+        lastPrefetchedText = text;
+        fetch('/chat/prefetch', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ message: text, collection_name: currentCollectionName, client_id: clientId })
+        }).catch((error) => console.debug('Prefetch failed:', error)); // Best effort only
+    }, PREFETCH_DEBOUNCE_MS);
+};
+
 // --- sendMessage (This now works correctly) ---
-const sendMessage = async () => {
+// With { spoken: true } (voice input), the answer is also read aloud as it is generated
+const sendMessage = async (options = {}) => {
     const messageText = messageInput.value.trim();
     if (messageText === '') return;
 
     displayMessage(userMessageTemplate, messageText);
     messageInput.value = '';
+    clearTimeout(prefetchTimer);
+    lastPrefetchedText = '';
 
     const typingIndicator = displayMessage(typingIndicatorTemplate);
     
     let botResponseText;
 
-    if (currentCollectionName) {
+    if (currentCollectionName && options.spoken) {
+        // Show the answer as soon as its first sentence is spoken, then the full Markdown at the end
+        let botMessage = null;
+        botResponseText = await callRAGBackendSpoken(messageText, (textSoFar) => {
+            if (!botMessage) {
+                chatContainer.removeChild(typingIndicator);
+                botMessage = displayMessage(botMessageTemplate, textSoFar);
+            } else {
+                botMessage.querySelector('p').innerHTML = marked.parse(textSoFar);
+                chatContainer.scrollTop = chatContainer.scrollHeight;
+            }
+        });
+        if (botMessage) {
+            botMessage.querySelector('p').innerHTML = marked.parse(botResponseText);
+            return;
+        }
+    } else if (currentCollectionName) {
         // If we have a PDF loaded, use the RAG backend
         console.log(`Sending to RAG backend with collection: ${currentCollectionName}`);
         botResponseText = await callRAGBackend(messageText);
@@ -172,15 +396,29 @@ voiceBtn.addEventListener('click', async () => {
             const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
             mediaRecorder = new MediaRecorder(stream, { mimeType: 'audio/webm; codecs=opus' });
             audioChunks = [];
+            transcribeSocket = await openTranscribeSocket();
+            if (transcribeSocket) {
+                handleTranscribeSocket(transcribeSocket);
+            }
 
-            mediaRecorder.ondataavailable = (event) => audioChunks.push(event.data);
+            mediaRecorder.ondataavailable = (event) => {
+                audioChunks.push(event.data);
+                if (transcribeSocket && transcribeSocket.readyState === WebSocket.OPEN) {
+                    transcribeSocket.send(event.data);
+                }
+            };
             mediaRecorder.onstop = () => {
-                const audioBlob = new Blob(audioChunks, { type: 'audio/webm' });
                 stream.getTracks().forEach(track => track.stop());
-                uploadAudioForTranscription(audioBlob); 
+                if (transcribeSocket && transcribeSocket.readyState === WebSocket.OPEN) {
+                    // The last chunk was sent in ondataavailable; the final text follows
+                    transcribeSocket.send('stop');
+                } else {
+                    uploadAudioForTranscription(new Blob(audioChunks, { type: 'audio/webm' }));
+                }
             };
 
-            mediaRecorder.start();
+            // Emit chunks while recording so they are transcribed as the user speaks
+            mediaRecorder.start(RECORDER_TIMESLICE_MS);
             voiceBtn.style.color = 'red';
             isRecording = true;
             //for debugging
@@ -195,6 +433,8 @@ voiceBtn.addEventListener('click', async () => {
 // --- Final Event Listeners ---
 sendBtn.addEventListener('click', sendMessage);
 
+messageInput.addEventListener('input', schedulePrefetch);
+
 messageInput.addEventListener('keydown', (event) => {
     if (event.key === 'Enter') {
         event.preventDefault();
@@ -1,3 +1,90 @@
+// --- Resumable chunked upload (see upload_store.py) ---
+// The file is sent in parts, several at a time. If the upload fails, clicking
+// Upload again with the same file resumes with the parts that are missing.
+const PARALLEL_PARTS = 4;
+const PART_RETRIES = 3;
+
+const responseError = async (response) => {
+    try {
+        const errorData = await response.json();
+        return new Error(errorData.detail || `Server error ${response.status}`);
+    } catch {
+        return new Error(`Server error ${response.status}`);
+    }
+};
+
+const sha256Hex = async (buffer) => {
+    if (!window.crypto || !crypto.subtle) return null; // Only available on https:// and localhost
+    const digest = await crypto.subtle.digest('SHA-256', buffer);
+    return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, '0')).join('');
+};
+
+const uploadKey = (file) => `upload:${file.name}:${file.size}:${file.lastModified}`;
+
+const startOrResumeUpload = async (file) => {
+    const savedId = localStorage.getItem(uploadKey(file));
+    if (savedId) {
+        const response = await fetch(`/uploads/${savedId}`);
+        if (response.ok) return response.json();
+        localStorage.removeItem(uploadKey(file)); // Expired: start over
+    }
+    const response = await fetch('/uploads/', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ filename: file.name, size: file.size })
+    });
+    if (!response.ok) throw await responseError(response);
+    const upload = await response.json();
+    localStorage.setItem(uploadKey(file), upload.upload_id);
+    return upload;
+};
+
+const uploadPart = async (upload, file, part) => {
+    const start = part * upload.part_size;
+    const buffer = await file.slice(start, Math.min(start + upload.part_size, file.size)).arrayBuffer();
+    const headers = {};
+    const digest = await sha256Hex(buffer);
+    if (digest) headers['X-Part-SHA256'] = digest;
+
+    for (let attempt = 1; ; attempt++) {
+        try {
+            const response = await fetch(`/uploads/${upload.upload_id}/parts/${part}`, {
+                method: 'PUT', headers, body: buffer
+            });
+            if (response.ok) return;
+            // Client errors (other than a corrupted part) won't succeed on retry
+            if (response.status < 500 && response.status !== 422) throw await responseError(response);
+            if (attempt >= PART_RETRIES) throw await responseError(response);
+        } catch (error) {
+            if (!(error instanceof TypeError) || attempt >= PART_RETRIES) throw error;
+        }
+        await new Promise(resolve => setTimeout(resolve, 500 * 2 ** attempt));
+    }
+};
+
+// Uploads the file in parts; onProgress(fraction) after each part. Resolves to the server's response.
+const uploadInParts = async (file, onProgress) => {
+    const upload = await startOrResumeUpload(file);
+    const queue = [...upload.missing];
+    let done = upload.received.length;
+    onProgress(done / upload.parts);
+
+    const worker = async () => {
+        while (queue.length > 0) {
+            const part = queue.shift();
+            await uploadPart(upload, file, part);
+            done++;
+            onProgress(done / upload.parts);
+        }
+    };
+    await Promise.all(Array.from({ length: Math.min(PARALLEL_PARTS, queue.length) }, worker));
+
+    const response = await fetch(`/uploads/${upload.upload_id}/complete`, { method: 'POST' });
+    if (!response.ok) throw await responseError(response);
+    localStorage.removeItem(uploadKey(file));
+    return response.json();
+};
+
 document.addEventListener('DOMContentLoaded', () => {
     const pdfInput = document.getElementById('pdf-input');
     const uploadBtn = document.getElementById('upload-btn');
@@ -35,24 +122,10 @@ document.addEventListener('DOMContentLoaded', () => {
         uploadBtn.disabled = true;
         statusMessage.textContent = `Uploading ${file.name}...`;
 
-        const formData = new FormData();
-        formData.append("file", file);
-
         try {
-            const response = await fetch('/upload-pdf/', {
-                method: 'POST',
-                body: formData
+            const data = await uploadInParts(file, (fraction) => {
+                statusMessage.textContent = `Uploading ${file.name}... ${Math.round(fraction * 100)}%`;
             });
-
-            if (!response.ok) {
-                const errorData = await response.json();
-                const errorMessage = errorData.detail || 'Upload failed due to a server error.';
-                statusMessage.textContent = `❌ Upload Failed: ${errorMessage}`;
-                uploadBtn.disabled = false; 
-                return;
-            }
-            
-            const data = await response.json();
             const collectionName = data.collection_name;
 
             if (!collectionName) {
@@ -65,6 +138,7 @@ document.addEventListener('DOMContentLoaded', () => {
             // This will be remembered as long as the tab is open
             sessionStorage.setItem('activeCollectionName', collectionName);
             sessionStorage.setItem('activeFileName', file.name);
+            sessionStorage.removeItem('activeSessionId'); // New document, new conversation
             // --- END MODIFICATION ---
 
             statusMessage.textContent = '✅ Upload successful! Redirecting to chat...';
@@ -74,7 +148,11 @@ document.addEventListener('DOMContentLoaded', () => {
             }, 1500);
 
         } catch (error) {
-            statusMessage.textContent = '⚠️ Network Error: Could not connect to the server.';
+            if (error instanceof TypeError) {
+                statusMessage.textContent = '⚠️ Network Error: Could not connect to the server. Click Upload to resume.';
+            } else {
+                statusMessage.textContent = `❌ Upload Failed: ${error.message}`;
+            }
             console.error('Upload Error:', error);
             uploadBtn.disabled = false; 
         }